@@ -543,7 +543,7 @@ def from_records(records : List[Dict], array_type="arrow", defaults={}) -> vaex.
 
 
 @docsubst
-def from_csv_arrow(file, read_options=None, parse_options=None, convert_options=None, lazy=False, chunk_size="10MiB", newline_readahead="64kiB", schema_infer_fraction=0.01, fs_options={}, fs=None):
+def from_csv_arrow(file, read_options=None, parse_options=None, convert_options=None, lazy=False, chunk_size="10MiB", newline_readahead="64kiB", schema_infer_fraction=0.01, index=None, fs_options={}, fs=None):
     """ Fast CSV reader using Apache Arrow. Support for lazy reading of CSV files (experimental).
 
     :param file: file path or file-like object
@@ -554,13 +554,14 @@ def from_csv_arrow(file, read_options=None, parse_options=None, convert_options=
     :param chunk_size: The CSV is read in chunks of the specified size. Relevant only if lazy=True.
     :param newline_readahead: The size of the readahead buffer for newline detection. Relevant only if lazy=True.
     :param schema_infer_fraction: The fraction of the CSV file to read to infer the schema. Relevant only if lazy=True.
+    :param index: Store the row and byte offsets of the chunks and the schema on disk, so opening the file again is fast, and slices only read the chunks they need. Defaults to `vaex.settings.main.csv.index`. Relevant only if lazy=True.
     :param fs_options: {fs_options}
     :param fs: {fs}
     :return: DataFrame
     """
     import vaex.csv
     if lazy is True:
-        ds = vaex.csv.DatasetCsvLazy(file, chunk_size=chunk_size, read_options=read_options, parse_options=parse_options, convert_options=convert_options, newline_readahead=newline_readahead, schema_infer_fraction=schema_infer_fraction, fs=fs, fs_options=fs_options)
+        ds = vaex.csv.DatasetCsvLazy(file, chunk_size=chunk_size, read_options=read_options, parse_options=parse_options, convert_options=convert_options, newline_readahead=newline_readahead, schema_infer_fraction=schema_infer_fraction, index=index, fs=fs, fs_options=fs_options)
         return vaex.from_dataset(ds)
     else:
         ds = vaex.csv.DatasetCsv(file, read_options=read_options, parse_options=parse_options, convert_options=convert_options, fs=fs, fs_options=fs_options)
@@ -28,6 +28,7 @@ if vaex.utils.has_c_extension:
     import vaex.superagg
 
 _min = min  # we're gonna overwrite builtin min
+_max = max
 aggregates = {}
 
 
@@ -518,6 +519,153 @@ class AggregatorDescriptorKurtosis(AggregatorDescriptorMulti):
         return [task_sum_moment1, task_sum_moment2, task_sum_moment3, task_sum_moment4, task_count], finish(task_sum_moment1, task_sum_moment2, task_sum_moment3, task_sum_moment4, task_count)
 
 
+class AggregatorDescriptorNUniqueApprox(AggregatorDescriptorMulti):
+    """Estimates the number of unique values using a HyperLogLog sketch per bin
+
+    The 2**precision registers of a bin are the maximum of :func:`vaex.functions._hll_rank`, binned by
+    :func:`vaex.functions._hll_register` as an extra (ordinal) dimension, so they are computed (and merged) by the max aggregator.
+    """
+    def __init__(self, name, expression, short_name, precision, dropmissing, dropnan, selection=None, edges=False):
+        super(AggregatorDescriptorNUniqueApprox, self).__init__(name, expression, short_name, selection=selection, edges=edges)
+        if not (4 <= precision <= 18):
+            raise ValueError(f'precision should be between 4 and 18, not {precision}')
+        self.precision = precision
+        self.dropmissing = dropmissing
+        self.dropnan = dropnan
+
+    def add_tasks(self, df, binners, progress):
+        progressbar = vaex.utils.progressbars(progress, title=repr(self))
+        expression = str(df[str(self.expressions[0])])
+        registers = 2**self.precision
+        binner_register = df._binner_ordinal(f'_hll_register({expression}, {self.precision})', registers)
+        max_agg = max(f'_hll_rank({expression}, {self.precision}, {self.dropmissing}, {self.dropnan})', selection=self.selection, edges=self.edges)
+        task = max_agg.add_tasks(df, tuple(binners) + (binner_register,), progress=progressbar)[0][0]
+        self.dtype_in = df[expression].data_type()
+        self.dtype_out = DataType(np.dtype('int64'))
+
+        @vaex.delayed
+        def finish(ranks):
+            # with edges, the register dimension has the missing and out of range bins
+            return _hll_estimate(np.asarray(ranks)[..., :registers])
+        return [task], finish(task)
+
+
+def _hll_estimate(ranks):
+    '''HyperLogLog estimate of the number of unique values, from the registers in the last dimension'''
+    registers = ranks.shape[-1]
+    alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(registers, 0.7213 / (1 + 1.079 / registers))
+    estimate = alpha * registers**2 / np.sum(2.0 ** -ranks.astype(np.float64), axis=-1)
+    zeros = np.sum(ranks == 0, axis=-1)
+    # for small cardinalities, linear counting of the empty registers is more accurate
+    with np.errstate(divide='ignore'):
+        linear = registers * np.log(registers / zeros)
+    estimate = np.where((estimate <= 2.5 * registers) & (zeros > 0), linear, estimate)
+    return np.rint(estimate).astype(np.int64)[()]
+
+
+class AggregatorDescriptorQuantile(AggregatorDescriptorMulti):
+    """Estimates quantiles using a DDSketch per bin
+
+    The sketch of a bin is the count of the values in logarithmically spaced buckets (given by :func:`vaex.functions._ddsketch_bucket`),
+    added as an extra (ordinal) dimension, so they are computed (and merged) by the count aggregator.
+    """
+    def __init__(self, name, expression, short_name, q, relative_accuracy, min_value, max_value, selection=None, edges=False):
+        super(AggregatorDescriptorQuantile, self).__init__(name, expression, short_name, selection=selection, edges=edges)
+        if not (0 <= q <= 1):
+            raise ValueError(f'q should be between 0 and 1, not {q}')
+        if not (0 < relative_accuracy < 1):
+            raise ValueError(f'relative_accuracy should be between 0 and 1, not {relative_accuracy}')
+        if not (0 < min_value < max_value):
+            raise ValueError(f'Expected 0 < min_value < max_value, not {min_value} and {max_value}')
+        self.q = q
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.max_value = max_value
+
+    def __repr__(self):
+        return 'vaex.agg.{}({!r}, {!r})'.format(self.short_name, str(self.expressions[0]), self.q)
+
+    def add_tasks(self, df, binners, progress):
+        progressbar = vaex.utils.progressbars(progress, title=repr(self))
+        expression = str(df[str(self.expressions[0])])
+        gamma, key_min, key_max = vaex.functions._ddsketch_keys(self.relative_accuracy, self.min_value, self.max_value)
+        keys = np.arange(key_min, key_max + 1)
+        # the value of a bucket is within the relative accuracy of all values in the bucket
+        values = 2 * gamma**keys / (gamma + 1)
+        values = np.concatenate([-values[::-1], [0], values])
+        binner_bucket = df._binner_ordinal(f'_ddsketch_bucket({expression}, {self.relative_accuracy!r}, {self.min_value!r}, {self.max_value!r})', len(values))
+        count_agg = count(selection=self.selection, edges=self.edges)
+        task = count_agg.add_tasks(df, tuple(binners) + (binner_bucket,), progress=progressbar)[0][0]
+        self.dtype_in = df[expression].data_type()
+        self.dtype_out = DataType(np.dtype('float64'))
+
+        @vaex.delayed
+        def finish(counts):
+            # with edges, the bucket dimension has the missing and out of range bins
+            counts = np.asarray(counts)[..., :len(values)]
+            return _quantile_from_counts(counts, values, self.q)
+        return [task], finish(task)
+
+
+def _quantile_from_counts(counts, values, q):
+    '''The (lower) quantile, from the counts of the buckets in the last dimension'''
+    cumulative = np.cumsum(counts, axis=-1)
+    total = cumulative[..., -1]
+    rank = np.floor(q * (total - 1))
+    index = np.argmax(cumulative > rank[..., np.newaxis], axis=-1)
+    return np.where(total > 0, values[index], np.nan)[()]
+
+
+class AggregatorDescriptorTopK(AggregatorDescriptor):
+    """The most frequent values per bin, using a bounded summary per bin (see :class:`vaex.cpu.TaskPartTopK`)"""
+    def __init__(self, name, expression, short_name, k, capacity, dropmissing, dropnan, selection=None, edges=False):
+        self.name = name
+        self.short_name = short_name
+        self.expressions = [str(expression)]
+        self.k = k
+        self.capacity = capacity if capacity is not None else _max(1000, 10 * k)
+        if self.capacity < k:
+            raise ValueError(f'capacity ({self.capacity}) should be at least k ({k})')
+        self.dropmissing = dropmissing
+        self.dropnan = dropnan
+        self.selection = _normalize_selection_name(selection)
+        self.edges = edges
+
+    def __repr__(self):
+        return 'vaex.agg.{}({!r}, {!r})'.format(self.short_name, self.expressions[0], self.k)
+
+    def add_tasks(self, df, binners, progress):
+        progressbar = vaex.utils.progressbars(progress)
+        expression = self.expressions[0]
+        self.dtype_in = df[expression].data_type()
+        self.dtype_out = DataType(pa.large_list(self.dtype_in.arrow))
+        task = vaex.tasks.TaskTopK(df, binners, expression, self.capacity, dropnan=self.dropnan, dropmissing=self.dropmissing, selection=self.selection)
+        task = df.executor.schedule(task)
+        progressbar.add_task(task, repr(self))
+        shape = tuple(vaex.cpu._binner_shape(binner) for binner in binners)
+
+        @vaex.delayed
+        def finish(table):
+            bins = table['bin'].to_numpy()
+            starts = np.flatnonzero(np.diff(bins, prepend=-1))
+            positions = np.arange(len(bins)) - np.repeat(starts, np.diff(starts, append=len(bins)))
+            top = positions < self.k
+            bins = bins[top]
+            values = table['value'].filter(pa.array(top)).to_pylist()
+            splits = np.flatnonzero(np.diff(bins)) + 1
+            grid = np.empty(reduce(operator.mul, shape, 1), dtype=object)
+            for i in range(len(grid)):
+                grid[i] = []
+            for bin, start, end in zip(bins[np.r_[0, splits]] if len(bins) else [], np.r_[0, splits], np.r_[splits, len(bins)]):
+                grid[bin] = values[start:end]
+            grid = grid.reshape(shape)
+            if binners and not self.edges:
+                grid = grid[tuple(slice(2, -1) if binner.snake_name == 'scalar' else slice(0, -2) for binner in binners)]
+            # without binners, this gives the list
+            return grid[()]
+        return [task], finish(task)
+
+
 class AggregatorDescriptorStd(AggregatorDescriptorVar):
     def finish(self, value):
         return value**0.5
@@ -611,6 +759,75 @@ def nunique(expression, dropna=False, dropnan=False, dropmissing=False, selectio
         dropmissing = True
     return AggregatorDescriptorNUnique('AggNUnique', [expression], 'nunique', dropmissing, dropnan, selection=selection, edges=edges)
 
+@register
+@docsubst
+def nunique_approx(expression, precision=12, dropna=False, dropnan=False, dropmissing=False, selection=None, edges=False):
+    """Aggregator that estimates the number of unique items per bin using HyperLogLog.
+
+    Unlike :func:`nunique`, which keeps a hash set per bin, this uses a fixed amount of memory per bin
+    (2**precision bytes, per thread for large grids), which makes it suitable for large grids and groupby's with
+    many groups. The relative standard error of the estimate is about 1.04/sqrt(2**precision), e.g. 1.6% for
+    the default precision of 12 (4KB per bin), and 0.8% for a precision of 14 (16KB per bin). Small
+    counts (up to a few times 2**precision) are close to exact.
+
+    :param expression: {expression_one}
+    :param int precision: Number of bits of the hash that select the register, between 4 and 18.
+    :param dropmissing: {dropmissing}
+    :param dropnan: {dropnan}
+    :param dropna: {dropna}
+    :param selection: {selection1}
+    """
+    if dropna:
+        dropnan = True
+        dropmissing = True
+    return AggregatorDescriptorNUniqueApprox('AggNUniqueApprox', [expression], 'nunique_approx', precision, dropmissing, dropnan, selection=selection, edges=edges)
+
+@register
+@docsubst
+def quantile(expression, q=0.5, relative_accuracy=0.01, min_value=1e-9, max_value=1e12, selection=None, edges=False):
+    """Aggregator that estimates the quantile(s) per bin in a single pass, using a DDSketch.
+
+    The values are counted in logarithmically spaced buckets, such that the estimate is within the
+    relative accuracy of the exact (lower) quantile, also for heavy tailed data, without needing the
+    limits of the data. Values with an absolute value smaller than min_value are counted as zero, and
+    values outside of max_value are less accurate. Each bin uses 8*log(max_value/min_value)/relative_accuracy
+    bytes (38KB for the defaults, per thread for large grids), so for large grids, a lower accuracy may be needed.
+    Quantile aggregators of the same expression and selection share the same sketch, e.g. in a groupby:
+
+    >>> df.groupby('id', agg={{'p10': vaex.agg.quantile('E', 0.1), 'p90': vaex.agg.quantile('E', 0.9)}})  # doctest: +SKIP
+
+    :param expression: {expression_one}
+    :param float q: Quantile, between 0 and 1.
+    :param float relative_accuracy: Relative accuracy of the quantiles, between 0 and 1.
+    :param float min_value: Smallest absolute value that is not counted as zero.
+    :param float max_value: Largest absolute value that has the requested relative accuracy.
+    :param selection: {selection1}
+    """
+    return AggregatorDescriptorQuantile('AggQuantile', [expression], 'quantile', q, relative_accuracy, min_value, max_value, selection=selection, edges=edges)
+
+@register
+@docsubst
+def top_k(expression, k=10, capacity=None, dropna=False, dropnan=False, dropmissing=False, selection=None, edges=False):
+    """Aggregator that returns the k most frequent values per bin (most frequent first), using bounded memory.
+
+    Instead of counting all values (like :meth:`Expression.value_counts`), the counts of at most `capacity` values
+    per bin are kept (a Misra-Gries summary). The result is exact when a bin has no more than `capacity` unique values,
+    otherwise all values that occur more than N/(capacity+1) times in a bin (with N the number of values in the bin)
+    are guaranteed to be found.
+
+    :param expression: {expression_one}
+    :param int k: Number of values to return per bin.
+    :param int capacity: Maximum number of values that are counted per bin, defaults to max(1000, 10*k).
+    :param dropmissing: {dropmissing}
+    :param dropnan: {dropnan}
+    :param dropna: {dropna}
+    :param selection: {selection1}
+    """
+    if dropna:
+        dropnan = True
+        dropmissing = True
+    return AggregatorDescriptorTopK('AggTopK', expression, 'top_k', k, capacity, dropmissing, dropnan, selection=selection, edges=edges)
+
 @docsubst
 def any(expression=None, selection=None):
     '''Aggregator that returns True when any of the values in the group are True, or when there is any data in the group that is valid (i.e. not missing values or np.nan).
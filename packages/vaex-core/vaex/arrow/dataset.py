@@ -11,6 +11,7 @@ import pyarrow.parquet as pq
 
 import vaex.dataset
 import vaex.file
+import vaex.zonemap
 from vaex.dataset import DatasetSlicedArrays
 from ..itertools import buffer
 from vaex.multithreading import get_main_io_pool
@@ -43,6 +44,85 @@ class DatasetArrowBase(vaex.dataset.Dataset):
         for name, dictionary in self._partitions.items():
             # TODO: make int32 dependant on the data?
             self._columns[name] = vaex.dataset.ColumnProxy(self, name, pa.dictionary(pa.int32(), dictionary.type))
+        self._zone_maps = {}
+
+    def zone_map(self, column):
+        if column not in self._zone_maps:
+            self._zone_maps[column] = self._create_zone_map(column)
+        return self._zone_maps[column]
+
+    def _create_zone_map(self, column):
+        '''Zone map of the column using the statistics of the row groups (Parquet), or the partition values'''
+        if column not in self._columns:
+            return None
+        type = self._columns[column].dtype
+        if pa.types.is_dictionary(type):
+            type = type.value_type
+        if pa.types.is_timestamp(type) and type.tz is not None:
+            return None
+        if not (pa.types.is_integer(type) or pa.types.is_floating(type) or pa.types.is_temporal(type) or pa.types.is_string(type) or pa.types.is_large_string(type)):
+            return None
+        offsets = [0]
+        mins = []
+        maxs = []
+        null_counts = []
+        for fragment in self._arrow_ds.get_fragments():
+            if column in self._partitions:
+                rows = sum(rg.num_rows for rg in fragment.row_groups) if hasattr(fragment, "row_groups") else fragment.count_rows()
+                value = self._partitions[column][self._partition_keys[fragment.path][column]].as_py()
+                offsets.append(offsets[-1] + rows)
+                mins.append(value)
+                maxs.append(value)
+                null_counts.append(rows if value is None else 0)
+            elif hasattr(fragment, "row_groups"):
+                metadata = fragment.metadata
+                index = metadata.schema.to_arrow_schema().get_field_index(column)
+                for rg in fragment.row_groups:
+                    statistics = (rg.statistics or {}).get(column, {})
+                    offsets.append(offsets[-1] + rg.num_rows)
+                    mins.append(statistics.get('min'))
+                    maxs.append(statistics.get('max'))
+                    column_statistics = metadata.row_group(rg.id).column(index).statistics if index != -1 else None
+                    null_counts.append(column_statistics.null_count if column_statistics is not None else -1)
+            else:
+                offsets.append(offsets[-1] + fragment.count_rows())
+                mins.append(None)
+                maxs.append(None)
+                null_counts.append(-1)
+        known = [value for value in mins + maxs if value is not None]
+        if not known:
+            return None
+        def to_array(values):
+            mask = [value is None for value in values]
+            values = [known[0] if value is None else value for value in values]
+            return np.ma.array(pa.array(values, type=type).to_numpy(zero_copy_only=False), mask=mask)
+        rows = np.diff(offsets)
+        null_counts = np.array(null_counts)
+        # we only know there are no values when all are missing
+        count = np.where(null_counts == rows, 0, -1)
+        return vaex.zonemap.ZoneMap(offsets, to_array(mins), to_array(maxs), null_counts, count)
+
+    def pushdown(self, filter, columns):
+        '''Uses pyarrow to select the fragments (e.g. hive partitions) and row groups (using their statistics) that can pass the filter'''
+        offsets = [0]
+        match = []
+        try:
+            selected = {fragment.path for fragment in self._arrow_ds.get_fragments(filter=filter)}
+            for fragment in self._arrow_ds.get_fragments():
+                if hasattr(fragment, "row_groups"):
+                    row_groups = set()
+                    if fragment.path in selected:
+                        row_groups = {rg.id for rg in fragment.subset(filter, schema=self._arrow_ds.schema).row_groups}
+                    for rg in fragment.row_groups:
+                        offsets.append(offsets[-1] + rg.num_rows)
+                        match.append(rg.id in row_groups)
+                else:
+                    offsets.append(offsets[-1] + fragment.count_rows())
+                    match.append(fragment.path in selected)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError) as e:
+            logger.debug("cannot push down filter %s: %s", filter, e)
+            return None
+        return vaex.zonemap.ZoneMatch(offsets, match)
 
     def leafs(self) -> List[vaex.dataset.Dataset]:
         return [self]
@@ -85,20 +165,20 @@ class DatasetArrowBase(vaex.dataset.Dataset):
         columns_partition = tuple(columns_partition)
 
         for fragment_large in self._arrow_ds.get_fragments():
-            if hasattr(fragment_large, "count_rows"):
-                fragment_large_rows = fragment_large.count_rows()
-                fragments = [fragment_large]
-            else:
+            if hasattr(fragment_large, "split_by_row_group"):
                 fragment_large_rows = sum([rg.num_rows for rg in fragment_large.row_groups])
                 fragments = [fragment_large]
                 # when do we want to split up? File size? max chunk size?
-                if fragment_large_rows > self.max_rows_read:
+                # when we only need a part (e.g. when zone maps let us skip rows), we only read the row groups we need
+                if fragment_large_rows > self.max_rows_read or start > offset or end < offset + fragment_large_rows:
                     fragments = fragment_large.split_by_row_group()
+            else:
+                fragments = [fragment_large]
             for fragment in fragments:
-                if hasattr(fragment_large, "count_rows"):
-                    rows = fragment_large.count_rows()
-                else:
+                if hasattr(fragment, "row_groups"):
                     rows = sum([rg.num_rows for rg in fragment.row_groups])
+                else:
+                    rows = fragment.count_rows()
                 chunk_start = offset
                 chunk_end = offset + rows
 
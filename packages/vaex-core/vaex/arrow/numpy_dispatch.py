@@ -40,6 +40,9 @@ class NumpyDispatch:
             import vaex.arrow.convert
             arrow_array = self._arrow_array
             arrow_array = vaex.arrow.convert.ensure_not_chunked(arrow_array)
+            if pa.types.is_dictionary(arrow_array.type):
+                # e.g. partition columns, we compare the values, not the indices
+                arrow_array = arrow_array.dictionary_decode()
             buffers = arrow_array.buffers()
             # for math, we don't care about the nulls
             if buffers[0] is not None:
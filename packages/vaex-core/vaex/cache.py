@@ -49,10 +49,12 @@ and a second higher latency disk cache that is shared among all processes.
     $ VAEX_CACHE="memory,disk" VAEX_CACHE_DISK_SIZE_LIMIT="10GB" VAEX_CACHE_MEMORY_SIZE_LIMIT="1GB" gunicorn -w 16 app:server
 
 '''
+import collections
 import functools
 from typing import ChainMap, MutableMapping
 import logging
 import shutil
+import tempfile
 import uuid
 import os
 import pickle
@@ -60,6 +62,7 @@ import threading
 
 
 import dask.base
+import numpy as np
 import pyarrow as pa
 from vaex.promise import Promise
 
@@ -131,6 +134,168 @@ class MultiLevelCache(ChainMap):
             del cache[key]
 
 
+def _nbytes(value):
+    if isinstance(value, np.ma.MaskedArray):
+        return value.data.nbytes + np.ma.getmaskarray(value).nbytes
+    return getattr(value, 'nbytes', 0)
+
+
+class ChunkCache(MutableMapping):
+    """LRU cache for chunks of columns, with a byte budget and an optional spill-to-disk tier.
+
+    When the memory budget is exceeded, the least recently used chunks are evicted. If a
+    `path` is given, evicted chunks are written to disk and memory mapped back on access
+    (numpy arrays as .npy files, Arrow arrays as Arrow IPC files), until the disk budget is
+    exceeded as well. Values that cannot be spilled (e.g. object arrays) are simply dropped.
+
+    :param int or str memory_size_limit: Max size in bytes of the chunks kept in memory (or use a string like '1GB'), None means no limit.
+    :param str path: Directory to spill evicted chunks to, None disables spilling.
+    :param int or str disk_size_limit: Max size in bytes of the spilled chunks.
+    """
+    def __init__(self, memory_size_limit=None, path=None, disk_size_limit='10GB'):
+        from dask.utils import parse_bytes
+        self.memory_size_limit = parse_bytes(memory_size_limit) if memory_size_limit is not None else None
+        self.disk_size_limit = parse_bytes(disk_size_limit) if disk_size_limit is not None else None
+        self.path = path
+        self._directory = None
+        self._memory = collections.OrderedDict()
+        self._disk = collections.OrderedDict()  # key -> (paths, nbytes)
+        self.memory_size = 0
+        self.disk_size = 0
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_settings(cls):
+        settings = vaex.settings.cache
+        return cls(settings.column_memory_size_limit, settings.column_disk_path, settings.column_disk_size_limit)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._memory) + len(self._disk)
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._memory) + list(self._disk))
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._memory or key in self._disk
+
+    def __getitem__(self, key):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key][0]
+            paths, nbytes = self._disk[key]
+            self._disk.move_to_end(key)
+            # while holding the lock, the files cannot be evicted
+            return self._load(paths)
+
+    def __setitem__(self, key, value):
+        nbytes = _nbytes(value)
+        with self._lock:
+            if key in self:
+                del self[key]
+            self._memory[key] = (value, nbytes)
+            self.memory_size += nbytes
+            while self.memory_limit_exceeded and self._memory:
+                key_evict, (value_evict, nbytes_evict) = self._memory.popitem(last=False)
+                self.memory_size -= nbytes_evict
+                self._spill(key_evict, value_evict)
+
+    def __delitem__(self, key):
+        with self._lock:
+            if key in self._memory:
+                value, nbytes = self._memory.pop(key)
+                self.memory_size -= nbytes
+            else:
+                paths, nbytes = self._disk.pop(key)
+                self.disk_size -= nbytes
+                self._remove(paths)
+
+    @property
+    def memory_limit_exceeded(self):
+        return self.memory_size_limit is not None and self.memory_size > self.memory_size_limit
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            for paths, nbytes in self._disk.values():
+                self._remove(paths)
+            self._disk.clear()
+            self.memory_size = 0
+            self.disk_size = 0
+
+    def _spill(self, key, value):
+        if self.path is None:
+            return
+        if self._directory is None:
+            os.makedirs(self.path, exist_ok=True)
+            self._directory = tempfile.mkdtemp(prefix='vaex-chunks-', dir=self.path)
+        base = os.path.join(self._directory, uuid.uuid4().hex)
+        try:
+            paths = self._write(base, value)
+        except (TypeError, ValueError, pa.ArrowException) as e:
+            log.debug('cannot spill %r to disk, dropping it: %r', key, e)
+            return
+        if paths is None:
+            return
+        nbytes = sum(os.path.getsize(path) for path in paths)
+        self._disk[key] = (paths, nbytes)
+        self.disk_size += nbytes
+        while self.disk_size_limit is not None and self.disk_size > self.disk_size_limit and self._disk:
+            _, (paths_evict, nbytes_evict) = self._disk.popitem(last=False)
+            self.disk_size -= nbytes_evict
+            self._remove(paths_evict)
+
+    @staticmethod
+    def _write(base, value):
+        if isinstance(value, np.ndarray):
+            if value.dtype.hasobject:
+                return None
+            if isinstance(value, np.ma.MaskedArray):
+                paths = [base + '-data.npy', base + '-mask.npy']
+                np.save(paths[0], value.data, allow_pickle=False)
+                np.save(paths[1], np.ma.getmaskarray(value), allow_pickle=False)
+            else:
+                paths = [base + '.npy']
+                np.save(paths[0], value, allow_pickle=False)
+            return paths
+        elif isinstance(value, (pa.Array, pa.ChunkedArray)):
+            path = base + ('.arrow' if isinstance(value, pa.Array) else '-chunked.arrow')
+            chunks = [value] if isinstance(value, pa.Array) else value.chunks
+            schema = pa.schema([('value', value.type)])
+            with pa.OSFile(path, 'wb') as sink:
+                with pa.ipc.new_file(sink, schema) as writer:
+                    for chunk in chunks:
+                        writer.write_batch(pa.record_batch([chunk], schema=schema))
+            return [path]
+        return None
+
+    @staticmethod
+    def _load(paths):
+        # data is memory mapped, so only the pages we touch will be read
+        if len(paths) == 2:
+            return np.ma.array(np.load(paths[0], mmap_mode='r'), mask=np.load(paths[1], mmap_mode='r'))
+        path, = paths
+        if path.endswith('.npy'):
+            return np.load(path, mmap_mode='r')
+        reader = pa.ipc.open_file(pa.memory_map(path))
+        chunks = [reader.get_batch(i).column(0) for i in range(reader.num_record_batches)]
+        if path.endswith('-chunked.arrow'):
+            return pa.chunked_array(chunks, type=reader.schema.field('value').type)
+        return chunks[0]
+
+    @staticmethod
+    def _remove(paths):
+        # memory mapped arrays that are still in use keep the data alive
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
 @_with_cleanup
 def multilevel_cache(*caches):
     """Sets a multilevel cache, where the first caches should be the fastest (low latency)
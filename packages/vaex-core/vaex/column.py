@@ -359,42 +359,118 @@ class ColumnIndexed(Column):
         start = start or 0
         stop = stop or len(self)
         assert step in [None, 1]
-        indices = self.indices[start:stop]
-        ar_unfiltered = self.column
-        if self.masked:
-            mask = indices == -1
-        if isinstance(ar_unfiltered, Column):
-            # TODO: this is a workaround, since we do not require yet
-            # that Column classes know how to deal with indices, we get
-            # the minimal slice, and get those (not the most efficient)
-            if self.masked:
-                unmasked_indices = indices[~mask]
-                if len(unmasked_indices) > 0:
-                    i1, i2 = np.min(unmasked_indices), np.max(unmasked_indices)
-                else:
-                    i1, i2 = 0, 0
-            else:
-                i1, i2 = np.min(indices), np.max(indices)
-            ar_unfiltered = ar_unfiltered[i1:i2+1]
-            if self.masked:
-                indices = indices - i1
-            else:
-                indices = indices - i1
-        take_indices = indices
-        if self.masked:
+        return Gather(self.indices[start:stop], masked=self.masked).take(self.column)
+
+
+# rows that are less than this number of bytes apart are read as one block
+GATHER_BLOCK_GAP = 64 * 1024
+# when the rows are spread over more blocks, we do not advise the OS per block
+GATHER_ADVISE_MAX = 1024
+
+
+def _mmap_of(ar):
+    '''Returns the mmap object a numpy array is a view of, or None'''
+    import mmap
+    base = ar
+    while isinstance(base, np.ndarray):
+        base = base.base
+    if isinstance(base, memoryview):
+        base = base.obj
+    return base if isinstance(base, mmap.mmap) else None
+
+
+def _take(ar, indices):
+    if isinstance(ar, supported_arrow_array_types):
+        return ar.take(vaex.array_types.to_arrow(indices))
+    else:
+        return ar[indices]
+
+
+class Gather:
+    '''Takes rows from a column in the order of their position, and puts them back in the requested order
+
+    Taking rows in random order (e.g. after a shuffle, sample or sort) from memory mapped or remote
+    data causes random IO, which thrashes the page cache. By sorting the indices once, and reading
+    the rows in order (in blocks of nearby rows), the IO becomes (mostly) sequential. The same Gather
+    can be used for multiple columns with the same indices.
+
+    :param indices: Row numbers to take, -1 for a missing value when masked is True
+    :param masked: If True, negative indices give a masked value
+    '''
+    def __init__(self, indices, masked=False):
+        assert not np.ma.isMaskedArray(indices)
+        indices = np.asarray(indices)
+        self.length = len(indices)
+        self.mask = None
+        if masked:
+            self.mask = indices == -1
             # arrow and numpy do not like the negative indices, so we set them to 0
-            take_indices = indices.copy()
-            take_indices[mask] = 0
-        if isinstance(ar_unfiltered, supported_arrow_array_types):
-            ar = ar_unfiltered.take(vaex.array_types.to_arrow(take_indices))
+            indices = indices.copy()
+            indices[self.mask] = 0
+        if self.length == 0 or np.all(indices[1:] >= indices[:-1]):
+            self.sorted = indices
+            self.inverse = None
         else:
-            ar = ar_unfiltered[take_indices]
-        assert not np.ma.isMaskedArray(indices)
-        if self.masked:
-            # TODO: we probably want to keep this as arrow array if it originally was
-            return np.ma.array(ar, mask=mask)
+            order = np.argsort(indices, kind='stable')
+            self.sorted = indices[order]
+            # where each of the sorted rows should go
+            self.inverse = np.empty_like(order)
+            self.inverse[order] = np.arange(len(order), dtype=order.dtype)
+
+    def blocks(self, itemsize):
+        '''Returns the (start, end) positions in the sorted indices of blocks of nearby rows'''
+        if self.length == 0:
+            return []
+        gap = max(1, GATHER_BLOCK_GAP // max(1, itemsize))
+        splits = np.flatnonzero(np.diff(self.sorted) > gap) + 1
+        starts = np.concatenate([[0], splits])
+        ends = np.concatenate([splits, [self.length]])
+        return list(zip(starts.tolist(), ends.tolist()))
+
+    def take(self, column):
+        if isinstance(column, Column):
+            # we cannot fancy index, so we read the blocks of nearby rows
+            itemsize = column.dtype.itemsize if isinstance(getattr(column, 'dtype', None), np.dtype) else 8
+            parts = []
+            for start, end in self.blocks(itemsize):
+                i1, i2 = self.sorted[start], self.sorted[end - 1]
+                parts.append(_take(column[i1:i2 + 1], self.sorted[start:end] - i1))
+            if not parts:
+                values = column[0:0]
+            elif isinstance(parts[0], supported_arrow_array_types):
+                values = pa.concat_arrays(parts) if len(parts) > 1 else parts[0]
+            else:
+                values = np.ma.concatenate(parts) if np.ma.isMaskedArray(parts[0]) else np.concatenate(parts)
         else:
-            return ar
+            if isinstance(column, np.ndarray):
+                self._advise(column)
+            values = _take(column, self.sorted)
+        if self.inverse is not None:
+            values = _take(values, self.inverse)
+        if self.mask is not None:
+            # TODO: we probably want to keep this as arrow array if it originally was
+            return np.ma.array(values, mask=self.mask)
+        return values
+
+    def _advise(self, ar):
+        '''Tells the OS which pages of a memory mapped array we will need'''
+        import mmap
+        mapping = _mmap_of(ar)
+        if mapping is None or not hasattr(mapping, 'madvise') or not hasattr(mmap, 'MADV_WILLNEED') or ar.ndim != 1 or ar.strides[0] != ar.itemsize:
+            return
+        blocks = self.blocks(ar.itemsize)
+        if len(blocks) > GATHER_ADVISE_MAX:
+            return
+        base = np.frombuffer(mapping, dtype=np.uint8).ctypes.data
+        offset = ar.ctypes.data - base
+        for start, end in blocks:
+            begin = offset + int(self.sorted[start]) * ar.strides[0]
+            length = (int(self.sorted[end - 1]) - int(self.sorted[start]) + 1) * ar.strides[0]
+            aligned = begin - begin % mmap.PAGESIZE
+            try:
+                mapping.madvise(mmap.MADV_WILLNEED, aligned, length + begin - aligned)
+            except (OSError, ValueError):
+                return
 
 
 class ColumnConcatenatedLazy(Column):
@@ -8,10 +8,13 @@ from typing import List
 
 import numpy as np
 import pyarrow as pa
+import pyarrow.compute as pc
 
 import vaex
 import vaex.encoding
 import vaex.array_types
+import vaex.multithreading
+import vaex.settings
 from vaex.hash import counter_type_from_dtype
 from .utils import as_flat_float, as_flat_array, _issequence, _ensure_list
 from .array_types import filter
@@ -66,6 +69,9 @@ class binner_encoding:
 
 class TaskPart:
     stopped = False
+    # when True, get_partial and reduce_partials are implemented, such that the partial results of
+    # each dataset in a concatenation can be cached, see ExecutorLocal._partials
+    cache_partial = False
     def __init__(self, df, expressions, name, pre_filter):
         self.df = df
         self.expressions = expressions
@@ -78,10 +84,19 @@ class TaskPart:
     def memory_usage(self):
         return 0
 
+    def get_partial(self):
+        '''Returns the partial result (after reduce), which can be combined with partial results of other rows'''
+        raise NotImplementedError
+
+    def reduce_partials(self, partials):
+        '''Combines the partial results, such that get_result returns the result of all rows'''
+        raise NotImplementedError
+
 
 @register
 class TaskPartSum(TaskPart):
     snake_name = "sum-test"
+    cache_partial = True
 
     def __init__(self, expression):
         self.total = 0
@@ -100,9 +115,15 @@ class TaskPartSum(TaskPart):
     def process(self, thread_index, i1, i2, filter_mask, selection_masks, blocks):
         self.total += blocks[0].sum()
 
-    def reduce(self, others):
+    def reduce(self, others, thread_pool=None):
         self.total += sum(other.total for other in others)
 
+    def get_partial(self):
+        return self.total
+
+    def reduce_partials(self, partials):
+        self.total = sum(partials)
+
     @classmethod
     def decode(cls, encoding, spec, df):
         return cls(spec['expression'])
@@ -129,7 +150,7 @@ class TaskPartFilterFill(TaskPart):
     def process(self, thread_index, i1, i2, filter_mask, selection_masks, blocks):
         assert filter_mask is not None, f'{filter_mask}'
 
-    def reduce(self, others):
+    def reduce(self, others, thread_pool=None):
         pass
 
     @classmethod
@@ -208,13 +229,16 @@ class TaskPartValueCounts(TaskPart):
             self.counters[thread_index].update(ar)
         return 0
 
-    def reduce(self, others: List["TaskPartValueCounts"]):
+    def reduce(self, others: List["TaskPartValueCounts"], thread_pool=None):
         counters = []
         for other in [self, *others]:
             counters.extend([k for k in other.counters if k is not None])
-        counter = counters[0]
-        for other in counters[1:]:
+
+        def merge(counter, other):
             counter.merge(other)
+            return counter
+        # merging releases the GIL, except for dtype=object
+        counter = vaex.multithreading.tree_reduce(merge, counters, None if self.data_type_item.is_object else thread_pool)
         if self.data_type_item.is_object:
             # for dtype=object we use the old interface
             # since we don't care about multithreading (cannot release the GIL)
@@ -282,6 +306,156 @@ class TaskPartValueCounts(TaskPart):
     def get_result(self):
         return self.result
 
+
+def _binner_shape(binner):
+    # see BinnerScalar and BinnerOrdinal in src/binners.cpp and src/binner_ordinal.cpp
+    if binner.snake_name == 'scalar':
+        return binner.count + 3
+    elif binner.snake_name == 'ordinal':
+        return binner.count + 2
+    else:
+        raise TypeError(f'Binner not supported: {binner}')
+
+
+def _binner_indices(binner, block):
+    '''Bin index of each value, the same as the cpu binner would give'''
+    block = vaex.array_types.to_numpy(block)
+    mask = np.ma.getmaskarray(block) if np.ma.isMaskedArray(block) else None
+    values = np.ma.getdata(block)
+    if values.dtype.kind in 'mM':
+        values = values.view(np.int64)
+    if binner.snake_name == 'scalar':
+        # nan and missing values go to 0, underflow to 1, overflow to the last bin
+        with np.errstate(invalid='ignore'):
+            scaled = (values.astype(np.float64) - binner.minimum) * (1. / (binner.maximum - binner.minimum))
+            indices = np.where(scaled < 0, 1, np.where(scaled >= 1, binner.count + 2, 0))
+            inside = (scaled >= 0) & (scaled < 1)
+            indices[inside] = (scaled[inside] * binner.count).astype(np.int64) + 2
+        if mask is not None:
+            indices[mask] = 0
+    else:
+        # [bin0, ..., binN-1, null, nan], out of range values are null
+        nan = np.isnan(values) if values.dtype.kind == 'f' else None
+        with np.errstate(invalid='ignore'):
+            ordinal = np.nan_to_num(values - binner.minimum).astype(np.int64)
+        indices = np.where(binner.invert, binner.count - 1 - ordinal, ordinal)
+        null = (ordinal < 0) | (ordinal >= binner.count)
+        if mask is not None:
+            null |= mask
+        indices[null] = binner.count
+        if nan is not None:
+            indices[nan] = binner.count + 1
+    return indices
+
+
+@register
+class TaskPartTopK(TaskPart):
+    '''Keeps a mergeable Misra-Gries summary per bin: the counts of at most capacity values
+
+    Each chunk is counted exactly, and merged into the summary. When a bin has more than capacity values,
+    the (capacity+1)-th largest count is subtracted from its counts, and the values with a count of zero or less
+    are dropped. This keeps all values that occur more than N/(capacity+1) times, and their count is
+    underestimated by at most that amount (and exact when there are no more than capacity values in a bin).
+    '''
+    snake_name = "top_k"
+
+    def __init__(self, df, binners, expression, dtype, capacity, dropnan, dropmissing, selection, nthreads):
+        super().__init__(df=df, expressions=[binner.expression for binner in binners] + [expression], pre_filter=df.filtered, name=self.snake_name)
+        self.binners = binners
+        self.shape = tuple(_binner_shape(binner) for binner in binners)
+        self.dtype = dtype
+        self.capacity = capacity
+        self.dropnan = dropnan
+        self.dropmissing = dropmissing
+        self.selection = selection
+        self.selections = [self.selection]
+        self.summaries = [None] * nthreads
+        self.result = None
+
+    @classmethod
+    def decode(cls, encoding, spec, df, nthreads):
+        return cls(
+            df,
+            tuple(encoding.decode_list('binner', spec['binners'])),
+            spec["expression"],
+            encoding.decode("dtype", spec["dtype"]),
+            spec["capacity"],
+            dropnan=spec["dropnan"],
+            dropmissing=spec["dropmissing"],
+            selection=spec["selection"],
+            nthreads=nthreads,
+        )
+
+    def get_bin_count(self):
+        return reduce(operator.mul, self.shape, 1)
+
+    def memory_usage(self):
+        return sum(summary.nbytes for summary in self.summaries if summary is not None)
+
+    def process(self, thread_index, i1, i2, filter_mask, selection_masks, blocks):
+        *blocks_binners, values = blocks
+        bins = np.zeros(len(values), dtype=np.int64)
+        stride = 1
+        for binner, block in list(zip(self.binners, blocks_binners))[::-1]:
+            bins += _binner_indices(binner, block) * stride
+            stride *= _binner_shape(binner)
+        values = vaex.array_types.to_arrow(values)
+        if isinstance(values, pa.ChunkedArray):
+            values = values.combine_chunks()
+        if isinstance(values, pa.DictionaryArray):
+            values = values.dictionary_decode()
+        keep = None
+        if selection_masks and selection_masks[0] is not None:
+            keep = vaex.utils.unmask_selection_mask(vaex.array_types.to_numpy(selection_masks[0]))
+        if self.dropmissing and values.null_count:
+            keep = _combine_masks(keep, values.is_valid().to_numpy(zero_copy_only=False))
+        if self.dropnan and self.dtype.is_float:
+            keep = _combine_masks(keep, ~np.isnan(values.to_numpy(zero_copy_only=False)))
+        if keep is not None:
+            bins = bins[keep]
+            values = values.filter(pa.array(keep))
+        counts = pa.table({'bin': bins, 'value': values}).group_by(['bin', 'value']).aggregate([([], 'count_all')])
+        counts = counts.rename_columns(['bin', 'value', 'count'])
+        self.summaries[thread_index] = self._compact(counts if self.summaries[thread_index] is None else self._merge(self.summaries[thread_index], counts))
+
+    def _merge(self, summary, other):
+        table = pa.concat_tables([summary, other])
+        return table.group_by(['bin', 'value']).aggregate([('count', 'sum')]).rename_columns(['bin', 'value', 'count'])
+
+    def _compact(self, table):
+        '''Sorts the summary by bin and (descending) count, and keeps at most capacity values per bin'''
+        table = table.take(pc.sort_indices(table, [('bin', 'ascending'), ('count', 'descending')]))
+        bins = table['bin'].to_numpy()
+        counts = table['count'].to_numpy()
+        starts = np.flatnonzero(np.diff(bins, prepend=-1))
+        positions = np.arange(len(bins)) - np.repeat(starts, np.diff(starts, append=len(bins)))
+        overflow = positions == self.capacity
+        if not overflow.any():
+            return table
+        thresholds = np.zeros(bins.max() + 1 if len(bins) else 0, dtype=counts.dtype)
+        thresholds[bins[overflow]] = counts[overflow]
+        counts = counts - thresholds[bins]
+        keep = (positions < self.capacity) & (counts > 0)
+        return pa.table({'bin': bins[keep], 'value': table['value'].filter(pa.array(keep)), 'count': counts[keep]})
+
+    def reduce(self, others, thread_pool=None):
+        summaries = []
+        for other in [self, *others]:
+            summaries.extend([summary for summary in other.summaries if summary is not None])
+        if summaries:
+            self.result = vaex.multithreading.tree_reduce(lambda a, b: self._compact(self._merge(a, b)), summaries, thread_pool)
+        else:
+            self.result = pa.table({'bin': pa.array([], pa.int64()), 'value': pa.array([], self.dtype.arrow), 'count': pa.array([], pa.int64())})
+
+    def get_result(self):
+        '''Table with bin (the flat index in the grid), value and count columns, sorted by bin and descending count'''
+        return self.result
+
+
+def _combine_masks(mask, other):
+    return other if mask is None else mask & other
+
+
 @register
 class TaskPartHashmapUniqueCreate(TaskPart):
     snake_name = "hash_map_unique_create"
@@ -360,16 +534,25 @@ class TaskPartHashmapUniqueCreate(TaskPart):
                 self.stopped = True
 
     def ideal_splits(self, nthreads):
-        # TODO, we want to configure this
-        return 1 # nthreads
-
-    def reduce(self, others):
+        # each thread fills its own hash map, which are merged per map in parallel (see HashMapUnique.merge_flat)
+        # but with return_inverse, the values of all chunks refer to a single hash map
+        # and strings (and objects) can only be merged serially
+        if self.return_inverse or self.dtype_item.is_string or self.dtype_item == object:
+            return 1
+        return nthreads if vaex.settings.main.groupby.hash_map_per_thread else 1
+
+    def reduce(self, others, thread_pool=None):
         all = [self] + others
         all = [k.hash_map_unique for k in all if k.hash_map_unique is not None]
-        hash_map_unique_merged, *others = all
         import time
         t0 = time.time()
-        hash_map_unique_merged.merge(others)
+        hash_map_unique_merged = None
+        if len(all) > 1:
+            hash_map_unique_merged = vaex.hash.HashMapUnique.merge_flat(all, thread_pool=thread_pool)
+        flat = hash_map_unique_merged is not None
+        if not flat:
+            hash_map_unique_merged, *others = all
+            hash_map_unique_merged.merge(others)
         logger.info(f'merge took {time.time()-t0} seconds, size {len(hash_map_unique_merged):,}, byte_size {sys.getsizeof(hash_map_unique_merged):,}')
 
         if self.return_inverse:
@@ -379,9 +562,9 @@ class TaskPartHashmapUniqueCreate(TaskPart):
             for i1, i2, values, map_index in self.chunks:
                 length += len(values)
             self.values = np.empty(length, vaex.dtype_of(self.chunks[0][2]).numpy)
-            # TODO: we could do this parallel, but overhead is small
-            for i1, i2, values, map_index in self.chunks:
-                hash_map_unique_merged.flatten_values(values, map_index, self.values[i1:i2])
+            # each chunk writes to its own slice, so we can do this in parallel
+            vaex.multithreading.call_all([lambda values=values, map_index=map_index, i1=i1, i2=i2: hash_map_unique_merged.flatten_values(values, map_index, self.values[i1:i2])
+                                          for i1, i2, values, map_index in self.chunks], thread_pool)
 
         if self.limit is not None:
             count = len(hash_map_unique_merged)
@@ -390,9 +573,12 @@ class TaskPartHashmapUniqueCreate(TaskPart):
                     raise vaex.RowLimitException(f'Resulting set has {count:,} unique combinations, which is larger than the allowed value of {self.limit:,}')
                 else:
                     hash_map_unique_merged = hash_map_unique_merged.limit(self.limit)
-        logger.debug("flatten hashmap...")
-        self.hash_map_unique = hash_map_unique_merged.flatten()
-        logger.debug("flatten hashmap done")
+        if flat:
+            self.hash_map_unique = hash_map_unique_merged
+        else:
+            logger.debug("flatten hashmap...")
+            self.hash_map_unique = hash_map_unique_merged.flatten()
+            logger.debug("flatten hashmap done")
         self.hash_map_unique._internal.fingerprint = f'hash-map-unique-{self.fingerprint}'
 
     @classmethod
@@ -464,7 +650,8 @@ class TaskPartMapReduce(TaskPart):
         else:
             self.values.append(self._map(*blocks))
 
-    def reduce(self, others):
+    def reduce(self, others, thread_pool=None):
+        # python callbacks hold the GIL, so we reduce serially
         # if self.ordered_reduce:
         #     results.sort(key=lambda x: x[0])
         #     results = [k[1] for k in results]
@@ -487,6 +674,7 @@ class TaskPartMapReduce(TaskPart):
 @register
 class TaskPartStatistic(TaskPart):
     snake_name = "legacy_statistic"
+    cache_partial = True
 
     def __init__(self, df, shape, expressions, dtype, selections, op, weights, minima, maxima, edges, selection_waslist):
         self.df = df
@@ -606,11 +794,17 @@ class TaskPartStatistic(TaskPart):
         return i2 - i1
         # return map(self._map, blocks)#[self.map(block) for block in blocks]
 
-    def reduce(self, others):
+    def reduce(self, others, thread_pool=None):
         grids = [self.grid] + [k.grid for k in others]
-        self.grid = self.op.reduce(np.array(grids))
+        self.grid = vaex.multithreading.tree_reduce(lambda a, b: self.op.reduce(np.array([a, b])), grids, thread_pool)
         # If selection was a string, we just return the single selection
 
+    def get_partial(self):
+        return self.grid
+
+    def reduce_partials(self, partials):
+        self.grid = reduce(lambda a, b: self.op.reduce(np.array([a, b])), partials)
+
     def get_result(self):
         return self.grid if self.selection_waslist else self.grid[0]
 
@@ -622,6 +816,16 @@ class TaskPartStatistic(TaskPart):
         return cls(df, **spec)
 
 
+# the results of these aggregators, for different rows, can be combined to the result of all rows
+_partial_reducers = {
+    'AggCount': np.add,
+    'AggSum': np.add,
+    'AggSumMoment': np.add,
+    'AggMin': np.minimum,
+    'AggMax': np.maximum,
+}
+
+
 @register
 class TaskPartAggregation(TaskPart):
     snake_name = "aggregations"
@@ -661,6 +865,7 @@ class TaskPartAggregation(TaskPart):
             selections = _ensure_list(selection)
             initial_values_i = initial_values[i] if initial_values else None
             self.aggregations.append((aggregator_descriptor, selections, list(create_aggregator(aggregator_descriptor, selections, initial_values_i)), selection_waslist))
+        self.cache_partial = all(agg_desc.name in _partial_reducers for agg_desc in self.aggregation_descriptions)
 
     def get_bin_count(self):
         return reduce(lambda prev, binner: len(binner) * prev, self.binners, 1)
@@ -781,20 +986,32 @@ class TaskPartAggregation(TaskPart):
         grid.bin(thread_index, all_aggregators, N)
         self.has_values = True
 
-    def reduce(self, others):
+    def reduce(self, others, thread_pool=None):
+        # each aggregator is independent, and merging them, and reducing their per-thread
+        # grids (in get_result) releases the GIL, so we do this in parallel
+        def reduce_aggregator(agg_desc, agg0, aggs):
+            agg0.merge(aggs)
+            return agg_desc.get_result(agg0)
+        calls = []
         for agg_index, (agg_desc, selections, aggregation, selection_waslist) in enumerate(self.aggregations):
             for selection_index, selection in enumerate(selections):
                 agg0 = aggregation[selection_index]
                 aggs = [other.aggregations[agg_index][2][selection_index] for other in others]
-                agg0.merge(aggs)
+                calls.append(lambda agg_desc=agg_desc, agg0=agg0, aggs=aggs: reduce_aggregator(agg_desc, agg0, aggs))
+        self.grids = vaex.multithreading.call_all(calls, thread_pool)
+
+    def get_partial(self):
+        return self.grids
+
+    def reduce_partials(self, partials):
+        reducers = [_partial_reducers[agg_desc.name] for agg_desc, selections, aggregation, selection_waslist in self.aggregations for selection in selections]
+        self.grids = [reduce(reducer, grids) for reducer, *grids in zip(reducers, *partials)]
 
     def get_result(self):
         results = []
+        grids_iter = iter(self.grids)
         for agg_index, (agg_desc, selections, aggregation, selection_waslist) in enumerate(self.aggregations):
-            grids = []
-            for selection_index, selection in enumerate(selections):
-                grid = agg_desc.get_result(aggregation[selection_index])
-                grids.append(grid)
+            grids = [next(grids_iter) for selection in selections]
             result = np.asarray(grids) if selection_waslist else grids[0]
             if agg_desc.dtype_out.is_primitive or agg_desc.dtype_out.is_temporal:
                 dtype_out = agg_desc.dtype_out.to_native()
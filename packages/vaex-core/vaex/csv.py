@@ -1,5 +1,10 @@
+import base64
 import collections
+import json
+import logging
 import mmap
+import os
+import tempfile
 from typing import Any, Dict, List
 import numpy as np
 
@@ -11,16 +16,22 @@ from frozendict import frozendict
 import vaex.dataset
 import vaex.settings
 import vaex.file
+import vaex.file.compressed
 from vaex.dataset import Dataset, DatasetFile
 from .itertools import pmap, pwait, buffer, consume, filter_none
 from .multithreading import get_main_io_pool
 
 
 MB = 1024**2
+COMPRESSED_EXTENSIONS = ('.csv.gz', '.csv.bgz', '.csv.zst')
+logger = logging.getLogger("vaex.csv")
 
 
-def file_chunks(file, chunk_size, newline_readahead, fs=None, fs_options=None):
-    """Bytes chunks, split by chunk_size bytes, on newline boundaries"""
+def file_chunks(file, chunk_size, newline_readahead, fs=None, fs_options=None, offsets=False):
+    """Bytes chunks, split by chunk_size bytes, on newline boundaries
+
+    With offsets=True, (begin, end, reader) is yielded, where begin and end are the byte offsets of the chunk in the file.
+    """
     offset = 0
     # with open(file, 'rb') as file:\
     file_size = vaex.file.size(file, fs=fs, fs_options=fs_options)
@@ -49,14 +60,20 @@ def file_chunks(file, chunk_size, newline_readahead, fs=None, fs_options=None):
             def reader(data=data, leftover_previous=leftover_previous):
                 chunk = leftover_previous + data
                 return memoryview(chunk)
+            length = len(leftover_previous) + len(data)
             leftover_previous = leftover
-            yield reader
+            if offsets:
+                yield begin_offset, begin_offset + length, reader
+            else:
+                yield reader
+            begin_offset += length
 
 
-def file_chunks_mmap(file, chunk_size, newline_readahead):
+def file_chunks_mmap(file, chunk_size, newline_readahead, offsets=False):
     """Bytes chunks, split by chunk_size bytes, on newline boundaries
     
     Using memory mapping (which avoids a memcpy)
+    With offsets=True, (begin, end, reader) is yielded, where begin and end are the byte offsets of the chunk in the file.
     """
     offset = 0
     with open(file, 'rb') as file:
@@ -93,10 +110,75 @@ def file_chunks_mmap(file, chunk_size, newline_readahead):
             assert length > 0
             def reader(file_offset=begin_offset, length=length):
                 return data[file_offset:file_offset+length]
-            yield reader
+            if offsets:
+                yield begin_offset, end_offset, reader
+            else:
+                yield reader
             begin_offset = end_offset
 
 
+def file_chunks_compressed(file, chunk_size, newline_readahead, offsets=False):
+    """Bytes chunks of a block compressed file, split by chunk_size bytes of uncompressed data, on newline boundaries
+
+    Only the frame at the end of a chunk is decompressed to find the newline, the frames of the chunk
+    itself are decompressed by the reader, so chunks can be decompressed in parallel.
+    With offsets=True, (begin, end, reader) is yielded, where begin and end are the offsets of the chunk in the uncompressed data.
+    """
+    file_size = file.size
+    begin_offset = 0
+    done = False
+    while not done:
+        end_offset = min(file_size, begin_offset + chunk_size)
+        if end_offset < file_size:
+            offset = file.find(b'\n', end_offset, newline_readahead)
+            if offset == -1:
+                raise ValueError(f'Expected a newline within {newline_readahead} bytes, but not found, please increase newline_readahead')
+            end_offset = offset + 1  # include the newline
+        done = end_offset == file_size
+
+        assert end_offset > begin_offset
+        def reader(begin=begin_offset, end=end_offset):
+            return memoryview(file.read(begin, end))
+        if offsets:
+            yield begin_offset, end_offset, reader
+        else:
+            yield reader
+        begin_offset = end_offset
+
+
+def file_chunks_ranges(file, ranges, fs=None, fs_options=None):
+    """Bytes chunks of the byte ranges [(begin, end), ...] of a file, e.g. known from a previous pass"""
+    if isinstance(file, vaex.file.compressed.BlockCompressedFile):
+        for begin, end in ranges:
+            def reader(begin=begin, end=end):
+                return memoryview(file.read(begin, end))
+            yield reader
+    elif fs is None and not fs_options:
+        with open(file, 'rb') as f:
+            f.seek(0, 2)
+            file_size = f.tell()
+            if file_size == 0:
+                return
+            kwargs = {}
+            if vaex.utils.osname == "windows":
+                kwargs["access"] = mmap.ACCESS_READ
+            else:
+                kwargs["prot"] = mmap.PROT_READ
+            data = memoryview(mmap.mmap(f.fileno(), file_size, **kwargs))
+        for begin, end in ranges:
+            def reader(begin=begin, end=end):
+                return data[begin:end]
+            yield reader
+    else:
+        for begin, end in ranges:
+            def reader(begin=begin, end=end):
+                # readers can run in parallel, so each opens the file
+                with vaex.file.open(file, fs=fs, fs_options=fs_options) as f:
+                    f.seek(begin)
+                    return memoryview(f.read(end - begin))
+            yield reader
+
+
 def _row_count(chunk):
     ar = np.frombuffer(chunk, dtype=np.uint8)
     lines = vaex.superutils.count_byte(ar, ord(b'\n'))
@@ -133,16 +215,11 @@ def _get_kwargs(obj):
 @vaex.dataset.register
 class DatasetCsvLazy(DatasetFile):
     snake_name = "arrow-csv-lazy"
-    def __init__(self, path, chunk_size=10*MB, newline_readahead=1*MB, row_count=None, schema=None, read_options=None, parse_options=None, convert_options=None, schema_infer_fraction=0.001, fs=None, fs_options={}):
+    def __init__(self, path, chunk_size=10*MB, newline_readahead=1*MB, row_count=None, schema=None, read_options=None, parse_options=None, convert_options=None, schema_infer_fraction=0.001, index=None, fs=None, fs_options={}):
         super().__init__(path, fs=fs, fs_options=fs_options)
-        try:
-            codec = pa.Codec.detect(self.path)
-        except Exception:
-            codec = None
-        if codec:
-            raise NotImplementedError("We don't support compressed csv files for lazy reading, cannot read file: %s" % self.path)
         self._given_row_count = row_count
         self._row_count = None
+        self._fragment_info = {}
         self._schema = schema
         self.chunk_size = parse_bytes(chunk_size)
         self.newline_readahead = parse_bytes(newline_readahead)
@@ -152,16 +229,33 @@ class DatasetCsvLazy(DatasetFile):
         self.parse_options = parse_options
         self.convert_options = convert_options
         self.schema_infer_fraction = schema_infer_fraction
+        self.index = vaex.settings.main.csv.index if index is None else index
+        try:
+            codec = pa.Codec.detect(self.path)
+        except Exception:
+            codec = None
+        self._compressed = None
+        if codec:
+            # files with independently compressed frames can be read lazily
+            self._compressed = self._open_compressed()
+            if self._compressed is None:
+                raise NotImplementedError("We only support block compressed (BGZF or seekable zstd) csv files for lazy reading, cannot read file: %s" % self.path)
         self._infer_schema()
 
     @classmethod
     def quick_test(cls, path, fs_options={}, fs=None):
         path, options = vaex.file.split_options(path)
-        return path.endswith('.csv')
+        return path.endswith('.csv') or path.endswith(COMPRESSED_EXTENSIONS)
 
     @classmethod
     def can_open(cls, path, fs_options={}, fs=None, group=None, **kwargs):
-        return cls.quick_test(path, fs_options=fs_options, fs=fs)
+        if not cls.quick_test(path, fs_options=fs_options, fs=fs):
+            return False
+        naked_path, options = vaex.file.split_options(path)
+        if naked_path.endswith(COMPRESSED_EXTENSIONS):
+            # only reads a header, the offsets of all frames are read when we open it
+            return vaex.file.compressed.is_block_compressed(path, fs_options=fs_options, fs=fs)
+        return True
 
 
     def _encode(self, encoding):
@@ -180,6 +274,9 @@ class DatasetCsvLazy(DatasetFile):
         state["_row_count"] = self._row_count
         state["_schema"] = self._schema
         state["schema_infer_fraction"] = self.schema_infer_fraction
+        state["index"] = self.index
+        state["_compressed"] = self._compressed
+        state["_fragment_info"] = self._fragment_info
         return state
 
     def __setstate__(self, state):
@@ -228,33 +325,110 @@ class DatasetCsvLazy(DatasetFile):
         return table
 
 
-    def _infer_schema(self):
+    def _index_path(self):
+        fingerprint_file = vaex.file.fingerprint(self.path, fs_options=self.fs_options, fs=self.fs)
+        fp = vaex.cache.fingerprint(fingerprint_file, self.chunk_size, self.newline_readahead, self.read_options, self.parse_options, self.convert_options, self.schema_infer_fraction)
+        return os.path.join(vaex.settings.main.csv.path, f'csv-index-{fp}.json')
+
+    def _load_index(self):
+        path = self._index_path()
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def _open_compressed(self):
+        # the index stores the offsets of the frames, so we do not need to read all block headers
+        index = self._load_index() if self.index else None
+        if index is not None and 'compressed' in index:
+            info = index['compressed']
+            offsets = [np.frombuffer(base64.b64decode(info[name]), dtype='<i8') for name in ['compressed_offsets', 'uncompressed_offsets']]
+            return vaex.file.compressed.BlockCompressedFile(self.path, info['codec'], *offsets, fs_options=self.fs_options, fs=self.fs)
+        return vaex.file.compressed.open(self.path, fs_options=self.fs_options, fs=self.fs)
+
+    def _read_index(self):
+        '''Reads the row and byte offsets of the fragments, and the schema, from the index file, returns False when it does not exist (yet)'''
+        index = self._load_index()
+        if index is None:
+            return False
+        self._column_names = index['column_names']
+        self._fragment_info = {i: fragment_info for i, fragment_info in enumerate(index['fragments'])}
+        self._row_count = index['row_count']
+        if self._schema is None:
+            schema = pa.ipc.read_schema(pa.py_buffer(base64.b64decode(index['schema'])))
+            self._schema = dict(zip(schema.names, schema.types))
+        logger.debug("read index of %s", self.path)
+        return True
+
+    def _write_index(self):
+        path = self._index_path()
+        schema = pa.schema([(name, type) for name, type in self._schema.items()])
+        index = {
+            'path': str(self.path),
+            'column_names': self._column_names,
+            'row_count': self._row_count,
+            'fragments': [self._fragment_info[i] for i in range(len(self._fragment_info))],
+            'schema': base64.b64encode(schema.serialize().to_pybytes()).decode('ascii'),
+        }
+        if self._compressed is not None:
+            index['compressed'] = {
+                'codec': self._compressed.codec,
+                'compressed_offsets': base64.b64encode(self._compressed.compressed_offsets.astype('<i8').tobytes()).decode('ascii'),
+                'uncompressed_offsets': base64.b64encode(self._compressed.uncompressed_offsets.astype('<i8').tobytes()).decode('ascii'),
+            }
+        # write to a temporary file first, so concurrent processes never see a partial index
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, path_tmp = tempfile.mkstemp(prefix='.tmp-', dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(index, f)
+            os.replace(path_tmp, path)
+        finally:
+            if os.path.exists(path_tmp):
+                os.remove(path_tmp)
+        logger.info("wrote index of %s to %s", self.path, path)
+
+    def _file_chunks(self, offsets=False):
+        if self._compressed is not None:
+            return file_chunks_compressed(self._compressed, self.chunk_size, self.newline_readahead, offsets=offsets)
+        elif self.fs is None and not self.fs_options:
+            return file_chunks_mmap(self.path, self.chunk_size, self.newline_readahead, offsets=offsets)
+        else:
+            return file_chunks(self.path, self.chunk_size, self.newline_readahead, fs=self.fs, fs_options=self.fs_options, offsets=offsets)
+
+    def _read_head(self, size):
+        if self._compressed is not None:
+            return self._compressed.read(0, size)
         with vaex.file.open(self.path, fs_options=self.fs_options, fs=self.fs) as f:
-            data = bytes(f.read(self.newline_readahead*3))
-            offset = 0
-            offset = data.find(b'\n', offset) + 1
-            if offset == 0:
-                raise ValueError("Cannot find newline in first %d bytes of file: %s" % (self.newline_readahead*3, self.path))
-            offset = data.find(b'\n', offset) + 1
-            if offset == 0:
-                raise ValueError("Cannot find second newline in first %d bytes of file: %s" % (self.newline_readahead*3, self.path))
-            f_first_two_lines = pa.input_stream(memoryview(data[:offset]))
-            reader = pyarrow.csv.open_csv(f_first_two_lines, read_options=self.read_options, parse_options=self.parse_options, convert_options=self.convert_options)
-            self._arrow_schema = reader.read_next_batch().schema
+            return bytes(f.read(size))
+
+    def _infer_schema(self):
+        if self.index and self._given_row_count is None and self._read_index():
+            self._set_columns()
+            return
+        data = self._read_head(self.newline_readahead*3)
+        offset = 0
+        offset = data.find(b'\n', offset) + 1
+        if offset == 0:
+            raise ValueError("Cannot find newline in first %d bytes of file: %s" % (self.newline_readahead*3, self.path))
+        offset = data.find(b'\n', offset) + 1
+        if offset == 0:
+            raise ValueError("Cannot find second newline in first %d bytes of file: %s" % (self.newline_readahead*3, self.path))
+        f_first_two_lines = pa.input_stream(memoryview(data[:offset]))
+        reader = pyarrow.csv.open_csv(f_first_two_lines, read_options=self.read_options, parse_options=self.parse_options, convert_options=self.convert_options)
+        self._arrow_schema = reader.read_next_batch().schema
         self._column_names = list(self._arrow_schema.names)
 
         self._arrow_schema = None
 
         pool = get_main_io_pool()
         workers = pool._max_workers
-        self._fragment_info = {}
         schemas: Dict[str, List[Any]] = collections.defaultdict(list)
         if self._schema is None and self._given_row_count is None and self._row_count is None:
-            if self.fs is None and not self.fs_options:
-                chunks = file_chunks_mmap(self.path, self.chunk_size, self.newline_readahead)
-            else:
-                chunks = file_chunks(self.path, self.chunk_size, self.newline_readahead, fs=self.fs, fs_options=self.fs_options)
-            def process(i, chunk_reader):
+            chunks = self._file_chunks(offsets=True)
+            self._fragment_info = {}
+            def process(i, chunk):
+                byte_start, byte_end, chunk_reader = chunk
                 data = chunk_reader()
                 if (i % int(1/self.schema_infer_fraction)) == 0:
                     table = self._read_table(data, first=i==0, columns=self._column_names)
@@ -263,7 +437,7 @@ class DatasetCsvLazy(DatasetFile):
                 row_count = _row_count(data)
                 if i == 0:
                     row_count -= 1  # we counted the header (TODO: depends on ReadOptions)
-                self._fragment_info[i] = dict(row_count=row_count)
+                self._fragment_info[i] = dict(row_count=row_count, byte_start=byte_start, byte_end=byte_end)
             consume(pwait(buffer(pmap(process, enumerate(chunks), pool=pool), workers+3)))
             row_start = 0
             for i in range(len(self._fragment_info)):
@@ -272,8 +446,9 @@ class DatasetCsvLazy(DatasetFile):
                 self._fragment_info[i]['row_end'] = row_end
                 row_start = row_end
             self._row_count = row_start
-            pool.map(process, enumerate(chunks))
+            scanned = True
         else:
+            scanned = False
             if self._row_count is None:
                 self._row_count = self._given_row_count
         if self._schema is None:
@@ -285,6 +460,11 @@ class DatasetCsvLazy(DatasetFile):
                 if pa.types.is_null(type):
                     type = pa.int8()
                 self._schema[name] = type
+        if scanned and self.index:
+            self._write_index()
+        self._set_columns()
+
+    def _set_columns(self):
         self._arrow_schema = pa.schema([(name, type) for name, type in self._schema.items()])
 
         self._columns = {name: vaex.dataset.ColumnProxy(self, name, type) for name, type in self._schema.items()}
@@ -295,7 +475,7 @@ class DatasetCsvLazy(DatasetFile):
         raise NotImplementedError
 
     def slice(self, start, end):
-        # TODO: we can be smarter here, and trim off some fragments
+        # when the byte offsets of the fragments are known, the chunk producer only reads the fragments we need
         if start == 0 and end == self.row_count:
             return self
         return vaex.dataset.DatasetSliced(self, start=start, end=end)
@@ -321,11 +501,15 @@ class DatasetCsvLazy(DatasetFile):
         
         first = True
         previous = None
-        if self.fs is None and not self.fs_options:
-            file_chunks_iterator = file_chunks_mmap(self.path, self.chunk_size, self.newline_readahead)
+        fragments = len(self._fragment_info)
+        if fragments and all('byte_start' in self._fragment_info.get(i, {}) for i in range(fragments)) and self._fragment_info[fragments - 1]['row_end'] == self._row_count:
+            # we know where each fragment is in the file, so we seek to the fragments we need
+            indices = [i for i in range(fragments) if self._fragment_info[i]['row_end'] > start and self._fragment_info[i]['row_start'] < end]
+            ranges = [(self._fragment_info[i]['byte_start'], self._fragment_info[i]['byte_end']) for i in indices]
+            file_chunks_iterator = zip(indices, file_chunks_ranges(self._compressed or self.path, ranges, fs=self.fs, fs_options=self.fs_options))
         else:
-            file_chunks_iterator = file_chunks(self.path, self.chunk_size, self.newline_readahead, fs=self.fs, fs_options=self.fs_options)
-        for i, reader in enumerate(file_chunks_iterator):
+            file_chunks_iterator = enumerate(self._file_chunks())
+        for i, reader in file_chunks_iterator:
             fragment_info = self._fragment_info.get(i)
             # bail out/continue early
             if fragment_info:
@@ -34,6 +34,7 @@ import vaex.promise
 import vaex.execution
 import vaex.expresso
 import vaex.tasks
+import vaex.sort
 import logging
 import vaex.kld
 from . import selections, tasks, scopes
@@ -233,6 +234,11 @@ class DataFrame(object):
         :param bool treeshake: Get rid of unused variables before calculating the fingerprint.
         '''
         df = self.copy(treeshake=True) if treeshake else self
+        fp = vaex.cache.fingerprint(self._fingerprint_state(dependencies), df.dataset.fingerprint)
+        return f'dataframe-{fp}'
+
+    def _fingerprint_state(self, dependencies=None):
+        '''The state that goes into the fingerprint of the dataframe, except the dataset'''
         selections = {name: self.get_selection(name) for name, history in self.selection_histories.items() if self.has_selection(name)}
         if dependencies is not None:
             dependencies = set(dependencies)  # copy
@@ -258,8 +264,7 @@ class DataFrame(object):
         )
         # selections can affect the filter, so put them all in
         state['selections'] = {name: selection.to_dict() if selection is not None else None for name, selection in selections.items()}
-        fp = vaex.cache.fingerprint(state, df.dataset.fingerprint)
-        return f'dataframe-{fp}'
+        return state
 
     def __dataframe__(self, nan_as_null : bool = False, allow_copy : bool = True):
         """
@@ -511,7 +516,7 @@ class DataFrame(object):
     # kept for compatibility
     _set = _hash_map_unique
 
-    def _index(self, expression, progress=False, delay=False, prime_growth=False, cardinality=None):
+    def _index(self, expression, progress=False, delay=False, prime_growth=False, cardinality=None, persist=None):
         column = _ensure_string_from_expression(expression)
         # TODO: this does not seem needed
         # column = vaex.utils.valid_expression(self.dataset, column)
@@ -527,6 +532,10 @@ class DataFrame(object):
                 transient = True
 
         dtype = self.data_type(column)
+        if persist is None:
+            persist = vaex.settings.main.index.persist
+        if persist and not self.filtered and vaex.hash.PersistentIndex.supports(dtype):
+            return vaex.hash.PersistentIndex.create(self, column, progress=progress)
         index_type = index_type_from_dtype(dtype, transient, prime_growth=prime_growth)
         import queue
         if cardinality is not None:
@@ -4680,12 +4689,16 @@ class DataFrame(object):
             start = offset
 
     @docsubst
-    def sort(self, by, ascending=True):
+    def sort(self, by, ascending=True, memory_limit=None, progress=None):
         '''Return a sorted DataFrame, sorted by the expression 'by'.
 
         Both 'by' and 'ascending' arguments can be lists.
         Note that missing/nan/NA values will always be pushed to the end, no matter the sorting order.
 
+        When the sort keys do not fit in `memory_limit` bytes (defaults to `vaex.settings.main.sort.memory_limit`),
+        an external merge sort is used: chunks are sorted in parallel and spilled to disk, after which they are merged
+        into a memory mapped array of indices.
+
         {note_copy}
 
         {note_filter}
@@ -4710,6 +4723,8 @@ class DataFrame(object):
 
         :param str or expression or list of str/expressions by: expression to sort by.
         :param bool or list of bools ascending: ascending (default, True) or descending (False).
+        :param str or int memory_limit: Maximum amount of memory (e.g. '1GB' or number of bytes) to use for the sort keys, or None for no limit.
+        :param progress: {progress}
         '''
 
         if len(self) == 0:
@@ -4725,6 +4740,11 @@ class DataFrame(object):
         else:
             ascending = vaex.utils._ensure_list(ascending) * len(by)
 
+        memory_limit = vaex.sort.parse_memory_limit(memory_limit)
+        if memory_limit is not None and len(self) * vaex.sort.estimate_bytes_per_row(self, by) > memory_limit:
+            indices = vaex.sort.sort_indices(self, by, ascending, memory_limit, progress=progress)
+            return self.take(indices)
+
         sort_keys = [(key, 'ascending') if order is True else (key, 'descending') for key, order in zip(by, ascending)]
         pa_table = self[by].to_arrow_table()
         indices = pa.compute.sort_indices(pa_table, sort_keys=sort_keys)
@@ -4913,7 +4933,7 @@ class DataFrame(object):
         return df
 
     @docsubst
-    def materialize(self, column=None, inplace=False, virtual_column=None):
+    def materialize(self, column=None, inplace=False, virtual_column=None, persist=None, progress=None):
         '''Turn columns into native CPU format for optimal performance at cost of memory.
 
         .. warning:: This may use of lot of memory, be mindfull.
@@ -4936,9 +4956,23 @@ class DataFrame(object):
         >>> df.x.sum()  # slow, but will fill the cache
         >>> df.x.sum()  # as fast as possible, will use memory
 
+        Example of a persisted virtual column, that survives a restart:
+
+        >>> df = vaex.open('data.parquet')
+        >>> df['city'] = df.address.str.extract_regex(...)  # expensive
+        >>> df.materialize('city', persist=True)  # evaluated once, and written to disk
+        >>> df.city.value_counts()  # reads the values from disk (also in a new process)
+
+        Persisted virtual columns stay virtual columns, but whenever the same expression is evaluated on
+        the same data, the values are memory mapped from disk. They are stored in the directory
+        given by `vaex.settings.main.materialize.path`, keyed by the fingerprint of the dataset and
+        the expression, so they will not be used when the data changes.
+
         :param column: string or list of strings with column names to materialize, all columns when None
         :param inplace: {inplace}
         :param virtual_column: for backward compatibility
+        :param bool persist: Store virtual columns on disk, defaults to `vaex.settings.main.materialize.persist`
+        :param progress: {progress}
         '''
         if virtual_column is not None:
             warnings.warn("virtual_column argument is deprecated, please use column")
@@ -4958,6 +4992,14 @@ class DataFrame(object):
                 virtual.append(column)
             else:
                 raise NameError(f'{column} is not a column or virtual column')
+        if persist is None:
+            persist = vaex.settings.main.materialize.persist
+        if persist and virtual:
+            progressbar = vaex.utils.progressbars(progress, title="materialize")
+            for name in virtual:
+                vaex.materialized.store(df, name, progress=progressbar.add(f"materialize {name}"))
+            # the virtual columns are kept, their values will be read from disk
+            virtual = []
         dataset = df._dataset
         if cache:
             dataset = vaex.dataset.DatasetCached(dataset, cache)
@@ -5642,18 +5684,24 @@ class DataFrame(object):
         return self._delay(delay, finish(*binners))
 
     @docsubst
-    def rolling(self, window, trim=False, column=None, fill_value=None, edge="right"):
+    def rolling(self, window, trim=False, column=None, fill_value=None, edge="right", on=None, by=None):
         '''Create a :py:data:`vaex.rolling.Rolling` rolling window object
 
-        :param int window: Size of the rolling window.
+        >>> df = vaex.from_arrays(x=[1, 2, 3, 4])
+        >>> df.rolling(2).sum().x.tolist()
+        [1, 3, 5, 7]
+
+        :param int or str window: Size of the rolling window, or a time span (e.g. '10s') when `on` is given.
         :param bool trim: {trim}
         :param str or list[str] column: Column name or column names of columns affected (None for all)
         :param any fill_value: Scalar value to use for data outside of existing rows.
         :param str edge: Where the edge of the rolling window is for the current row.
+        :param str on: Sorted datetime column for time based windows.
+        :param str or list[str] by: Column name(s), the window only contains rows of the same group.
         '''
-        columns = self.get_column_names() if column is None else (column if _issequence(column) else [column])
+        columns = None if column is None else (column if _issequence(column) else [column])
         from .rolling import Rolling
-        return Rolling(self, window, trim=trim, columns=columns, fill_value=fill_value, edge=edge)
+        return Rolling(self, window, trim=trim, columns=columns, fill_value=fill_value, edge=edge, on=on, by=by)
 
 
 DataFrame.__hidden__ = {}
@@ -5880,7 +5928,12 @@ class DataFrameLocal(DataFrame):
             labels = list(range(min_value, max_value+1))
             N = len(labels)
         else:
-            vmin, vmax = df.minmax(column)
+            index = vaex.hash.PersistentIndex.load(df, column) if vaex.settings.main.index.persist else None
+            if index is not None and len(index.keys):
+                # the keys of the index are sorted, so we do not need a pass over the data
+                vmin, vmax = int(index.keys[0]), int(index.keys[-1])
+            else:
+                vmin, vmax = df.minmax(column)
             if labels is None:
                 N = int(vmax + 1)
                 labels = list(range(vmin, vmax+1))
@@ -6674,7 +6727,7 @@ class DataFrameLocal(DataFrame):
         return different_values, missing, type_mismatch, meta_mismatch
 
     @docsubst
-    def join(self, other, on=None, left_on=None, right_on=None, lprefix='', rprefix='', lsuffix='', rsuffix='', how='left', allow_duplication=False, prime_growth=False, cardinality_other=None, inplace=False):
+    def join(self, other, on=None, left_on=None, right_on=None, lprefix='', rprefix='', lsuffix='', rsuffix='', how='left', allow_duplication=False, prime_growth=False, cardinality_other=None, partitions=None, sort_merge=False, inplace=False):
         """Return a DataFrame joined with other DataFrames, matched by columns/expression on/left_on/right_on
 
         If neither on/left_on/right_on is given, the join is done by simply adding the columns (i.e. on the implicit
@@ -6707,6 +6760,11 @@ class DataFrameLocal(DataFrame):
         :param bool allow_duplication: Allow duplication of rows when the joined column contains non-unique values.
         :param int cardinality_other: Number of unique elements (or estimate of) for the other table.
         :param bool prime_growth: Growth strategy for the hashmaps used internally, can improve performance in some case (e.g. integers with low bits unused).
+        :param int partitions: If given, both sides are partitioned on the hash of the key into this number of partitions, which are spilled to disk,
+                and each partition is joined separately (in parallel). This bounds the memory usage when the other DataFrame is too large to be indexed in memory.
+                The spilled rows are buffered and written like :meth:`export_partitioned`, using the same settings (`vaex.settings.main.export_partitioned`) for the memory and the number of open files.
+        :param sort_merge: If True, both DataFrames are assumed to be sorted by the key (e.g. exported with `sort=...`), and instead of building a hash index,
+                the keys are merged, which only needs memory proportional to a chunk. If 'auto', the keys are checked for sortedness first, and the (hash) join is used otherwise.
         :param inplace: {inplace}
         :return:
         """
@@ -6829,7 +6887,8 @@ class DataFrameLocal(DataFrame):
                 self.export_arrow(writer, progress=progress, chunk_size=chunk_size, parallel=parallel, reduce_large=True)
 
     @docsubst
-    def export_partitioned(self, path, by, directory_format='{key}={value}', progress=None, chunk_size=default_chunk_size, parallel=True, fs_options={}, fs=None):
+    def export_partitioned(self, path, by, directory_format='{key}={value}', progress=None, chunk_size=default_chunk_size, parallel=True, fs_options={}, fs=None,
+                           max_open_files=None, memory_limit=None, file_size_limit=None):
         '''Expertimental: export files using hive partitioning.
 
         If no extension is found in the path, we assume parquet files. Otherwise you can specify the
@@ -6842,6 +6901,13 @@ class DataFrameLocal(DataFrame):
           * '/some/dir/{{subdir}}/{{uuid}}.parquet'
           * '/some/dir/{{subdir}}/{{uuid}}.parquet'
 
+        The data is read once: the rows of each chunk are routed to a buffer per partition, which
+        is written to the file of the partition when full. Because the chunks are processed in parallel,
+        the order of the rows within a partition is not guaranteed (unless parallel=False). A partition can
+        be written to multiple files when the limit on open files is reached, or when a file exceeds
+        `file_size_limit`. This requires {{i}} or {{uuid}} in the filename, with a fixed filename the file of
+        each partition stays open until the end (ignoring `max_open_files`), and `file_size_limit` cannot be used.
+
         :param path: directory where to write the files to.
         :param str or list of str: Which column to partition by.
         :param str directory_format: format string for directories, default '{{key}}={{value}}' for Hive layout.
@@ -6849,35 +6915,22 @@ class DataFrameLocal(DataFrame):
         :param int chunk_size: {chunk_size_export}
         :param bool parallel: {evaluate_parallel}
         :param dict fs_options: {fs_options}
+        :param int max_open_files: Maximum number of files that are open at the same time, defaults to `vaex.settings.main.export_partitioned.max_open_files`
+        :param str memory_limit: Maximum memory used to buffer rows (e.g. '1GB'), defaults to `vaex.settings.main.export_partitioned.memory_limit`
+        :param str file_size_limit: Start a new file when a file exceeds this (uncompressed) size (e.g. '1GB'), defaults to `vaex.settings.main.export_partitioned.file_size_limit`
         '''
-        from uuid import uuid4
+        import vaex.partitioned
         if not _issequence(by):
             by = [by]
         by = _ensure_strings_from_expressions(by)
 
-        # we don't store the partitioned columns
-        columns = self.get_column_names()
-        for name in by:
-            columns.remove(name)
-
-        progressbar = vaex.utils.progressbars(progress, title="export(partitioned)")
-        progressbar(0)
-        groups = self.groupby(by)
         _, ext, _ = vaex.file.split_ext(path)
         if not ext:
             path = vaex.file.stringyfy(path) + '/{subdir}/{uuid}.parquet'
         else:
             path = vaex.file.stringyfy(path)
-        for i, (values, df) in enumerate(groups):
-            parts = [directory_format.format(key=key, value=value) for key, value in dict(zip(by, values)).items()]
-            subdir = '/'.join(parts)
-            uuid = uuid4()
-            fullpath = path.format(uuid=uuid, subdir=subdir, i=i)
-            dirpath = os.path.dirname(fullpath)
-            vaex.file.create_dir(dirpath, fs_options=fs_options, fs=fs)
-            progressbar((i)/len(groups))
-            df[columns].export(fullpath, chunk_size=chunk_size, parallel=parallel, fs_options=fs_options, fs=fs)
-        progressbar(1)
+        vaex.partitioned.export_partitioned(self, path, by, directory_format, progress=progress, chunk_size=chunk_size, parallel=parallel, fs_options=fs_options, fs=fs,
+                                            max_open_files=max_open_files, memory_limit=memory_limit, file_size_limit=file_size_limit)
 
     @docsubst
     def export_many(self, path, progress=None, chunk_size=default_chunk_size, parallel=True, max_workers=None, fs_options=None, fs=None, **export_kwargs):
@@ -7119,7 +7172,7 @@ class DataFrameLocal(DataFrame):
     #     # self.signal_selection_changed.emit(self)
 
     @docsubst
-    def groupby(self, by=None, agg=None, sort=False, ascending=True, assume_sparse='auto', row_limit=None, copy=True, progress=None, delay=False):
+    def groupby(self, by=None, agg=None, sort=False, ascending=True, assume_sparse='auto', row_limit=None, copy=True, progress=None, delay=False, partitions=None):
         """Return a :class:`GroupBy` or :class:`DataFrame` object when agg is not None
 
         Examples:
@@ -7178,9 +7231,18 @@ class DataFrameLocal(DataFrame):
         :param bool copy: Copy the dataframe (shallow, does not cost memory) so that the fingerprint of the original dataframe is not modified.
         :param bool delay: {delay}
         :param progress: {progress}
+        :param int partitions: When given, do the groupby out of core: the rows are spilled to disk in this many partitions (by the hash of the keys),
+            and each partition is aggregated separately, such that only the groups of a single partition need to fit in memory.
+            Only supported when grouping by column names, and when agg is given. When not given, and the number of groups does not fit in
+            the memory limit (see `vaex.settings.main.groupby.memory_limit`), this is done automatically. Pass False to always group in memory.
         :return: :class:`DataFrame` or :class:`GroupBy` object.
         """
-        from .groupby import GroupBy
+        from .groupby import GroupBy, groupby_partitioned, _spill_partitions
+        if agg is not None and not delay and row_limit is None:
+            if partitions is None:
+                partitions = _spill_partitions(self, by, agg)
+            if partitions:
+                return groupby_partitioned(self, by, agg, partitions, sort=sort, ascending=ascending, assume_sparse=assume_sparse, progress=progress)
         progressbar = vaex.utils.progressbars(progress, title="groupby")
         groupby = GroupBy(self, by=by, sort=sort, ascending=ascending, combine=assume_sparse, row_limit=row_limit, copy=copy, progress=progressbar)
         if agg:
@@ -7315,6 +7377,12 @@ class BinnerOrdinal(BinnerBase):
         datatype = encoding.encode("dtype", self.dtype)
         return {"type": "ordinal", "expression": self.expression, "dtype": datatype, "count": self.count, "minimum": self.minimum, "invert": self.invert}
 
+    @classmethod
+    def decode(cls, encoding, spec):
+        spec = spec.copy()
+        spec.pop("type", None)
+        return super().decode(encoding, spec)
+
     def __hash__(self) -> int:
         return hash((self.__class__.__name__, self.expression, self.minimum, self.count, self.invert, self.dtype))
 
@@ -14,11 +14,13 @@ from frozendict import frozendict
 import pyarrow as pa
 
 import vaex
+import vaex.cache
 import vaex.execution
+import vaex.multithreading
 import vaex.settings
 import vaex.utils
 from vaex.array_types import data_type
-from .column import Column, ColumnIndexed, supported_column_types
+from .column import Column, ColumnIndexed, Gather, supported_column_types
 from . import array_types
 from vaex import encoding
 try:
@@ -528,6 +530,28 @@ class Dataset(collections.abc.Mapping):
     def chunk_iterator(self, columns, chunk_size=None, reverse=False):
         pass
 
+    def zone_map(self, column):
+        '''Returns statistics per range of rows of a column (a :class:`vaex.zonemap.ZoneMap`), or None when not available'''
+        return None
+
+    def pushdown(self, filter, columns):
+        '''Returns per range of rows if any row can pass the filter (a :class:`vaex.zonemap.ZoneMatch`), or None when not known
+
+        :param filter: A :class:`pyarrow.dataset.Expression`, which may pass more rows than the filter of the DataFrame
+        :param columns: The names of the columns used in the filter
+        '''
+        return None
+
+    def column_origin(self, column):
+        '''Returns a key that identifies the values of a column
+
+        Columns of different datasets (e.g. decorators over the same leafs) with the same key hold the
+        same values, so a column only needs to be read once when passing over these datasets together.
+        '''
+        if column in self._ids:
+            return self._ids[column]
+        return (self.fingerprint, column)
+
     @abstractmethod
     def is_masked(self, column):
         pass
@@ -669,6 +693,18 @@ class DatasetRenamed(DatasetDecorator):
     def is_masked(self, column):
         return self.original.is_masked(self.reverse.get(column, column))
 
+    def zone_map(self, column):
+        return self.original.zone_map(self.reverse.get(column, column))
+
+    def column_origin(self, column):
+        return self.original.column_origin(self.reverse.get(column, column))
+
+    def pushdown(self, filter, columns):
+        if any(column in self.reverse for column in columns):
+            # we cannot rename the fields in an arrow expression, but the zone maps still work
+            return None
+        return self.original.pushdown(filter, columns)
+
     def shape(self, column):
         return self.original.shape(self.reverse.get(column, column))
 
@@ -780,6 +816,23 @@ class DatasetConcatenated(Dataset):
     def shape(self, column):
         return self._shapes[column]
 
+    def zone_map(self, column):
+        zone_maps = [dataset.zone_map(column) if column in dataset else None for dataset in self.datasets]
+        if all(zone_map is None for zone_map in zone_maps):
+            return None
+        import vaex.zonemap
+        dtype = [zone_map for zone_map in zone_maps if zone_map is not None][0].min.dtype
+        zone_maps = [vaex.zonemap.ZoneMap.unknown(dataset.row_count, dtype) if zone_map is None else zone_map for dataset, zone_map in zip(self.datasets, zone_maps)]
+        return vaex.zonemap.ZoneMap.concat(zone_maps)
+
+    def pushdown(self, filter, columns):
+        zone_matches = [dataset.pushdown(filter, columns) if all(column in dataset for column in columns) else None for dataset in self.datasets]
+        if all(zone_match is None for zone_match in zone_matches):
+            return None
+        import vaex.zonemap
+        zone_matches = [vaex.zonemap.ZoneMatch.unknown(dataset.row_count) if zone_match is None else zone_match for dataset, zone_match in zip(self.datasets, zone_matches)]
+        return vaex.zonemap.ZoneMatch.concat(zone_matches)
+
     def _set_row_count(self):
         self._row_count = sum(ds.row_count for ds in self.datasets)
 
@@ -927,9 +980,21 @@ class DatasetTake(DatasetDecorator):
         return ds
 
     def chunk_iterator(self, columns, chunk_size=None, reverse=False):
-        # TODO: we may be able to do this slightly more efficient by first
-        # materializing the columns
-        yield from self._default_chunk_iterator(self._columns, columns, chunk_size, reverse=reverse)
+        # the columns are gathered in parallel, and columns with the same indices share the sorting of the indices
+        # reading a column (e.g. parquet) uses the main io pool, so we should not gather on that pool (it can deadlock)
+        pool = vaex.multithreading.get_gather_pool()
+        for i1, i2, _ in self._default_lazy_chunk_iterator(self._columns, columns, chunk_size, reverse):
+            gathers = {}
+            for name in columns:
+                column = self._columns[name]
+                key = id(column.indices), column.masked
+                if key not in gathers:
+                    gathers[key] = Gather(column.indices[i1:i2], masked=column.masked)
+            def gather(name):
+                column = self._columns[name]
+                return gathers[id(column.indices), column.masked].take(column.column)
+            chunks = vaex.multithreading.call_all([lambda name=name: gather(name) for name in columns], pool)
+            yield i1, i2, dict(zip(columns, chunks))
 
     def slice(self, start, end):
         if start == 0 and end == self.row_count:
@@ -1073,6 +1138,19 @@ class DatasetSliced(DatasetDecorator):
     def chunk_iterator(self, columns, chunk_size=None, reverse=False):
         yield from self.original.chunk_iterator(columns, chunk_size=chunk_size, reverse=reverse, start=self.start, end=self.end)
 
+    def zone_map(self, column):
+        zone_map = self.original.zone_map(column)
+        return None if zone_map is None else zone_map.slice(self.start, self.end)
+
+    def column_origin(self, column):
+        if column in self._ids:
+            return self._ids[column]
+        return (self.original.column_origin(column), self.start, self.end)
+
+    def pushdown(self, filter, columns):
+        zone_match = self.original.pushdown(filter, columns)
+        return None if zone_match is None else zone_match.slice(self.start, self.end)
+
     def hashed(self):
         if set(self._ids) == set(self):
             return self
@@ -1135,6 +1213,19 @@ class DatasetSlicedArrays(DatasetDecorator):
     def chunk_iterator(self, columns, chunk_size=None, reverse=False):
         yield from self._default_chunk_iterator(self._columns, columns, chunk_size, reverse=reverse)
 
+    def zone_map(self, column):
+        zone_map = self.original.zone_map(column)
+        return None if zone_map is None else zone_map.slice(self.start, self.end)
+
+    def column_origin(self, column):
+        if column in self._ids:
+            return self._ids[column]
+        return (self.original.column_origin(column), self.start, self.end)
+
+    def pushdown(self, filter, columns):
+        zone_match = self.original.pushdown(filter, columns)
+        return None if zone_match is None else zone_match.slice(self.start, self.end)
+
     def hashed(self):
         if set(self._ids) == set(self):
             return self
@@ -1188,6 +1279,15 @@ class DatasetDropped(DatasetDecorator):
                 raise KeyError(f'Oops, you tried to get column {column} while it is actually dropped')
         yield from self.original.chunk_iterator(columns, chunk_size=chunk_size, reverse=reverse)
 
+    def zone_map(self, column):
+        return self.original.zone_map(column)
+
+    def column_origin(self, column):
+        return self.original.column_origin(column)
+
+    def pushdown(self, filter, columns):
+        return self.original.pushdown(filter, columns)
+
     def hashed(self):
         if set(self._ids) == set(self):
             return self
@@ -1269,6 +1369,24 @@ class DatasetMerged(Dataset):
         else:
             return self.right.is_masked(column)
 
+    def zone_map(self, column):
+        if column in self.left:
+            return self.left.zone_map(column)
+        else:
+            return self.right.zone_map(column)
+
+    def column_origin(self, column):
+        if column in self.left:
+            return self.left.column_origin(column)
+        else:
+            return self.right.column_origin(column)
+
+    def pushdown(self, filter, columns):
+        for dataset in [self.left, self.right]:
+            if all(column in dataset for column in columns):
+                return dataset.pushdown(filter, columns)
+        return None
+
     def shape(self, column):
         if column in self.left:
             return self.left.shape(column)
@@ -1597,16 +1715,23 @@ class DatasetFile(Dataset):
 
 
 class DatasetCached(DatasetDecorator):
+    """Caches columns in blocks of rows, keyed by fingerprint and row range.
+
+    Blocks are read (and cached) while streaming, so only the columns/blocks that are missing
+    are read from the original dataset. The cache defaults to a shared :class:`vaex.cache.ChunkCache`
+    (see the `cache.column_*` settings) which evicts the least recently used blocks.
+    """
     snake_name = "cached"
-    shared_cache = {}
+    shared_cache = vaex.cache.ChunkCache.from_settings()
 
-    def __init__(self, original, names, cache=None, to_numpy=False):
+    def __init__(self, original, names, cache=None, to_numpy=False, block_size=None):
         super(DatasetCached, self).__init__(original)
         self.original = original
         self.names = names
         self._shared = cache is None or cache is self.shared_cache
         self.cache = cache if cache is not None else self.shared_cache
         self.to_numpy = to_numpy
+        self.block_size = block_size or chunk_size_default
         self._create_columns()
         self._row_count = self.original.row_count
 
@@ -1614,6 +1739,12 @@ class DatasetCached(DatasetDecorator):
     def _fingerprint(self):
         return self.original.fingerprint
 
+    def zone_map(self, column):
+        return self.original.zone_map(column)
+
+    def pushdown(self, filter, columns):
+        return self.original.pushdown(filter, columns)
+
     def _create_columns(self):
         columns = {}
         schema = self.original.schema()
@@ -1629,66 +1760,62 @@ class DatasetCached(DatasetDecorator):
     def _decode(cls, encoding, spec):
         raise NotImplementedError("cannot serialize cache")
 
-    def chunk_iterator(self, columns, chunk_size=None, reverse=False):
-        chunk_size = chunk_size or chunk_size_default
-        columns_all = set(columns)
-        columns_cachable = columns_all & set(self.names)
-        # avoids asking the cache twice, by using .get() and then testing for None
-        columns_cached = {name: self.cache.get(self._cache_key(name)) for name in columns_cachable}
-        columns_cached = {name: array for name, array in columns_cached.items() if array is not None}
-        columns_to_cache = columns_cachable - set(columns_cached)
-        column_required = columns_all - set(columns_cached)
-        cache_chunks = {name: [] for name in columns_to_cache}
-
-        def cached_iterator():
-            chunks_list = [chunks for name, chunks in columns_cached.items()]
-            # chunks_list is of form [[ar1x, ar2x, a3x], [ar1y, ar2y, a3y]]
-            # and now we want to yield
-            #  * i1, i2 {'x': ar1x, 'y': ar1y}
-            #  * i1, i2 {'x': ar2x, 'y': ar2y}
-            #  * i1, i2 {'x': ar3x, 'y': ar3y}
-            names = [name for name, chunks in columns_cached.items()]
-            i1 = 0
-            i2 = 0
-            for chunks in zip(*chunks_list):
-                i2 += len(chunks[0])
-                for chunk in chunks:
-                    assert len(chunk) == len(chunks[0])
-                yield i1, i2, dict(zip(names, chunks))
-                i1 = i2
+    def _block_ranges(self, reverse):
+        ranges = [(i1, min(self.row_count, i1 + self.block_size)) for i1 in range(0, self.row_count, self.block_size)]
+        return ranges[::-1] if reverse else ranges
 
-        if columns_cached:
-            cached_iter = chunk_rechunk(cached_iterator(), chunk_size)
-        else:
-            cached_iter = empty_chunk_iterator(0, self.row_count, chunk_size)
-        if column_required:
-            original_iter = self.original.chunk_iterator(column_required, chunk_size, reverse=reverse)
+    def _block_iterator(self, columns, reverse):
+        columns_cachable = [name for name in columns if name in self.names]
+        columns_other = [name for name in columns if name not in self.names]
+        # non-cachable columns are streamed in lockstep with the blocks
+        if columns_other:
+            original_iter = self.original.chunk_iterator(columns_other, self.block_size, reverse=reverse)
         else:
-            original_iter = empty_chunk_iterator(0, self.row_count, chunk_size)
-        original_iter = list(original_iter)
-        cached_iter = list(cached_iter)
-
-        for (o1, o2, ochunks), (c1, c2, cchunks) in zip(original_iter, cached_iter):
-            assert o1 == c1
-            assert o2 == c2
-            yield o1, o2, {**ochunks, **cchunks}
-            for name in columns_to_cache:
-                if self.to_numpy:
-                    ochunks = {k: vaex.array_types.to_numpy(v) for k, v in ochunks.items()}
-                cache_chunks[name].append(ochunks[name])
-        # we write it too the cache in 1 go
-        for name in columns_to_cache:
-            self.cache[self._cache_key(name)] = cache_chunks[name]
+            original_iter = ((i1, i2, {}) for i1, i2 in self._block_ranges(reverse))
+        for i1, i2, chunks in original_iter:
+            chunks = dict(chunks)
+            columns_missing = []
+            for name in columns_cachable:
+                # avoids asking the cache twice, by using .get() and then testing for None
+                array = self.cache.get(self._cache_key(name, i1, i2))
+                if array is None:
+                    columns_missing.append(name)
+                else:
+                    chunks[name] = array
+            if columns_missing:
+                # only read the columns missing for this block
+                chunk_list = [k for _, _, k in self.original.slice(i1, i2).chunk_iterator(columns_missing, i2 - i1)]
+                chunks_missing = _concat_chunk_list(chunk_list)
+                for name in columns_missing:
+                    array = chunks_missing[name]
+                    if self.to_numpy:
+                        array = vaex.array_types.to_numpy(array)
+                    self.cache[self._cache_key(name, i1, i2)] = array
+                    chunks[name] = array
+            yield i1, i2, chunks
+
+    def chunk_iterator(self, columns, chunk_size=None, reverse=False):
+        chunk_size = chunk_size or chunk_size_default
+        if not set(columns) & set(self.names):
+            yield from self.original.chunk_iterator(columns, chunk_size, reverse=reverse)
+            return
+        if not reverse:
+            yield from chunk_rechunk(self._block_iterator(columns, reverse), chunk_size)
+            return
+        for b1, b2, chunks in self._block_iterator(columns, reverse):
+            for i2 in range(b2, b1, -chunk_size):
+                i1 = max(b1, i2 - chunk_size)
+                yield i1, i2, {name: ar[i1 - b1:i2 - b1] for name, ar in chunks.items()}
 
     def slice(self, start, end):
         if start == 0 and end == self.row_count:
             return self
-        return type(self)(self.original.slice(start, end), self.names, cache=self.cache)
+        return type(self)(self.original.slice(start, end), self.names, cache=self.cache, to_numpy=self.to_numpy, block_size=self.block_size)
 
     def hashed(self):
         if set(self._ids) == set(self):
             return self
-        return type(self)(self.original.hashed(), self.names, cache=self.cache)
+        return type(self)(self.original.hashed(), self.names, cache=self.cache, to_numpy=self.to_numpy, block_size=self.block_size)
 
-    def _cache_key(self, name):
-        return f"{self.fingerprint}-{name}"
+    def _cache_key(self, name, i1, i2):
+        return f"{self.fingerprint}-{name}-{i1}-{i2}"
@@ -2,6 +2,7 @@
 
 import base64
 import io
+import itertools
 import json
 import numbers
 import pickle
@@ -16,6 +17,8 @@ from .datatype import DataType
 
 
 registry = {}
+# smaller blobs are not worth compressing
+COMPRESSION_MIN_SIZE = 1024
 
 
 def register(name):
@@ -130,11 +133,13 @@ class arrow_array_encoding:
     @classmethod
     def encode(cls, encoding, array):
         schema = pa.schema({'x': array.type})
+        # the body of the IPC message is compressed by arrow itself
+        options = pa.ipc.IpcWriteOptions(compression=encoding.compression)
         with pa.BufferOutputStream() as sink:
-            with pa.ipc.new_stream(sink, schema) as writer:
+            with pa.ipc.new_stream(sink, schema, options=options) as writer:
                 writer.write_table(pa.table({'x': array}))
         blob = sink.getvalue()
-        return {'arrow-ipc-blob': encoding.add_blob(blob)}
+        return {'arrow-ipc-blob': encoding.add_blob(blob, compress=False)}
 
     @classmethod
     def decode(cls, encoding, result_encoded):
@@ -337,9 +342,17 @@ class selection_encoding:
 
 
 class Encoding:
-    def __init__(self, next=None):
+    '''Encodes and decodes objects, and keeps the binary blobs that are send next to the json data
+
+    :param compression: Compress blobs with this codec ('lz4' or 'zstd'), None for no compression.
+        Only use this when the receiving side supports it.
+    '''
+    def __init__(self, next=None, compression=None):
         self.registry = {**registry}
         self.blobs = {}
+        self.compression = compression
+        # maps blob id to {'codec': ..., 'size': <uncompressed size>} for compressed blobs
+        self.blob_compression = {}
         # for sharing objects
         self._object_specs = {}
         self._objects = {}
@@ -412,16 +425,28 @@ class Encoding:
         decoded = {key: self.registry[typename].decode(self, value, **kwargs) for key, value in values.items()}
         return decoded
 
-    def add_blob(self, buffer):
-        bytes = memoryview(buffer).tobytes()
-        hasher = vaex.utils.create_hasher(bytes, large_data=True)
+    def add_blob(self, buffer, compress=True):
+        # we keep a view on the buffer, so it should not be modified before it is serialized
+        data = memoryview(buffer)
+        if not data.c_contiguous:
+            data = memoryview(data.tobytes())
+        data = data.cast('B')
+        hasher = vaex.utils.create_hasher(data, large_data=True)
         blob_id = hasher.hexdigest()
-        self.blobs[blob_id] = bytes
+        if compress and self.compression and data.nbytes >= COMPRESSION_MIN_SIZE:
+            compressed = pa.compress(data, codec=self.compression, asbytes=True)
+            if len(compressed) < data.nbytes:
+                self.blob_compression[blob_id] = {'codec': self.compression, 'size': data.nbytes}
+                data = memoryview(compressed)
+        self.blobs[blob_id] = data
         return f'blob:{blob_id}'
 
     def get_blob(self, blob_ref):
         assert blob_ref.startswith('blob:')
         blob_id = blob_ref[5:]
+        if blob_id in self.blob_compression:
+            info = self.blob_compression.pop(blob_id)
+            self.blobs[blob_id] = pa.decompress(self.blobs[blob_id], decompressed_size=info['size'], codec=info['codec'], asbytes=True)
         return self.blobs[blob_id]
 
 
@@ -430,62 +455,132 @@ class inline:
     def serialize(data, encoding):
         import base64
         blobs = {key: base64.b64encode(value).decode('ascii') for key, value in encoding.blobs.items()}
-        return json.dumps({'data': data, 'blobs': blobs})
+        data = {'data': data, 'blobs': blobs}
+        if encoding.blob_compression:
+            data['blob_compression'] = encoding.blob_compression
+        return json.dumps(data)
 
     @staticmethod
     def deserialize(data, encoding):
         data = json.loads(data)
         encoding.blobs = {key: base64.b64decode(value.encode('ascii')) for key, value in data['blobs'].items()}
+        encoding.blob_compression = data.get('blob_compression', {})
         return data['data']
 
 
-def _pack_blobs(*blobs):
+def _blobs_header(blobs):
     count = len(blobs)
-    lenghts = [len(blob) for blob in blobs]
-    stream = io.BytesIO()
+    lenghts = [memoryview(blob).nbytes for blob in blobs]
     # header: <number of blobs>,<offset 0>, ... <offset N-1> with 8 byte unsigned ints
     header_length = 8 * (2 + count)
     offsets = (np.cumsum([0] + lenghts) + header_length).tolist()
-    stream.write(struct.pack(f'{count+2}q', count, *offsets))
-    for blob in blobs:
-        stream.write(blob)
-    bytes = stream.getvalue()
-    assert offsets[-1] == len(bytes)
-    return bytes
+    return struct.pack(f'{count+2}q', count, *offsets)
 
 
-def _unpack_blobs(bytes):
-    stream = io.BytesIO(bytes)
+def _pack_blobs(*blobs):
+    return b''.join([_blobs_header(blobs), *blobs])
+
 
-    count, = struct.unpack('q', stream.read(8))
-    offsets = struct.unpack(f'{count+1}q', stream.read(8 * (count + 1)))
-    assert offsets[-1] == len(bytes)
+def _unpack_blobs(bytes):
+    # slices of a memoryview do not copy the data
+    data = memoryview(bytes).cast('B')
+    count, = struct.unpack_from('q', data, 0)
+    offsets = struct.unpack_from(f'{count+1}q', data, 8)
+    assert offsets[-1] == len(data)
     blobs = []
     for i1, i2 in zip(offsets[:-1], offsets[1:]):
-        blobs.append(bytes[i1:i2])
+        blobs.append(data[i1:i2])
     return blobs
 
 
 class binary:
     @staticmethod
-    def serialize(data, encoding):
+    def serialize_buffers(data, encoding):
+        '''Like serialize, but returns a list of buffers that form the message, without copying the blobs'''
         blob_refs = list(encoding.blobs.keys())
         blobs = [encoding.blobs[k] for k in blob_refs]
-        json_blob = json.dumps({'data': data, 'blob_refs': blob_refs, 'objects': encoding._object_specs})
-        return _pack_blobs(json_blob.encode('utf8'), *blobs)
+        json_data = {'data': data, 'blob_refs': blob_refs, 'objects': encoding._object_specs}
+        if encoding.blob_compression:
+            json_data['blob_compression'] = encoding.blob_compression
+        json_blob = json.dumps(json_data).encode('utf8')
+        return [_blobs_header([json_blob, *blobs]), json_blob, *blobs]
+
+    @staticmethod
+    def serialize(data, encoding):
+        '''Returns the message as a single bytes object, which copies the blobs once (see serialize_buffers)'''
+        return b''.join(binary.serialize_buffers(data, encoding))
 
     @staticmethod
     def deserialize(data, encoding):
         json_data, *blobs = _unpack_blobs(data)
-        json_data = json_data.decode('utf8')
-        json_data = json.loads(json_data)
+        json_data = json.loads(bytes(json_data).decode('utf8'))
         data = json_data['data']
         encoding.blobs = {key: blob for key, blob in zip(json_data['blob_refs'], blobs)}
+        encoding.blob_compression = json_data.get('blob_compression', {})
         if 'objects' in json_data:  # for backwards compatibility, otherwise we might not be able to parse old msg'es
             encoding._object_specs = json_data['objects']
         return data
 
 
+class frames:
+    '''Splits a serialized message in frames of a maximum size, so large results can be streamed
+
+    Each frame starts with a header of 4 little endian 8 byte ints: -1 (which distinguishes it
+    from a non-framed message, which starts with the number of blobs), the stream id, the offset
+    of the frame in the message, and the total size of the message.
+    '''
+    HEADER = struct.Struct('<qqqq')
+    _stream_ids = itertools.count()
+
+    @staticmethod
+    def serialize(data, encoding, frame_size):
+        '''Yields frames, only the parts of the blobs in a frame are copied'''
+        buffers = [memoryview(k).cast('B') for k in binary.serialize_buffers(data, encoding)]
+        total = sum(k.nbytes for k in buffers)
+        stream_id = next(frames._stream_ids)
+        offset = 0
+        parts = []
+        part_size = 0
+        for buffer in buffers:
+            while buffer.nbytes:
+                part = buffer[:frame_size - part_size]
+                buffer = buffer[part.nbytes:]
+                parts.append(part)
+                part_size += part.nbytes
+                if part_size == frame_size:
+                    yield b''.join([frames.HEADER.pack(-1, stream_id, offset, total), *parts])
+                    offset += part_size
+                    parts = []
+                    part_size = 0
+        if parts:
+            yield b''.join([frames.HEADER.pack(-1, stream_id, offset, total), *parts])
+
+    @staticmethod
+    def is_frame(data):
+        return len(data) >= frames.HEADER.size and struct.unpack_from('<q', data, 0)[0] == -1
+
+
+class FrameAssembler:
+    '''Collects frames (see :class:`frames`), and returns the message when all frames are received'''
+    def __init__(self):
+        self.streams = {}
+
+    def add(self, frame):
+        '''Returns the complete message, or None when frames are missing'''
+        frame = memoryview(frame).cast('B')
+        marker, stream_id, offset, total = frames.HEADER.unpack_from(frame, 0)
+        assert marker == -1
+        if stream_id not in self.streams:
+            self.streams[stream_id] = [bytearray(total), 0]
+        stream = self.streams[stream_id]
+        data = frame[frames.HEADER.size:]
+        stream[0][offset:offset + data.nbytes] = data
+        stream[1] += data.nbytes
+        if stream[1] == total:
+            del self.streams[stream_id]
+            return stream[0]
+
+
 def fingerprint(typename, object):
     '''Use the encoding framework to calculate a fingerprint'''
     encoding = vaex.encoding.Encoding()
@@ -17,12 +17,16 @@ import numpy as np
 
 import vaex.asyncio
 import vaex.cpu  # force registration of task-part-cpu
+import vaex.dataset
 import vaex.encoding
 import vaex.memory
 import vaex.multithreading
+import vaex.scopes
 import vaex.vaexfast
 import vaex.events
 import vaex.settings
+import vaex.materialized
+import vaex.zonemap
 
 try:
     # support py 36 for the moment
@@ -40,17 +44,45 @@ class UserAbort(Exception):
         super(UserAbort, self).__init__(reason)
 
 
+class _Leaf:
+    '''A dataset in a concatenation, with the rows it covers, and the (cached) partial result per task'''
+    def __init__(self, start, end, keys, partials):
+        self.start = start
+        self.end = end
+        self.keys = keys
+        self.partials = partials
+
+
 class Run:
     def __init__(self, tasks):
         self.tasks = tasks
         self.cancelled = False
-        dataset = self.tasks[0].df.dataset
-        if self.tasks[0].df._index_start != 0 or self.tasks[0].df._index_end != dataset.row_count:
-            dataset = dataset.slice(self.tasks[0].df._index_start, self.tasks[0].df._index_end)
+        # expressions (and virtual columns) that are materialized on disk are read from the stored column
+        self.materialized = {}
+        columns_materialized = {}
+        for task in tasks:
+            if task.df not in self.materialized:
+                expressions = set(expression for task_df in tasks if task_df.df is task.df for expression in task_df.expressions_all)
+                self.materialized[task.df], columns = vaex.materialized.lookup(task.df, expressions)
+                columns_materialized.update(columns)
+        # views (e.g. filtered copies) can have different datasets that are decorators over the same leafs
+        self.datasets = {}
+        datasets = []
         for task in tasks:
             assert self.tasks[0].df._index_start == task.df._index_start
             assert self.tasks[0].df._index_end == task.df._index_end
-        self.dataset = dataset
+            if task.df not in self.datasets:
+                dataset = next((k for k in datasets if k == task.df.dataset), task.df.dataset)
+                if dataset not in datasets:
+                    datasets.append(dataset)
+                self.datasets[task.df] = dataset
+        for df, dataset in self.datasets.items():
+            dataset = vaex.materialized.merged(dataset, columns_materialized)
+            if df._index_start != 0 or df._index_end != dataset.row_count:
+                dataset = dataset.slice(df._index_start, df._index_end)
+            self.datasets[df] = dataset
+        self.dataset = self.datasets[self.tasks[0].df]
+        self.shared = len(datasets) > 1
         self.pre_filter_per_df = {}
         self.expressions = list(set(expression for task in tasks for expression in task.expressions_all))
         self.tasks_per_df = dict()
@@ -76,8 +108,11 @@ class Run:
         self.filter_deps = {}
         self.selection_deps = {}
         self.expression_deps = {}
+        # expressions are compiled once per pass, and shared by all chunks
+        self.expression_plans = {}
 
         for df in dfs:
+            dataset = self.datasets[df]
             self.filter_deps[df] = set()
             self.selection_deps[df] = set()
             self.expression_deps[df] = set()
@@ -85,11 +120,15 @@ class Run:
             tasks_df = [task for task in tasks if task.df == df]
             expressions = list(set(expression for task in tasks_df for expression in task.expressions_all))
             selections = list(set(selection for task in tasks_df for selection in task.selections))
+            self.expression_plans[df] = vaex.scopes.plan(df, expressions)
             variables = set()
             for expression in expressions:
-                variables |= df._expr(expression).expand().variables(ourself=True)
+                if self.materialized[df]:
+                    variables |= vaex.materialized.dependencies(df, expression, self.materialized[df])
+                else:
+                    variables |= df._expr(expression).expand().variables(ourself=True)
             for var in variables:
-                if var not in self.dataset:
+                if var not in dataset:
                     if var not in others:
                         raise RuntimeError(f'Oops, requesting column {var} from dataset, but it does not exist')
                     else:
@@ -102,7 +141,7 @@ class Run:
             if df.filtered:
                 variables = df.get_selection(vaex.dataframe.FILTER_SELECTION_NAME).dependencies(df)
                 for var in variables:
-                    if var not in self.dataset:
+                    if var not in dataset:
                         if var not in others:
                             raise RuntimeError(f'Oops, requesting column {var} from dataset, but it does not exist')
                         else:
@@ -115,7 +154,7 @@ class Run:
                 if selection is not None:
                     variables |= df._selection_expression(selection).dependencies()
             for var in variables:
-                if var not in self.dataset:
+                if var not in dataset:
                     if var not in others:
                         raise RuntimeError(f'Oops, requesting column {var} from dataset, but it does not exist')
                     else:
@@ -126,6 +165,25 @@ class Run:
 
         logger.debug('Using columns %r from dataset', self.dataset_deps)
 
+        # with multiple datasets, we read each column once, from the first dataset that has it
+        # the chunks are keyed by the origin of the column, and mapped back to names per dataframe
+        self.sources = []
+        self.columns = {}
+        if self.shared:
+            sources = {}
+            origins = set()
+            for df in dfs:
+                dataset = self.datasets[df]
+                self.columns[df] = {}
+                for name in self.expression_deps[df] | self.filter_deps[df] | self.selection_deps[df]:
+                    origin = dataset.column_origin(name)
+                    if origin not in origins:
+                        origins.add(origin)
+                        sources.setdefault(dataset, {})[name] = origin
+                    self.columns[df][name] = origin
+            self.sources = list(sources.items()) or [(self.dataset, {})]
+            logger.debug('Sharing a pass over %d datasets, reading from %d', len(datasets), len(self.sources))
+
 
 def _merge(tasks):
     dfs = set()
@@ -199,6 +257,15 @@ class Executor:
         async def auto_execute(self):
             raise NotImplemented('Only on Python >3.7')
 
+    def scheduler_for(self, row_count, chunk_size):
+        settings = vaex.settings.main.chunk
+        # only when the chunk size is not fixed, we are free to split the chunks
+        adaptive = self.adaptive and self.chunk_size is None and settings.size is None
+        chunk_size_min = self.chunk_size_min or settings.size_min
+        chunk_size_max = self.chunk_size_max or settings.size_max
+        return vaex.multithreading.ChunkScheduler(self.thread_pool.nthreads, row_count, chunk_size, chunk_size_min, chunk_size_max,
+                                                  adaptive=adaptive, prefetch=settings.prefetch if adaptive else 0)
+
     async def execute_async(self):
         raise NotImplementedError
 
@@ -248,33 +315,46 @@ class Executor:
             if len(self.tasks) == 0:
                 return []
             else:
-                dataset = self.tasks[0].df.dataset
-                i1, i2 = self.tasks[0].df._index_start, self.tasks[0].df._index_end
-                # if we have the same dataset *AND* we want to have the same slice out of it
-                # we can share it in in single pass over the dataset
-                def shares_dataset(df, i1=i1, i2=i2, dataset=dataset):
-                    return dataset == df.dataset and i1 == df._index_start and i2 == df._index_end
-
-                tasks = [task for task in self.tasks if shares_dataset(task.df)]
+                df = self.tasks[0].df
+                tasks = [task for task in self.tasks if self._shares_pass(df, task.df)]
                 logger.info("executing tasks in run: %r", tasks)
                 for task in tasks:
                     self.tasks.remove(task)
                 return tasks
 
+    def _shares_pass(self, df, other):
+        # if we have the same dataset *AND* we want to have the same slice out of it
+        # we can share it in in single pass over the dataset
+        return df.dataset == other.dataset and df._index_start == other._index_start and df._index_end == other._index_end
+
 
 class ExecutorLocal(Executor):
-    def __init__(self, thread_pool=None, chunk_size=None, chunk_size_min=None, chunk_size_max=None, thread_mover=None, zigzag=True):
+    def __init__(self, thread_pool=None, chunk_size=None, chunk_size_min=None, chunk_size_max=None, thread_mover=None, zigzag=True, adaptive=None):
         super().__init__()
         self.thread_pool = thread_pool or vaex.multithreading.ThreadPoolIndex()
         self.chunk_size = chunk_size
         self.chunk_size_min = chunk_size_min
         self.chunk_size_max = chunk_size_max
+        self.adaptive = vaex.settings.main.chunk.adaptive if adaptive is None else adaptive
+        self.thread_utilization = []  # fraction of the wall time each thread was busy in the last pass
         self.thread = None
         self.passes = 0  # how many times we passed over the data
         self.zig = True  # zig or zag
         self.zigzag = zigzag
         self.event_loop = asyncio.new_event_loop()
 
+    def _shares_pass(self, df, other):
+        if super()._shares_pass(df, other):
+            return True
+        # different datasets over the same leafs (e.g. after adding or renaming columns) can share a
+        # pass, in which we read each column only once
+        if not vaex.settings.main.shared_pass:
+            return False
+        if df._index_start != other._index_start or df._index_end != other._index_end or df.dataset.row_count != other.dataset.row_count:
+            return False
+        leafs = set(leaf.fingerprint for leaf in df.dataset.leafs())
+        return any(leaf.fingerprint in leafs for leaf in other.dataset.leafs())
+
     def _cancel(self, run):
         logger.debug("cancelling")
         self.signal_cancel.emit()
@@ -367,6 +447,7 @@ class ExecutorLocal(Executor):
 
                 for task in run.tasks:
                     task._results = []
+                    task._reduced = False
                     if not any(task.signal_progress.emit(0)):
                         logger.debug("task cancelled immediately")
                         task.cancelled = True
@@ -384,7 +465,7 @@ class ExecutorLocal(Executor):
                         task_checker.add_task(task)
                     spec = encoding.encode('task', task)
                     spec['task-part-cpu-type'] = spec.pop('task-type')
-                    def create_task_part():
+                    def create_task_part(task=task, spec=spec):
                         nonlocal memory_usage
                         task_part = encoding.decode('task-part-cpu', spec, df=task.df, nthreads=nthreads)
                         memory_usage += task_part.memory_usage()
@@ -393,23 +474,8 @@ class ExecutorLocal(Executor):
                         if task.requires_fingerprint:
                             task_part.fingerprint = task.fingerprint()
                         return task_part
-                    # We want at least 1 task part (otherwise we cannot do any work)
-                    # then we ask for the task part how often we should split
-                    # This means that we can have 100 threads, but only 2 task parts
-                    # In this case, evaluation of expressions is still multithreaded,
-                    # but aggregation is reduced to effectively 2 threads.
-                    task_part_0 = create_task_part()
-                    ideal_task_splits = task_part_0.ideal_splits(self.thread_pool.nthreads)
-                    assert ideal_task_splits <= self.thread_pool.nthreads, f'Cannot have more splits {ideal_task_splits} then threads {self.thread_pool.nthreads}'
-                    if ideal_task_splits == self.thread_pool.nthreads or task.see_all:
-                        # in the simple case, we just use a list
-                        task._parts = [task_part_0] + [create_task_part() for i in range(1, ideal_task_splits)]
-                    else:
-                        # otherwise a queue
-                        task._parts = queue.Queue()
-                        task._parts.put(task_part_0)
-                        for i in range(1, ideal_task_splits):
-                            task._parts.put(create_task_part())
+                    task._create_part = create_task_part
+                    task._parts = self._create_parts(task)
                 if memory_usage != memory_tracker.used:
                     raise RuntimeError(f"Reported memory usage by tasks was {memory_usage}, while tracker listed {memory_tracker.used}")
                 vaex.memory.local.agg = None
@@ -429,12 +495,16 @@ class ExecutorLocal(Executor):
                     if not ok_executor:
                         logger.debug("Pass cancelled because of the global progress event: %r", self.signal_progress.callbacks)
                     return ok_tasks and ok_executor and not all_stopped
-                yield from self.thread_pool.map(self.process_part, dataset.chunk_iterator(run.dataset_deps, chunk_size),
-                                                    dataset.row_count,
-                                                    progress=progress,
-                                                    cancel=lambda: self._cancel(run), unpack=True, run=run, use_async=use_async)
+                self.local.run = run
+                ranges = self._read_ranges(run)
+                leafs = self._partials(run, ranges)
+                if leafs is None:
+                    yield from self._process(run, ranges, chunk_size, progress, use_async)
+                else:
+                    yield from self._process_partials(run, leafs, chunk_size, progress, use_async)
                 duration_wallclock = time.time() - t0
                 logger.debug("executing took %r seconds", duration_wallclock)
+                logger.debug("thread utilization: %s", ", ".join(f"{100 * u:.0f}%" for u in self.thread_utilization))
                 self.local.executing = False
                 if has_contextvars:
                     self.isnested.set(False)
@@ -442,13 +512,9 @@ class ExecutorLocal(Executor):
                     for task in tasks:
                         if not task.cancelled:
                             logger.debug("fulfill task: %r", task)
-                            parts = task._parts
-                            if not isinstance(parts, list):
-                                parts_queue = parts
-                                parts = []
-                                while not parts_queue.empty():
-                                    parts.append(parts_queue.get())
-                            parts[0].reduce(parts[1:])
+                            parts = self._parts_list(task)
+                            if not task._reduced:
+                                parts[0].reduce(parts[1:], thread_pool=self.thread_pool)
                             logger.debug("wait for task: %r", task)
                             task._result = parts[0].get_result()
                             task.end()
@@ -489,21 +555,197 @@ class ExecutorLocal(Executor):
             raise
         finally:
             self.local.executing = False
+            self.local.run = None
             if has_contextvars:
                 self.isnested.set(False)
 
+    def memory_usage(self):
+        '''Memory used by the task parts of the pass that is executing in this thread (e.g. called from a progress callback)'''
+        run = getattr(self.local, 'run', None)
+        if run is None:
+            return 0
+        usage = 0
+        for task in run.tasks:
+            parts = getattr(task, '_parts', None)
+            if parts is None:
+                continue
+            # parts in a queue that are being processed are not counted
+            for part in (parts if isinstance(parts, list) else list(parts.queue)):
+                usage += part.memory_usage()
+        return usage
+
+    def cancel_run(self, reason):
+        '''Cancels the tasks of the pass that is executing in this thread, they are rejected with reason'''
+        run = getattr(self.local, 'run', None)
+        if run is not None:
+            for task in run.tasks:
+                task._toreject = reason
+                task.cancelled = True
+
+    def _create_parts(self, task):
+        # We want at least 1 task part (otherwise we cannot do any work)
+        # then we ask for the task part how often we should split
+        # This means that we can have 100 threads, but only 2 task parts
+        # In this case, evaluation of expressions is still multithreaded,
+        # but aggregation is reduced to effectively 2 threads.
+        task_part_0 = task._create_part()
+        task._cache_partial = task_part_0.cache_partial
+        ideal_task_splits = task_part_0.ideal_splits(self.thread_pool.nthreads)
+        assert ideal_task_splits <= self.thread_pool.nthreads, f'Cannot have more splits {ideal_task_splits} then threads {self.thread_pool.nthreads}'
+        if ideal_task_splits == self.thread_pool.nthreads or task.see_all:
+            # in the simple case, we just use a list
+            return [task_part_0] + [task._create_part() for i in range(1, ideal_task_splits)]
+        else:
+            # otherwise a queue
+            parts = queue.Queue()
+            parts.put(task_part_0)
+            for i in range(1, ideal_task_splits):
+                parts.put(task._create_part())
+            return parts
+
+    def _parts_list(self, task):
+        parts = task._parts
+        if not isinstance(parts, list):
+            parts_queue = parts
+            parts = []
+            while not parts_queue.empty():
+                parts.append(parts_queue.get())
+        return parts
+
+    def _process(self, run, ranges, chunk_size, progress, use_async):
+        row_count_read = run.dataset.row_count if ranges is None else sum(i2 - i1 for i1, i2 in ranges)
+        run.scheduler = scheduler = self.scheduler_for(row_count_read, chunk_size)
+        yield from self.thread_pool.map(self.process_part, scheduler.split(self._chunk_iterator(run, ranges, scheduler.chunk_size_io())),
+                                            row_count_read,
+                                            progress=progress,
+                                            cancel=lambda: self._cancel(run), unpack=True, run=run, use_async=use_async)
+        scheduler.finish()
+        self.thread_utilization = scheduler.utilization()
+
+    def _partials(self, run, ranges):
+        '''Returns the leafs of a concatenated dataset, with the cached partial results of the tasks, or None
+
+        The partial results (e.g. the grids of aggregations) of each dataset in a concatenation are
+        cached, such that after appending data, only the new datasets are processed, and their partial
+        results are combined with the cached partial results of the other datasets.
+        '''
+        if ranges is not None or run.shared or not vaex.cache.is_on() or not vaex.settings.main.cache.partial:
+            return None
+        if not isinstance(run.dataset, vaex.dataset.DatasetConcatenated):
+            return None
+        if not all(task.cacheable and task._cache_partial for task in run.tasks):
+            return None
+        leafs = []
+        offset = 0
+        for dataset in run.dataset.datasets:
+            keys = {task: task.fingerprint_partial(dataset) for task in run.tasks}
+            partials = {task: vaex.cache.get(key, type='task-part') for task, key in keys.items()}
+            leafs.append(_Leaf(offset, offset + dataset.row_count, keys, partials))
+            offset += dataset.row_count
+        return leafs
+
+    def _process_partials(self, run, leafs, chunk_size, progress, use_async):
+        missing = [leaf for leaf in leafs if any(partial is None for partial in leaf.partials.values())]
+        logger.debug("processing %d out of %d leafs of the dataset", len(missing), len(leafs))
+        row_count_read = sum(leaf.end - leaf.start for leaf in missing)
+        done = 0
+        for i, leaf in enumerate(missing):
+            if i > 0:
+                vaex.memory.local.agg = vaex.memory.create_tracker()
+                try:
+                    for task in run.tasks:
+                        task._parts = self._create_parts(task)
+                finally:
+                    vaex.memory.local.agg = None
+            def progress_leaf(p, done=done, length=leaf.end - leaf.start):
+                return progress((done + p * length) / max(row_count_read, 1))
+            yield from self._process(run, [(leaf.start, leaf.end)], chunk_size, progress_leaf, use_async)
+            if run.cancelled or any(task.cancelled for task in run.tasks):
+                return
+            for task in run.tasks:
+                parts = self._parts_list(task)
+                parts[0].reduce(parts[1:], thread_pool=self.thread_pool)
+                leaf.partials[task] = parts[0].get_partial()
+                if not any(part.stopped for part in parts):
+                    vaex.cache.set(leaf.keys[task], leaf.partials[task], type='task-part')
+            done += leaf.end - leaf.start
+        if not missing:
+            progress(1)
+        vaex.memory.local.agg = vaex.memory.create_tracker()
+        try:
+            for task in run.tasks:
+                part = task._create_part()
+                part.reduce_partials([leaf.partials[task] for leaf in leafs])
+                task._parts = [part]
+                task._reduced = True
+        finally:
+            vaex.memory.local.agg = None
+
+    def _read_ranges(self, run):
+        '''Returns the row ranges that need to be read, or None for all rows
+
+        Zone maps (statistics per range of rows) of the dataset can prove that no row in a range
+        can pass the filter. This is only used when all tasks only see the filtered rows.
+        '''
+        if run.shared:
+            return None
+        for task in run.tasks:
+            if not task.pre_filter or any(selection is not None for selection in task.selections):
+                return None
+        ranges = vaex.zonemap.read_ranges(run.dataset, list(run.tasks_per_df))
+        if ranges is None:
+            return None
+        # the ranges we skip are never evaluated, so we mark them as filtered out
+        skipped = []
+        offset = 0
+        for i1, i2 in ranges + [(run.dataset.row_count, run.dataset.row_count)]:
+            if i1 > offset:
+                skipped.append((offset, i1))
+            offset = i2
+        for df in run.tasks_per_df:
+            selection = df.get_selection(vaex.dataframe.FILTER_SELECTION_NAME)
+            full_mask = df._selection_masks[vaex.dataframe.FILTER_SELECTION_NAME]
+            cache = df._selection_mask_caches[vaex.dataframe.FILTER_SELECTION_NAME]
+            for i1, i2 in skipped:
+                mask = np.asarray(full_mask.view(i1, i2))
+                mask[:] = 0
+                cache[(i1, i2)] = selection, mask
+        return ranges
+
+    def _chunk_iterator(self, run, ranges, chunk_size):
+        if run.shared:
+            iterators = [dataset.chunk_iterator(list(columns), chunk_size) for dataset, columns in run.sources]
+            for items in zip(*iterators):
+                i1, i2, _ = items[0]
+                chunks = {}
+                for (dataset, columns), (j1, j2, chunks_source) in zip(run.sources, items):
+                    if (i1, i2) != (j1, j2):
+                        raise RuntimeError(f'Datasets in a shared pass yield different chunks: {i1}-{i2} and {j1}-{j2}')
+                    chunks.update({columns[name]: chunk for name, chunk in chunks_source.items()})
+                yield i1, i2, chunks
+        elif ranges is None:
+            yield from run.dataset.chunk_iterator(run.dataset_deps, chunk_size)
+        else:
+            for start, end in ranges:
+                for i1, i2, chunks in run.dataset.slice(start, end).chunk_iterator(run.dataset_deps, chunk_size):
+                    yield start + i1, start + i2, chunks
+
     def process_part(self, thread_index, i1, i2, chunks, run):
         if not run.cancelled:
             if thread_index >= run.nthreads:
                 raise ValueError(f'thread_index={thread_index} while only having {run.nthreads} blocks')
+            t0 = time.perf_counter()
             for df, tasks in run.tasks_per_df.items():
                 self.process_tasks(thread_index, i1, i2, chunks, run, df, tasks)
+            run.scheduler.record(thread_index, i2 - i1, time.perf_counter() - t0)
         return i2 - i1
 
     def process_tasks(self, thread_index, i1, i2, chunks, run, df, tasks):
         if 1:  # avoid large diff
             if i1 == i2:
                 raise RuntimeError(f'Oops, get an empty chunk, from {i1} to {i2}, that should not happen')
+            if run.shared:
+                chunks = {name: chunks[origin] for name, origin in run.columns[df].items()}
             N = i2 - i1
             for name, chunk in chunks.items():
                 assert len(chunk) == N, f'Oops, got a chunk ({name}) of length {len(chunk)} while it is expected to be of length {N} (at {i1}-{i2}'
@@ -527,10 +769,12 @@ class ExecutorLocal(Executor):
                     raise TypeError(f'Evaluated a chunk ({name}) that is not an array of column like object: {chunk!r} (type={type(chunk)}')
             for name, chunk in chunks.items():
                 sanity_check(name, chunk)
-            block_scope = _BlockScope(df, i1, i2, values={**run.variables[df], **chunks})
+            plan = run.expression_plans[df]
+            materialized = {name: chunks[column] for name, column in run.materialized[df].items() if column in chunks}
+            block_scope = _BlockScope(df, i1, i2, values={**run.variables[df], **chunks, **materialized}, plan=plan)
             block_scope.mask = filter_mask
             block_dict = {expression: block_scope.evaluate(expression) for expression in expressions}
-            selection_scope = _BlockScope(df, i1, i2, None, selection=True, values={**block_scope.values})
+            selection_scope = _BlockScope(df, i1, i2, None, selection=True, values={**block_scope.values}, plan=plan)
             selection_scope.filter_mask = filter_mask
             if not pre_filter and df.filtered:
                 filter_mask = selection_scope.evaluate(vaex.dataframe.FILTER_SELECTION_NAME)
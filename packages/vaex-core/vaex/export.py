@@ -12,6 +12,7 @@ import pyarrow as pa
 import vaex
 import vaex.utils
 import vaex.execution
+import vaex.sort
 from vaex.column import ColumnStringArrow, _to_string_sequence
 
 
@@ -90,7 +91,11 @@ def _export(dataset_input, dataset_output, random_index_column, path, column_nam
         # e.g., not b[:] = a[indices]
         # but b[indices_r] = a
         logger.info("sorting...")
-        indices = np.argsort(dataset_input.evaluate(sort))
+        memory_limit = vaex.sort.parse_memory_limit()
+        if memory_limit is not None and N * vaex.sort.estimate_bytes_per_row(dataset_input, [sort]) > memory_limit:
+            indices = vaex.sort.sort_indices(dataset_input, [sort], [True], memory_limit)
+        else:
+            indices = np.argsort(dataset_input.evaluate(sort))
         indices_r = np.zeros_like(indices)
         indices_r[indices] = np.arange(len(indices))
         if has_strings:
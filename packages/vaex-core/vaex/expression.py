@@ -995,7 +995,7 @@ class Expression(with_metaclass(Meta)):
         return self.ds.is_masked(self.expression)
 
     @docsubst
-    def value_counts(self, dropna=False, dropnan=False, dropmissing=False, ascending=False, progress=False, axis=None, delay=False):
+    def value_counts(self, dropna=False, dropnan=False, dropmissing=False, ascending=False, progress=False, axis=None, limit=None, delay=False):
         """Computes counts of unique values.
 
          WARNING:
@@ -1008,6 +1008,8 @@ class Expression(with_metaclass(Meta)):
         :param ascending: when False (default) it will report the most frequent occuring item first
         :param progress: {progress}
         :param bool axis: Axis over which to determine the unique elements (None will flatten arrays or lists)
+        :param int limit: Only return the limit most frequent values. Instead of counting all values, the counts of a bounded number of
+            values are kept (see :func:`vaex.agg.top_k`), which is exact when there are at most max(1000, 10*limit) unique values.
         :param bool delay: {delay}
         :returns: Pandas series containing the counts
         """
@@ -1019,6 +1021,25 @@ class Expression(with_metaclass(Meta)):
             dropmissing = True
 
         progressbar = vaex.utils.progressbars(progress)
+        if limit is not None and not self.df.data_type(self.expression).is_list:
+            capacity = max(1000, 10 * limit)
+            task = vaex.tasks.TaskTopK(self.df, (), self.expression, capacity, dropnan=dropnan, dropmissing=dropmissing)
+            task = self.df.executor.schedule(task)
+            progressbar.add_task(task, "value counts")
+
+            @vaex.delayed
+            def finish(table):
+                table = table.slice(0, limit)
+                keys = ['missing' if key is None else key for key in table['value'].to_pylist()]
+                counts = table['count'].to_numpy()
+                if ascending:
+                    keys, counts = keys[::-1], counts[::-1]
+                return Series(counts, index=keys)
+            return self.df._delay(delay, finish(task))
+        elif limit is not None:
+            value_counts = self.value_counts(dropnan=dropnan, dropmissing=dropmissing, ascending=False, progress=progressbar, delay=True)
+            value_counts = value_counts.then(lambda counts: counts.iloc[:limit].iloc[::-1] if ascending else counts.iloc[:limit])
+            return self.df._delay(delay, value_counts)
         task = vaex.tasks.TaskValueCounts(self.df, self.expression, dropnan=dropnan, dropmissing=dropmissing, ascending=ascending, axis=axis)
         self.df.executor.schedule(task)
         progressbar.add_task(task, "value counts")
@@ -1217,7 +1238,8 @@ def f({0}):
             values = pa.array(values, type=pa.large_string())
         else:
              # ensure that values are the same dtype as the expression (otherwise the set downcasts at the C++ level during execution)
-            values = np.array(values, dtype=self.dtype.numpy)
+            dtype = self.dtype.value_type if self.dtype.is_encoded else self.dtype
+            values = np.array(values, dtype=dtype.numpy)
 
         fp_args = vaex.cache.fingerprint(values, use_hashmap)
         fp = f"{self.fingerprint()}_{fp_args}".replace("-", "_")
@@ -579,6 +579,97 @@ def _graph(expression_string):
     return g.dependencies[0]
 
 
+# node types that are worth evaluating only once
+_subexpression_types = (_ast.BinOp, _ast.UnaryOp, _ast.Compare, _ast.Call)
+# node types that can be part of a subexpression that we can safely evaluate only once
+# (e.g. not lambda's, since names inside them refer to arguments)
+_subexpression_safe_types = _subexpression_types + (_ast.Name, _ast.Load, _ast.keyword, _ast.List, _ast.Tuple,
+                                                    ast_Num, ast_Str, ast_Constant, _ast.operator, _ast.unaryop, _ast.cmpop)
+
+
+# inside these nodes, names can refer to something else (e.g. lambda arguments)
+_scoping_types = (_ast.Lambda, _ast.ListComp, _ast.SetComp, _ast.DictComp, _ast.GeneratorExp)
+
+
+def _walk_unscoped(node):
+    yield node
+    for child in ast.iter_child_nodes(node):
+        if not isinstance(child, _scoping_types):
+            yield from _walk_unscoped(child)
+
+
+def _is_pure(node):
+    for child in ast.walk(node):
+        if not isinstance(child, _subexpression_safe_types):
+            return False
+        if isinstance(child, _ast.Call) and not isinstance(child.func, _ast.Name):
+            return False
+    return True
+
+
+class SubExpressionReplacer(ast.NodeTransformer):
+    def __init__(self, counts, temporaries, prefix):
+        self.counts = counts
+        self.temporaries = temporaries
+        self.prefix = prefix
+        self.names = {}
+
+    def visit_Call(self, node):
+        # we skip visiting node.func
+        key = ast.dump(node)
+        node.args = [self.visit(k) for k in node.args]
+        node.keywords = [self.visit(k) for k in node.keywords]
+        return self._replace(key, node)
+
+    def visit(self, node):
+        if isinstance(node, _scoping_types):
+            return node
+        if isinstance(node, _subexpression_types) and not isinstance(node, _ast.Call):
+            key = ast.dump(node)
+            node = self.generic_visit(node)
+            return self._replace(key, node)
+        return super().visit(node)
+
+    def _replace(self, key, node):
+        if self.counts.get(key, 0) < 2:
+            return node
+        if key not in self.names:
+            name = f'{self.prefix}{len(self.names)}'
+            self.names[key] = name
+            self.temporaries[name] = node
+        return ast.copy_location(_ast.Name(id=self.names[key], ctx=_ast.Load()), node)
+
+
+def eliminate_common_subexpressions(expressions, prefix='__cse_'):
+    """Finds subexpressions that occur more than once in a list of expressions.
+
+    Returns a dict that maps each expression to its ast node, in which common subexpressions are
+    replaced by names, and a dict that maps these names to the ast node of the subexpression (which
+    can refer to other names). Expressions that fail to parse are left out.
+
+    >>> nodes, temporaries = eliminate_common_subexpressions(['sqrt(x**2 + y**2)', 'x**2 + y**2 + z**2'])
+    >>> node_to_string(nodes['sqrt(x**2 + y**2)'])
+    'sqrt(__cse_2)'
+    >>> node_to_string(temporaries['__cse_2'])
+    '(__cse_0 + __cse_1)'
+    """
+    nodes = {}
+    for expression in expressions:
+        try:
+            nodes[expression] = parse_expression(expression)
+        except (SyntaxError, AssertionError):
+            pass
+    counts = collections.Counter()
+    for node in nodes.values():
+        for child in _walk_unscoped(node):
+            if isinstance(child, _subexpression_types) and _is_pure(child):
+                counts[ast.dump(child)] += 1
+    temporaries = {}
+    replacer = SubExpressionReplacer(counts, temporaries, prefix)
+    nodes = {expression: replacer.visit(node) for expression, node in nodes.items()}
+    return nodes, temporaries
+
+
 def simplify(expression_string):
     node = parse_expression(expression_string)
     node = SimplifyExpression().visit(node)
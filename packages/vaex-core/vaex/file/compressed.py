@@ -0,0 +1,202 @@
+"""Random access to block compressed files.
+
+Block compressed files consist of independently compressed frames. When the compressed and
+uncompressed offsets of the frames are known, any byte range of the uncompressed data can be read
+by only decompressing the frames that overlap it. Supported are:
+
+ * BGZF (e.g. written by `bgzip`), gzip members with the compressed block size in a header field. The offsets
+   are read from the `.gzi` index when it exists, otherwise from the headers of all blocks.
+ * The seekable zstd format (e.g. written by `t2sz` or `zstd --seekable` implementations), where a seek
+   table with the sizes of all frames is stored in a skippable frame at the end of the file.
+
+The offsets are cached per file (until it changes), since for a BGZF file without `.gzi` index all block
+headers have to be read. :class:`vaex.csv.DatasetCsvLazy` also stores them in its index file.
+"""
+import collections
+import logging
+import struct
+import threading
+
+import numpy as np
+import pyarrow as pa
+
+import vaex.file
+
+
+logger = logging.getLogger("vaex.file.compressed")
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_SKIPPABLE_MAGIC = 0x184D2A5E
+ZSTD_SEEKABLE_MAGIC = 0x8F92EAB1
+ZSTD_SEEKABLE_FOOTER_SIZE = 9
+CACHE_SIZE = 64  # number of files of which we keep the offsets
+
+_cache = collections.OrderedDict()  # (path, file fingerprint) -> BlockCompressedFile or None, least recently used first
+_cache_lock = threading.Lock()
+
+
+class BlockCompressedFile:
+    '''A block compressed file, with the offsets of all frames
+
+    :param codec: 'gzip' or 'zstd'
+    :param compressed_offsets: Offset of each frame in the file, with the end of the last frame as last element
+    :param uncompressed_offsets: Offset of each frame in the uncompressed data, with the uncompressed size as last element
+    '''
+    def __init__(self, path, codec, compressed_offsets, uncompressed_offsets, fs_options={}, fs=None):
+        self.path = path
+        self.codec = codec
+        self.compressed_offsets = np.asarray(compressed_offsets, dtype=np.int64)
+        self.uncompressed_offsets = np.asarray(uncompressed_offsets, dtype=np.int64)
+        self.fs_options = fs_options
+        self.fs = fs
+
+    @property
+    def size(self):
+        '''Size of the uncompressed data'''
+        return int(self.uncompressed_offsets[-1])
+
+    @property
+    def frame_count(self):
+        return len(self.compressed_offsets) - 1
+
+    def _frame_of(self, offset):
+        return int(np.searchsorted(self.uncompressed_offsets, offset, side='right')) - 1
+
+    def _decompress(self, data, i):
+        size = int(self.uncompressed_offsets[i + 1] - self.uncompressed_offsets[i])
+        if size == 0:
+            return b''
+        # releases the GIL, so frames can be decompressed in parallel
+        return pa.Codec(self.codec).decompress(data, decompressed_size=size, asbytes=True)
+
+    def read(self, begin, end):
+        '''Returns the bytes [begin, end) of the uncompressed data'''
+        end = min(end, self.size)
+        if begin >= end:
+            return b''
+        i1 = self._frame_of(begin)
+        i2 = int(np.searchsorted(self.uncompressed_offsets, end, side='left'))
+        offset = int(self.compressed_offsets[i1])
+        with vaex.file.open(self.path, fs_options=self.fs_options, fs=self.fs) as f:
+            f.seek(offset)
+            data = memoryview(f.read(int(self.compressed_offsets[i2]) - offset))
+        frames = []
+        for i in range(i1, i2):
+            frames.append(self._decompress(data[self.compressed_offsets[i] - offset:self.compressed_offsets[i + 1] - offset], i))
+        start = begin - int(self.uncompressed_offsets[i1])
+        return b''.join(frames)[start:start + end - begin]
+
+    def find(self, byte, begin, limit):
+        '''Returns the offset of the first occurrence of byte at or after begin, within limit bytes, or -1'''
+        offset = begin
+        end = min(self.size, begin + limit)
+        while offset < end:
+            i = self._frame_of(offset)
+            frame_begin = int(self.uncompressed_offsets[i])
+            data = self.read(frame_begin, int(self.uncompressed_offsets[i + 1]))
+            found = data.find(byte, offset - frame_begin)
+            if found != -1:
+                return frame_begin + found if frame_begin + found < end else -1
+            offset = int(self.uncompressed_offsets[i + 1])
+        return -1
+
+
+def is_block_compressed(path, fs_options={}, fs=None):
+    '''Returns True when the file looks block compressed, by only reading the first header (BGZF) or the footer (zstd)'''
+    file_size = vaex.file.size(path, fs_options=fs_options, fs=fs)
+    with vaex.file.open(path, fs_options=fs_options, fs=fs) as f:
+        header = f.read(18)
+        if header[:2] == GZIP_MAGIC:
+            return _bgzf_block_size(header) is not None
+        if file_size >= ZSTD_SEEKABLE_FOOTER_SIZE:
+            f.seek(file_size - ZSTD_SEEKABLE_FOOTER_SIZE)
+            frame_count, descriptor, magic = struct.unpack('<IBI', f.read(ZSTD_SEEKABLE_FOOTER_SIZE))
+            return magic == ZSTD_SEEKABLE_MAGIC
+    return False
+
+
+def open(path, fs_options={}, fs=None):
+    '''Returns a :class:`BlockCompressedFile`, or None when the file is not block compressed'''
+    key = vaex.file.stringyfy(path), vaex.file.fingerprint(path, fs_options=fs_options, fs=fs)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    compressed = _open(path, fs_options=fs_options, fs=fs)
+    with _cache_lock:
+        _cache[key] = compressed
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return compressed
+
+
+def _open(path, fs_options={}, fs=None):
+    file_size = vaex.file.size(path, fs_options=fs_options, fs=fs)
+    with vaex.file.open(path, fs_options=fs_options, fs=fs) as f:
+        header = f.read(18)
+        if header[:2] == GZIP_MAGIC:
+            if _bgzf_block_size(header) is None:
+                return None
+            offsets = _bgzf_offsets(f, path, file_size, fs_options, fs)
+            return BlockCompressedFile(path, 'gzip', *offsets, fs_options=fs_options, fs=fs)
+        if file_size >= ZSTD_SEEKABLE_FOOTER_SIZE:
+            offsets = _zstd_seekable_offsets(f, file_size)
+            if offsets is not None:
+                return BlockCompressedFile(path, 'zstd', *offsets, fs_options=fs_options, fs=fs)
+    return None
+
+
+def _bgzf_block_size(header):
+    # the size of a BGZF block is stored in the extra field with the 'BC' identifier
+    if len(header) < 18 or header[:2] != GZIP_MAGIC or not (header[3] & 4):
+        return None
+    xlen, = struct.unpack('<H', header[10:12])
+    extra = header[12:12 + xlen]
+    if extra[:2] != b'BC' or len(extra) < 6:
+        return None
+    bsize, = struct.unpack('<H', extra[4:6])
+    return bsize + 1
+
+
+def _bgzf_offsets(f, path, file_size, fs_options, fs):
+    compressed_offsets = [0]
+    uncompressed_offsets = [0]
+    path_index = vaex.file.stringyfy(path) + '.gzi'
+    if vaex.file.exists(path_index, fs_options=fs_options, fs=fs):
+        # the index written by `bgzip -i`, which lists all blocks after the first
+        with vaex.file.open(path_index, fs_options=fs_options, fs=fs) as fi:
+            count, = struct.unpack('<Q', fi.read(8))
+            entries = np.frombuffer(fi.read(16 * count), dtype='<u8').reshape(count, 2)
+        compressed_offsets.extend(entries[:, 0].tolist())
+        uncompressed_offsets.extend(entries[:, 1].tolist())
+    offset = compressed_offsets[-1]
+    # we have to visit the headers of the (remaining) blocks
+    while offset < file_size:
+        f.seek(offset)
+        block_size = _bgzf_block_size(f.read(18))
+        if block_size is None:
+            raise ValueError(f'{path} is not a valid BGZF file, no block found at offset {offset}')
+        f.seek(offset + block_size - 4)
+        isize, = struct.unpack('<I', f.read(4))
+        offset += block_size
+        compressed_offsets.append(offset)
+        uncompressed_offsets.append(uncompressed_offsets[-1] + isize)
+    logger.debug("found %d blocks in %s", len(compressed_offsets) - 1, path)
+    return compressed_offsets, uncompressed_offsets
+
+
+def _zstd_seekable_offsets(f, file_size):
+    f.seek(file_size - ZSTD_SEEKABLE_FOOTER_SIZE)
+    frame_count, descriptor, magic = struct.unpack('<IBI', f.read(ZSTD_SEEKABLE_FOOTER_SIZE))
+    if magic != ZSTD_SEEKABLE_MAGIC:
+        return None
+    entry_size = 12 if descriptor & 0x80 else 8
+    table_size = frame_count * entry_size
+    f.seek(file_size - ZSTD_SEEKABLE_FOOTER_SIZE - table_size - 8)
+    skippable_magic, frame_size = struct.unpack('<II', f.read(8))
+    if skippable_magic != ZSTD_SKIPPABLE_MAGIC or frame_size != table_size + ZSTD_SEEKABLE_FOOTER_SIZE:
+        raise ValueError('Invalid seek table in seekable zstd file')
+    entries = np.frombuffer(f.read(table_size), dtype='<u4').reshape(frame_count, entry_size // 4)
+    compressed_offsets = np.concatenate([[0], np.cumsum(entries[:, 0], dtype=np.int64)])
+    uncompressed_offsets = np.concatenate([[0], np.cumsum(entries[:, 1], dtype=np.int64)])
+    return compressed_offsets, uncompressed_offsets
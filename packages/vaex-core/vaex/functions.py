@@ -2581,9 +2581,103 @@ def _isin(x, values):
 
 @register_function(name='isin_set', on_expression=False)
 def _isin_set(x, hashmap_unique):
+    if isinstance(x, pa.DictionaryArray):
+        # e.g. partition columns, we test the values, not the indices
+        x = x.dictionary_decode()
     return hashmap_unique.isin(x)
 
 
+# all missing values hash to the same value
+_HLL_HASH_MISSING = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _hll_hash(x, dropmissing=False, dropnan=False):
+    '''Returns a 64 bit hash for each value, and a mask of values that should not be counted (or None)'''
+    import pandas as pd
+    if isinstance(x, pa.ChunkedArray):
+        x = x.combine_chunks()
+    if isinstance(x, pa.DictionaryArray):
+        x = x.dictionary_decode()
+    nan = None
+    if isinstance(x, pa.Array) and vaex.array_types.is_string_type(x.type):
+        missing = x.is_null().to_numpy(zero_copy_only=False)
+        values = x.fill_null('').to_numpy(zero_copy_only=False)
+    else:
+        x = vaex.array_types.to_numpy(x)
+        missing = np.ma.getmaskarray(x) if np.ma.isMaskedArray(x) else None
+        values = np.ma.getdata(x)
+        if values.dtype.kind in 'mM':
+            values = values.view(np.int64)
+        if values.dtype.kind == 'f':
+            nan = np.isnan(values)
+            # -0.0 and 0.0 are the same value, and so are all nan's
+            values = values + 0.0
+            values[nan] = np.nan
+    hashes = pd.util.hash_array(values, categorize=False)
+    if missing is not None:
+        hashes[missing] = _HLL_HASH_MISSING
+    drop = None
+    if dropmissing and missing is not None:
+        drop = missing
+    if dropnan and nan is not None:
+        drop = nan if drop is None else drop | nan
+    return hashes, drop
+
+
+@register_function()
+def _hll_register(x, precision):
+    '''The HyperLogLog register of each value, see :func:`vaex.agg.nunique_approx`'''
+    hashes, drop = _hll_hash(x)
+    return (hashes >> np.uint64(64 - precision)).astype(np.int64)
+
+
+@register_function()
+def _hll_rank(x, precision, dropmissing=False, dropnan=False):
+    '''The position of the first 1 bit of the hash of each value (after the register bits), see :func:`vaex.agg.nunique_approx`'''
+    hashes, drop = _hll_hash(x, dropmissing, dropnan)
+    bits = 64 - precision
+    hashes = hashes & np.uint64((1 << bits) - 1)
+    # the bit length, computed in 2 halves, which are exact in a float64
+    high = np.frexp((hashes >> np.uint64(32)).astype(np.float64))[1]
+    low = np.frexp((hashes & np.uint64(0xFFFFFFFF)).astype(np.float64))[1]
+    length = np.where(high > 0, high + 32, low)
+    rank = (bits + 1 - length).astype(np.uint8)
+    if drop is not None:
+        rank = np.ma.array(rank, mask=drop)
+    return rank
+
+
+def _ddsketch_keys(relative_accuracy, min_value, max_value):
+    '''The base of the logarithmic buckets, and the smallest and largest key of the positive buckets'''
+    gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+    return gamma, int(np.ceil(np.log(min_value) / np.log(gamma))), int(np.ceil(np.log(max_value) / np.log(gamma)))
+
+
+@register_function()
+def _ddsketch_bucket(x, relative_accuracy, min_value, max_value):
+    '''The (ordered) bucket of each value in a DDSketch, see :func:`vaex.agg.quantile`
+
+    The negative values go in the first buckets, values closer to zero than min_value in the middle
+    bucket, and the positive values in the last buckets. Values larger than max_value (in absolute
+    sense) go in the outer buckets. Missing values and nan's are masked.
+    '''
+    gamma, key_min, key_max = _ddsketch_keys(relative_accuracy, min_value, max_value)
+    count = key_max - key_min + 1
+    x = vaex.array_types.to_numpy(x)
+    mask = np.ma.getmaskarray(x) if np.ma.isMaskedArray(x) else None
+    values = np.ma.getdata(x).astype(np.float64)
+    nan = np.isnan(values)
+    mask = nan if mask is None else mask | nan
+    magnitude = np.abs(values)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        keys = np.ceil(np.log(np.clip(magnitude, min_value, max_value)) / np.log(gamma))
+    keys = np.clip(np.nan_to_num(keys), key_min, key_max).astype(np.int64) - key_min
+    buckets = np.where(values < 0, count - 1 - keys, count + 1 + keys)
+    buckets[magnitude < min_value] = count
+    buckets[mask] = 0
+    return np.ma.array(buckets, mask=mask)
+
+
 @register_function()
 def as_arrow(x):
     '''Lazily convert to Apache Arrow array type'''
@@ -1,10 +1,17 @@
 from functools import reduce
+import glob
 import logging
 import operator
+import os
 import collections
+import shutil
+import tempfile
+import weakref
 import six
 
+import dask.utils
 import numpy as np
+import pandas as pd
 import pyarrow as pa
 from vaex.dataframe import DataFrame
 from vaex.docstrings import docsubst
@@ -14,6 +21,7 @@ from vaex.delayed import delayed_args, delayed_dict, delayed_list
 from vaex.utils import _ensure_list, _ensure_string_from_expression
 import vaex
 import vaex.hash
+import vaex.partitioned
 import vaex.utils
 
 try:
@@ -844,7 +852,9 @@ class BinBy(GroupByBase):
                 coords = self._coords1d
                 return xr.DataArray(final_array, coords=coords, dims=self.dims)
             else:
-                final_array = np.zeros((len(arrays), ) + arrays[key0].shape)
+                # e.g. top_k gives a list per bin
+                dtype = object if any(value.dtype == object for value in arrays.values()) else np.float64
+                final_array = np.zeros((len(arrays), ) + arrays[key0].shape, dtype=dtype)
                 for i, value in enumerate(arrays.values()):
                     final_array[i] = value
                 coords = [list(arrays.keys())] + self._coords1d
@@ -1075,3 +1085,164 @@ class DatasetGroupby(vaex.dataset.DatasetDecorator):
         if start == 0 and end == self.row_count:
             return self
         return vaex.dataset.DatasetSlicedArrays(self, start=start, end=end)
+
+
+PARTITION_NAME = '__partition'
+
+
+def _arrow_values(array):
+    '''Values of an arrow array (in the dtype of the array for fixed width types) and its mask (or None)'''
+    mask = array.is_null().to_numpy(zero_copy_only=False) if array.null_count else None
+    type = array.type
+    if pa.types.is_boolean(type):
+        values = array.fill_null(False).to_numpy(zero_copy_only=False)
+    elif pa.types.is_primitive(type):
+        # to_numpy turns integers with missing values into floats, which hash differently
+        dtype = np.dtype(f'{"f" if pa.types.is_floating(type) else "i"}{type.bit_width // 8}')
+        buffer = array.buffers()[1]
+        if buffer is None:  # e.g. an empty array
+            values = np.zeros(len(array), dtype=dtype)
+        else:
+            values = np.frombuffer(buffer, dtype=dtype)[array.offset:array.offset + len(array)]
+    else:
+        values = array.to_numpy(zero_copy_only=False)
+    return values, mask
+
+
+def _hash_partition(blocks, partitions):
+    '''Partition number of each row, based on the hash of the keys (the blocks)'''
+    hashes = None
+    for block in blocks:
+        if isinstance(block, pa.ChunkedArray):
+            block = block.combine_chunks()
+        if isinstance(block, pa.Array):
+            values, mask = _arrow_values(block)
+            block = values if mask is None else np.ma.array(values, mask=mask)
+        values = np.ma.getdata(block)
+        if values.dtype.kind in 'mM':
+            values = values.view(np.int64)
+        if values.dtype.kind == 'f':
+            # -0.0 and 0.0 are the same key, and so are all nan's
+            values = values + 0.0
+            values[np.isnan(values)] = np.nan
+        if np.ma.isMaskedArray(block):
+            values = np.where(np.ma.getmaskarray(block), 0, values)
+        block_hashes = pd.util.hash_array(values, categorize=False)
+        hashes = block_hashes if hashes is None else hashes * np.uint64(1000003) ^ block_hashes
+    return (hashes % np.uint64(partitions)).astype(np.int32)
+
+
+def _spill_columns(df, by, actions):
+    '''Names of the columns that are needed to aggregate the spilled rows'''
+    names = df.get_column_names(hidden=True)
+    if isinstance(actions, collections_abc.Mapping):
+        actions = list(actions.items())
+    elif not isinstance(actions, collections_abc.Iterable) or isinstance(actions, six.string_types):
+        actions = [actions]
+    expressions = []
+    for action in actions:
+        name, aggregates = action if isinstance(action, tuple) else (None, action)
+        for aggregate in _ensure_list(aggregates):
+            if isinstance(aggregate, vaex.agg.AggregatorDescriptor):
+                expressions.extend(aggregate.expressions)
+                selection = getattr(aggregate, 'selection', None)
+                if isinstance(selection, (six.string_types, vaex.expression.Expression)):
+                    expressions.append(selection)
+            elif aggregate == 'count':
+                pass
+            elif name is not None:
+                expressions.append(name)
+            else:
+                # e.g. 'mean' is applied to all columns
+                return [name for name in df.get_column_names() if name not in by]
+    columns = []
+    for expression in expressions:
+        for name in df[str(expression)].variables(ourself=True, expand_virtual=False):
+            if name in names and name not in by and name not in columns:
+                columns.append(name)
+    return columns
+
+
+def _spill_partitions(df, by, actions, memory_limit=None):
+    '''Returns the number of partitions to spill to, when the groups need more than the memory limit, otherwise None'''
+    memory_limit = memory_limit or vaex.settings.main.groupby.memory_limit or vaex.settings.main.memory_tracker.max
+    if memory_limit is None:
+        return None
+    by = [str(k) for k in _ensure_list(by)]
+    if not all(name in df.get_column_names(hidden=True) for name in by):
+        return None
+    memory_limit = dask.utils.parse_bytes(memory_limit)
+    # the keys are stored in a hash map, and each aggregator has a grid per thread (max 8 for large grids)
+    bytes_key = sum(16 if df.data_type(name).is_string else df.data_type(name).index_type.numpy.itemsize for name in by)
+    aggregators = len(actions) if isinstance(actions, (collections_abc.Mapping, list, tuple)) else 1
+    bytes_per_group = 2 * bytes_key + 8 * aggregators * min(8, df.executor.thread_pool.nthreads)
+    groups_max = max(1, memory_limit // bytes_per_group)
+    groups = 1
+    for name in by:
+        groups *= len(df._set(name, limit=groups_max + 1, limit_raise=False))
+        if groups > groups_max:
+            partitions = vaex.utils.div_ceil(df.length_unfiltered(), groups_max)
+            logger.info("groupby has more than %d groups, which do not fit in %d bytes, using %d partitions", groups_max, memory_limit, partitions)
+            return max(2, partitions)
+    return None
+
+
+def groupby_partitioned(df, by, actions, partitions, sort=False, ascending=True, assume_sparse='auto', progress=None):
+    '''Out of core groupby, see :meth:`DataFrame.groupby`
+
+    The rows are spilled to disk, into one partition per value of the hash of the keys, such that all
+    rows of a group end up in the same partition. Each partition is aggregated separately (so only the
+    groups of one partition need to fit in memory), and written to disk. The result is a DataFrame
+    backed by the files of all partitions, which are removed when the DataFrame is no longer used.
+    '''
+    settings = vaex.settings.main.export_partitioned
+    by = [str(k) for k in _ensure_list(by)]
+    for name in by:
+        if name not in df.get_column_names(hidden=True):
+            raise ValueError(f'Can only do an out of core groupby by column names, not {name!r}')
+    columns = _spill_columns(df, by, actions)
+    names = by + columns
+    schema = df[names].schema_arrow(reduce_large=True)
+    progressbar = vaex.utils.progressbars(progress, title="groupby (partitioned)")
+    progressbar_spill = progressbar.add("spill")
+    progressbar_agg = progressbar.add("aggregate")
+    directory_result = tempfile.mkdtemp(prefix='vaex-groupby-', dir=vaex.settings.main.groupby.path)
+    paths = []
+    try:
+        with tempfile.TemporaryDirectory(prefix='vaex-groupby-spill-', dir=vaex.settings.main.groupby.path) as directory:
+            writer = vaex.partitioned.PartitionedWriter(os.path.join(directory, '{subdir}', '{i}.arrow'), [PARTITION_NAME], schema, '{key}={value}',
+                                                        settings.max_open_files, dask.utils.parse_bytes(settings.memory_limit), None, directory)
+            try:
+                def map(*blocks):
+                    arrays = [vaex.array_types.arrow_reduce_large(vaex.array_types.to_arrow(block)) for block in blocks]
+                    partition = pa.array(_hash_partition(blocks[:len(by)], partitions))
+                    writer.write(pa.Table.from_arrays(arrays + [partition], names + [PARTITION_NAME]))
+                    return len(blocks[0])
+                df.map_reduce(map, lambda a, b: a + b, names, to_numpy=False, pre_filter=df.filtered, progress=progressbar_spill, name='groupby spill')
+            finally:
+                writer.close()
+            for i, partition in enumerate(writer.partitions.values()):
+                files = glob.glob(os.path.join(directory, partition.subdir, '*.arrow'))
+                df_partition = vaex.open_many(files)
+                df_partition.variables.update(df.variables)
+                df_partition.functions.update(df.functions)
+                df_grouped = df_partition.groupby(by, agg=actions, assume_sparse=assume_sparse, partitions=False)
+                path = os.path.join(directory_result, f'{i}.arrow')
+                df_grouped.export_arrow(path)
+                df_partition.close()
+                paths.append(path)
+                progressbar_agg((i + 1) / len(writer.partitions))
+    except:  # noqa
+        shutil.rmtree(directory_result, ignore_errors=True)
+        raise
+    if not paths:
+        # no rows, the in memory groupby is fine
+        shutil.rmtree(directory_result, ignore_errors=True)
+        return df.groupby(by, agg=actions, sort=sort, ascending=ascending, partitions=False)
+    df_result = vaex.open_many(paths)
+    # the files are removed after the last reference to the dataset is gone
+    weakref.finalize(df_result.dataset, shutil.rmtree, directory_result, True)
+    progressbar(1)
+    if any(_ensure_list(sort)):
+        df_result = df_result.sort(by, ascending=ascending)
+    return df_result
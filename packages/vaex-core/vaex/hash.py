@@ -1,6 +1,9 @@
 import copyreg
+import json
+import shutil
 import sys
 import os
+import tempfile
 
 import dask.base
 import pyarrow as pa
@@ -8,7 +11,10 @@ import numpy as np
 
 import vaex
 import vaex.array_types
+import vaex.cache
+import vaex.multithreading
 from vaex.column import _to_string_sequence
+import vaex.settings
 import vaex.utils
 
 
@@ -174,7 +180,56 @@ class HashMapUnique:
         return len(self._internal)
 
     def merge(self, others):
-        self._internal.merge(others)
+        self._internal.merge([other._internal for other in others])
+
+    @classmethod
+    def merge_flat(cls, hash_maps, thread_pool=None):
+        '''Merges hash maps (with the same number of maps) into a new flat hash map, or returns None for strings and objects
+
+        A key always goes into the same map (based on its hash), so map i of all hash maps can be merged
+        independently of the other maps. We do this in parallel (when a thread pool is given), by adding the
+        keys of map i of all hash maps to a new hash map, and the flat hash map is built from their keys.
+        '''
+        first = hash_maps[0]
+        if first.dtype_item.is_string or first.dtype == object:
+            return None
+        internals = [hash_map._internal for hash_map in hash_maps]
+        internal_type = type(internals[0])
+        nmaps = len(internals[0].offsets())
+
+        def split(internal):
+            # the keys of each map, without nan and null (which are in the range of the first map)
+            keys = internal.key_array()
+            begins = internal.offsets()
+            ends = begins[1:] + [len(keys)]
+            parts = [keys[begin:end] for begin, end in zip(begins, ends)]
+            special = [index for index, count in [(internal.nan_index, internal.nan_count), (internal.null_index, internal.null_count)] if count]
+            if special:
+                parts[0] = np.delete(parts[0], special)
+            return parts
+        splits = vaex.multithreading.call_all([lambda internal=internal: split(internal) for internal in internals], thread_pool)
+
+        def merge_map(i):
+            keys = np.concatenate([parts[i] for parts in splits])
+            if len(keys) == 0:
+                return keys
+            merged = internal_type(1, -1)
+            merged.update(keys, -1, chunk_size=1024*1024, bucket_size=1024*1024*4)
+            return merged.key_array()
+        keys = vaex.multithreading.call_all([lambda i=i: merge_map(i) for i in range(nmaps)], thread_pool)
+
+        # like key_array, nan and null go first
+        nan_count = sum(internal.nan_count for internal in internals)
+        null_count = sum(internal.null_count for internal in internals)
+        null_index = -1
+        special = []
+        if nan_count:
+            special.append(np.array([np.nan], dtype=keys[0].dtype))
+        if null_count:
+            null_index = len(special)
+            special.append(np.zeros(1, dtype=keys[0].dtype))  # a placeholder, its value is not used
+        keys = np.concatenate(special + keys)
+        return HashMapUnique(first.dtype, _internal=internal_type(keys, null_index, nan_count, null_count, ''))
 
     def keys(self, mask=True):
         ar = self._internal.key_array()
@@ -301,3 +356,145 @@ def normalize(obj):
     if not obj.fingerprint:
         raise RuntimeError('No fingerprint present in HashMapUnique')
     return obj.fingerprint
+
+
+class PersistentIndex:
+    '''Index of a column that maps keys to row numbers, stored on disk and memory mapped.
+
+    Instead of a hash map, the index consists of the sorted keys and the rows that sort
+    them, which can be memory mapped directly, and shared between processes. It mimics
+    the lookup interface of the `index_hash_*` classes, so it can be used by :func:`vaex.join.join`.
+    Only supported for numerical and datetime columns.
+    '''
+    def __init__(self, path, keys, rows, meta):
+        self.path = path
+        self.keys = keys
+        self.rows = rows
+        self.nan_value = meta['nan_value']
+        self.null_value = meta['null_value']
+        self.nan_count = meta['nan_count']
+        self.null_count = meta['null_count']
+        self.has_duplicates = meta['has_duplicates']
+
+    @staticmethod
+    def supports(dtype):
+        return (dtype.is_primitive and dtype.kind in 'biuf') or dtype.is_datetime or dtype.is_timedelta
+
+    @staticmethod
+    def path_for(df, expression, path=None):
+        path = path or vaex.settings.main.index.path
+        fp = vaex.cache.fingerprint(df.fingerprint(), str(expression))
+        return os.path.join(path, f'index-{fp}')
+
+    @classmethod
+    def load(cls, df, expression, path=None):
+        '''Returns the persisted index, or None when it does not exist (yet)'''
+        directory = cls.path_for(df, expression, path)
+        if not os.path.exists(directory):
+            return None
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+        keys = np.load(os.path.join(directory, 'keys.npy'), mmap_mode='r')
+        rows = np.load(os.path.join(directory, 'rows.npy'), mmap_mode='r')
+        return cls(directory, keys, rows, meta)
+
+    @classmethod
+    def create(cls, df, expression, path=None, progress=None):
+        '''Builds the index and stores it on disk, or loads it when it already exists'''
+        index = cls.load(df, expression, path)
+        if index is not None:
+            return index
+        if df.filtered:
+            raise ValueError('Cannot persist an index of a filtered DataFrame, use df.extract() first')
+        directory = cls.path_for(df, expression, path)
+        values = df.evaluate(expression, array_type='numpy', progress=progress)
+        if values.dtype.kind in 'mM':
+            values = values.view(np.int64)
+        rows = np.arange(len(values), dtype=np.int64)
+        mask = np.ma.getmaskarray(values)
+        values = np.ma.getdata(values)
+        nan = np.isnan(values) if values.dtype.kind == 'f' else np.zeros(len(values), dtype=bool)
+        valid = ~(mask | nan)
+        # like the hash map, we keep the last row for missing values and nan
+        meta = {
+            'nan_value': int(rows[nan][-1]) if nan.any() else -1,
+            'null_value': int(rows[mask][-1]) if mask.any() else -1,
+            'nan_count': int(nan.sum()),
+            'null_count': int(mask.sum()),
+        }
+        keys = values[valid]
+        rows = rows[valid]
+        # stable, so that the first row of duplicate keys is the lowest row number
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        rows = rows[order]
+        meta['has_duplicates'] = bool(np.any(keys[1:] == keys[:-1]))
+        # write to a temporary directory first, so concurrent processes never see a partial index
+        os.makedirs(os.path.dirname(directory), exist_ok=True)
+        directory_tmp = tempfile.mkdtemp(prefix='.tmp-', dir=os.path.dirname(directory))
+        np.save(os.path.join(directory_tmp, 'keys.npy'), keys)
+        np.save(os.path.join(directory_tmp, 'rows.npy'), rows)
+        with open(os.path.join(directory_tmp, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        try:
+            os.rename(directory_tmp, directory)
+        except OSError:  # another process beat us
+            shutil.rmtree(directory_tmp, ignore_errors=True)
+        return cls.load(df, expression, path)
+
+    def __len__(self):
+        return len(self.keys) + self.nan_count + self.null_count
+
+    def _prepare(self, values):
+        values = np.asarray(values)
+        if values.dtype.kind in 'mM':
+            values = values.view(np.int64)
+        return values
+
+    def _search(self, values):
+        lo = np.searchsorted(self.keys, values, side='left')
+        if len(self.keys) == 0:
+            return lo, np.zeros(len(values), dtype=bool)
+        found = self.keys[np.minimum(lo, len(self.keys) - 1)] == values
+        found &= lo < len(self.keys)
+        return lo, found
+
+    def _map(self, values, mask, output):
+        values = self._prepare(values)
+        lo, found = self._search(values)
+        result = np.full(len(values), -1, dtype=np.int64)
+        result[found] = self.rows[lo[found]]
+        if values.dtype.kind == 'f':
+            result[np.isnan(values)] = self.nan_value if self.nan_count else -1
+        if mask is not None:
+            result[mask.astype(bool)] = self.null_value if self.null_count else -1
+        encountered_unknown = bool((result == -1).any())
+        if output is None:
+            return result
+        output[:] = result
+        return encountered_unknown
+
+    def map_index(self, values, output=None):
+        return self._map(values, None, output)
+
+    def map_index_masked(self, values, mask, output=None):
+        return self._map(values, mask, output)
+
+    def map_index_duplicates(self, values, *args):
+        '''Returns the (value indices, rows) for all but the first row of duplicate keys'''
+        if len(args) == 2:
+            mask, start_index = args
+        else:
+            mask, (start_index,) = None, args
+        values = self._prepare(values)
+        lo, found = self._search(values)
+        hi = np.searchsorted(self.keys, values, side='right')
+        extra = np.where(found, hi - lo - 1, 0)
+        if mask is not None:
+            extra[mask.astype(bool)] = 0
+        total = int(extra.sum())
+        indices = np.repeat(np.arange(len(values), dtype=np.int64) + start_index, extra)
+        # for value i, we want rows lo[i]+1 ... hi[i]-1
+        offsets = np.cumsum(extra) - extra
+        positions = np.arange(total, dtype=np.int64) + np.repeat(lo + 1 - offsets, extra)
+        return indices, np.asarray(self.rows[positions], dtype=np.int64)
@@ -1,3 +1,7 @@
+import queue
+import threading
+
+
 def buffer(i, n=1):
     values = []
     try:
@@ -54,3 +58,52 @@ def chunked(i, count):
             values = []
     if values:
         yield values
+
+
+def prefetch(i, n=1):
+    '''Consume iterator i in a background thread, keeping at most n items ready
+
+    Useful to overlap I/O (producing the items) with computation (consuming them).
+
+    >>> list(prefetch(range(5), 2))
+    [0, 1, 2, 3, 4]
+    '''
+    done = object()
+    items = queue.Queue(maxsize=n)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in i:
+                while not stop.is_set():
+                    try:
+                        items.put((item, None), timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+                if stop.is_set():
+                    break
+            else:
+                items.put((done, None))
+        except BaseException as e:  # noqa
+            items.put((done, e))
+
+    thread = threading.Thread(target=produce, name='vaex-prefetch', daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, exception = items.get()
+            if item is done:
+                if exception is not None:
+                    raise exception
+                break
+            yield item
+    finally:
+        stop.set()
+        # make sure a blocking put does not wait forever
+        while thread.is_alive():
+            try:
+                items.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        thread.join()
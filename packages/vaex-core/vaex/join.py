@@ -1,7 +1,17 @@
+import glob
+import os
+import tempfile
+
+import dask.utils
 import numpy as np
+import pandas as pd
+import pyarrow as pa
 from vaex.dataframe import DataFrame
 
 import vaex.dataset
+import vaex.multithreading
+import vaex.partitioned
+import vaex.settings
 from vaex.utils import _ensure_string_from_expression
 
 @vaex.dataset.register
@@ -122,7 +132,324 @@ class DatasetJoin(vaex.dataset.DatasetDecorator):
         return DatasetJoin(dataset, left, right, **spec)
         
 
-def join(df, other, on=None, left_on=None, right_on=None, lprefix='', rprefix='', lsuffix='', rsuffix='', how='left', allow_duplication=False, prime_growth=False, cardinality_other=None, inplace=False):
+def _lookup(left, left_on, right, right_on, allow_duplication, prime_growth, cardinality_other, lookup_dtype):
+    # we index the right side, this assumes right is smaller in size
+    index = right._index(right_on, prime_growth=prime_growth, cardinality=cardinality_other)
+    dtype = left.data_type(left_on)
+    duplicates_right = index.has_duplicates
+
+    if duplicates_right and not allow_duplication:
+        raise ValueError('This join will lead to duplication of rows which is disabled, pass allow_duplication=True')
+
+    # we put in the max value to maximize triggering failures in the case of a bug (we don't want
+    # to point to row 0 in case we do, we'd rather crash)
+    lookup = np.full(left._length_original, np.iinfo(lookup_dtype).max, dtype=lookup_dtype)
+    nthreads = left.executor.thread_pool.nthreads
+    lookup_masked = [False] * nthreads  # does the lookup contain masked/-1 values?
+    lookup_extra_chunks = []
+
+    from vaex.column import _to_string_sequence
+    def map(thread_index, i1, i2, selection_masks, blocks):
+        ar = blocks[0]
+        if vaex.array_types.is_string_type(dtype):
+            previous_ar = ar
+            ar = _to_string_sequence(ar)
+        if dtype.is_datetime:
+            ar = ar.view(np.int64)
+        if np.ma.isMaskedArray(ar):
+            mask = np.ma.getmaskarray(ar)
+            found_masked = index.map_index_masked(ar.data, mask, lookup[i1:i2])
+            lookup_masked[thread_index] = lookup_masked[thread_index] or found_masked
+            if duplicates_right:
+                extra = index.map_index_duplicates(ar.data, mask, i1)
+                lookup_extra_chunks.append(extra)
+        else:
+            found_masked = index.map_index(ar, lookup[i1:i2])
+            lookup_masked[thread_index] = lookup_masked[thread_index] or found_masked
+            if duplicates_right:
+                extra = index.map_index_duplicates(ar, i1)
+                lookup_extra_chunks.append(extra)
+    def reduce(a, b):
+        pass
+    left.map_reduce(map, reduce, [left_on], delay=False, name='fill looking', info=True, to_numpy=False, ignore_filter=True)
+    return lookup_masked, lookup_extra_chunks, lookup
+
+
+def _key_dtype(left, left_on, right, right_on):
+    dtype_left = left.data_type(left_on)
+    dtype_right = right.data_type(right_on)
+    if dtype_left.is_string or dtype_right.is_string:
+        return vaex.dtype(pa.large_string())
+    if dtype_left.is_datetime or dtype_left.is_timedelta:
+        return vaex.dtype(np.int64)
+    # both sides should hash equally, so we cast to a common type
+    return vaex.dtype(np.result_type(dtype_left.numpy, dtype_right.numpy))
+
+
+def _key_to_arrow(ar, dtype):
+    if dtype.is_string:
+        return vaex.array_types.to_arrow(ar).cast(pa.large_string())
+    ar = vaex.array_types.to_numpy(ar)
+    if ar.dtype.kind in 'mM':
+        ar = ar.view(np.int64)
+    return vaex.array_types.to_arrow(ar.astype(dtype.numpy, copy=False))
+
+
+PARTITION_NAME = '__partition'
+
+
+def _hash_partition(keys, partitions):
+    '''Partition number of each key (an Arrow array), based on the hash of the key, missing values go to partition 0'''
+    if pa.types.is_large_string(keys.type):
+        values = keys.to_numpy(zero_copy_only=False)
+    else:
+        values = np.ma.getdata(vaex.array_types.to_numpy(keys))
+        if values.dtype.kind == 'f':
+            # -0.0 and 0.0 should end up in the same partition, and also all nan's
+            values = values + 0.0
+            values[np.isnan(values)] = np.nan
+    hashes = pd.util.hash_array(values, categorize=False)
+    partition = (hashes % np.uint64(partitions)).astype(np.int32)
+    if keys.null_count:
+        partition[np.asarray(keys.is_null())] = 0
+    return partition
+
+
+class _PartitionWriter:
+    '''Spills (key, row) pairs to Arrow IPC files per partition
+
+    Uses :class:`vaex.partitioned.PartitionedWriter`, which buffers the rows, and caps the number of open files
+    (see `vaex.settings.main.export_partitioned`), so a partition can end up in multiple files.
+    '''
+    def __init__(self, directory, name, partitions, dtype):
+        settings = vaex.settings.main.export_partitioned
+        self.directory = os.path.join(directory, name)
+        self.partitions = partitions
+        self.dtype = dtype
+        schema = pa.schema([('key', dtype.arrow), ('row', pa.int64())])
+        self.writer = vaex.partitioned.PartitionedWriter(os.path.join(self.directory, '{subdir}', '{i}.arrow'), [PARTITION_NAME], schema, '{key}={value}',
+                                                         settings.max_open_files, dask.utils.parse_bytes(settings.memory_limit), None, directory)
+
+    def write(self, keys, i1):
+        keys = _key_to_arrow(keys, self.dtype)
+        rows = np.arange(i1, i1 + len(keys), dtype=np.int64)
+        partition = _hash_partition(keys, self.partitions)
+        self.writer.write(pa.Table.from_arrays([keys, pa.array(rows), pa.array(partition)], ['key', 'row', PARTITION_NAME]))
+
+    def close(self):
+        self.writer.close()
+
+    def read(self, i):
+        partition = self.writer.partitions.get((i,))
+        if partition is None:
+            return None, np.zeros(0, dtype=np.int64)
+        tables = []
+        for path in glob.glob(os.path.join(self.directory, partition.subdir, '*.arrow')):
+            with pa.memory_map(path) as source:
+                tables.append(pa.ipc.open_stream(source).read_all())
+        table = pa.concat_tables(tables)
+        keys = table['key'].combine_chunks()
+        rows = vaex.array_types.to_numpy(table['row'])
+        return keys, rows
+
+
+def _lookup_partitioned(left, left_on, right, right_on, partitions, allow_duplication, prime_growth, lookup):
+    '''Fills lookup, by partitioning both sides by the hash of the key, and joining each partition separately
+
+    Both sides are spilled to disk per partition, such that only the index of a single partition
+    needs to be in memory (per thread). Returns (lookup_masked, lookup_extra_chunks).
+    '''
+    from vaex.column import _to_string_sequence
+    from vaex.hash import index_type_from_dtype
+    dtype = _key_dtype(left, left_on, right, right_on)
+    index_type = index_type_from_dtype(dtype, transient=True, prime_growth=prime_growth)
+    with tempfile.TemporaryDirectory(prefix='vaex-join-') as directory:
+        writer_left = _PartitionWriter(directory, 'left', partitions, dtype)
+        writer_right = _PartitionWriter(directory, 'right', partitions, dtype)
+        for df, expression, writer in [(right, right_on, writer_right), (left, left_on, writer_left)]:
+            def map(thread_index, i1, i2, selection_masks, blocks, writer=writer):
+                writer.write(blocks[0], i1)
+            df.map_reduce(map, lambda a, b: None, [expression], delay=False, name='join partition', info=True, to_numpy=False, ignore_filter=True)
+            writer.close()
+
+        def to_hashable(keys):
+            if dtype.is_string:
+                return _to_string_sequence(keys), None
+            keys = vaex.array_types.to_numpy(keys)
+            if np.ma.isMaskedArray(keys):
+                return keys.data, np.ma.getmaskarray(keys)
+            return keys, None
+
+        def join_partition(i):
+            keys_right, rows_right = writer_right.read(i)
+            keys_left, rows_left = writer_left.read(i)
+            if len(rows_left) == 0:
+                return False, None
+            if len(rows_right) == 0:
+                lookup[rows_left] = -1
+                return True, None
+            index = index_type(1)
+            keys_right, mask_right = to_hashable(keys_right)
+            if mask_right is not None:
+                index.update(keys_right, mask_right, 0)
+            else:
+                index.update(keys_right, 0)
+            if index.has_duplicates and not allow_duplication:
+                raise ValueError('This join will lead to duplication of rows which is disabled, pass allow_duplication=True')
+            keys_left, mask_left = to_hashable(keys_left)
+            positions = np.empty(len(rows_left), dtype=np.int64)
+            if mask_left is not None:
+                found_masked = index.map_index_masked(keys_left, mask_left, positions)
+            else:
+                found_masked = index.map_index(keys_left, positions)
+            # positions are relative to this partition, translate them to rows of the right
+            lookup[rows_left] = np.where(positions == -1, -1, rows_right[positions])
+            extra = None
+            if index.has_duplicates:
+                if mask_left is not None:
+                    # missing values never lead to duplicates
+                    unmasked = np.flatnonzero(~mask_left)
+                    indices_left, positions_right = index.map_index_duplicates(keys_left[unmasked], 0)
+                    indices_left = unmasked[indices_left]
+                else:
+                    indices_left, positions_right = index.map_index_duplicates(keys_left, 0)
+                extra = rows_left[indices_left], rows_right[positions_right]
+            return found_masked, extra
+
+        thread_pool = left.executor.thread_pool
+        results = vaex.multithreading.call_all([lambda i=i: join_partition(i) for i in range(partitions)], thread_pool)
+    lookup_masked = [found_masked for found_masked, extra in results]
+    lookup_extra_chunks = [extra for found_masked, extra in results if extra is not None]
+    return lookup_masked, lookup_extra_chunks
+
+
+def _merge_keys(ar):
+    '''Returns the keys as numpy array, with masks for the missing values and nan's (which do not take part in the merge)'''
+    if isinstance(ar, vaex.array_types.supported_arrow_array_types) and vaex.dtype_of(ar).is_string:
+        values = ar.to_numpy(zero_copy_only=False)
+        null = np.asarray(ar.is_null())
+        return values, null, np.zeros(len(values), dtype=bool)
+    ar = vaex.array_types.to_numpy(ar)
+    null = np.ma.getmaskarray(ar)
+    values = np.ma.getdata(ar)
+    if values.dtype.kind == 'O':
+        null = null | np.equal(values, None)
+    if values.dtype.kind in 'mM':
+        values = values.view(np.int64)
+    if values.dtype.kind == 'f':
+        nan = np.isnan(values) & ~null
+    else:
+        nan = np.zeros(len(values), dtype=bool)
+    return values, null, nan
+
+
+def _merge_summary(df, expression):
+    '''Per chunk summary of the keys, used to check for sortedness and to find the rows for a range of keys
+
+    Returns a list of dicts, ordered by row.
+    '''
+    def map(thread_index, i1, i2, selection_masks, blocks):
+        values, null, nan = _merge_keys(blocks[0])
+        keys = values[~(null | nan)]
+        null_rows = np.flatnonzero(null)
+        nan_rows = np.flatnonzero(nan)
+        return [dict(
+            i1=i1,
+            i2=i2,
+            sorted=bool(np.all(keys[1:] >= keys[:-1])),
+            duplicates=bool(np.any(keys[1:] == keys[:-1])),
+            first=keys[0] if len(keys) else None,
+            last=keys[-1] if len(keys) else None,
+            null_row=i1 + null_rows[-1] if len(null_rows) else -1,
+            nan_row=i1 + nan_rows[-1] if len(nan_rows) else -1,
+        )]
+    chunks = df.map_reduce(map, lambda a, b: a + b, [expression], delay=False, name='join merge summary', info=True, to_numpy=False, ignore_filter=True)
+    chunks = sorted(chunks, key=lambda chunk: chunk['i1'])
+    return chunks
+
+
+def _merge_sorted(chunks):
+    '''Returns (sorted, duplicates) for all chunks combined'''
+    chunks = [chunk for chunk in chunks if chunk['first'] is not None]
+    is_sorted = all(chunk['sorted'] for chunk in chunks)
+    duplicates = any(chunk['duplicates'] for chunk in chunks)
+    for previous, chunk in zip(chunks[:-1], chunks[1:]):
+        is_sorted = is_sorted and bool(previous['last'] <= chunk['first'])
+        duplicates = duplicates or bool(previous['last'] == chunk['first'])
+    return is_sorted, duplicates
+
+
+def _lookup_sort_merge(left, left_on, right, right_on, allow_duplication, lookup_dtype, auto):
+    '''Fills the lookup by merging the sorted keys of left and right
+
+    Instead of building a hash index of the right side, we keep a summary of the keys per chunk
+    of the right (the first and last key). For each chunk of the left, we only evaluate the
+    range of rows of the right which can contain its keys, and match them using a binary search.
+    Since the chunks of the left are processed in parallel, this splits the key range over the threads.
+    Returns None when auto is True and the keys are not sorted.
+    '''
+    chunks_right = _merge_summary(right, right_on)
+    sorted_right, duplicates_right = _merge_sorted(chunks_right)
+    if auto:
+        if not sorted_right or not _merge_sorted(_merge_summary(left, left_on))[0]:
+            return None
+    elif not sorted_right:
+        raise ValueError(f'Cannot do a sort merge join, since {right_on!r} of the other DataFrame is not sorted')
+    elif not _merge_sorted(_merge_summary(left, left_on))[0]:
+        # the result would still be correct, but each chunk of the left could evaluate most of the right
+        raise ValueError(f'Cannot do a sort merge join, since {left_on!r} of the DataFrame is not sorted')
+    if duplicates_right and not allow_duplication:
+        raise ValueError('This join will lead to duplication of rows which is disabled, pass allow_duplication=True')
+    # missing values and nan's match the last missing value or nan of the right (like the hash join does)
+    null_row = max(chunk['null_row'] for chunk in chunks_right) if chunks_right else -1
+    nan_row = max(chunk['nan_row'] for chunk in chunks_right) if chunks_right else -1
+    chunks_right = [chunk for chunk in chunks_right if chunk['first'] is not None]
+    firsts = np.array([chunk['first'] for chunk in chunks_right])
+    lasts = np.array([chunk['last'] for chunk in chunks_right])
+
+    lookup = np.full(left._length_original, np.iinfo(lookup_dtype).max, dtype=lookup_dtype)
+    nthreads = left.executor.thread_pool.nthreads
+    lookup_masked = [False] * nthreads  # does the lookup contain masked/-1 values?
+    lookup_extra_chunks = []
+
+    def map(thread_index, i1, i2, selection_masks, blocks):
+        values, null, nan = _merge_keys(blocks[0])
+        out = lookup[i1:i2]
+        out[:] = -1
+        out[null] = null_row
+        out[nan] = nan_row
+        rows = np.flatnonzero(~(null | nan))
+        keys = values[rows]
+        if len(keys) and len(chunks_right):
+            # the chunks of the right which overlap with the keys of this chunk
+            chunk_start = np.searchsorted(lasts, keys.min(), side='left')
+            chunk_end = np.searchsorted(firsts, keys.max(), side='right')
+            if chunk_start < chunk_end:
+                r1 = chunks_right[chunk_start]['i1']
+                r2 = chunks_right[chunk_end - 1]['i2']
+                values_right, null_right, nan_right = _merge_keys(right.evaluate(right_on, r1, r2, parallel=False))
+                rows_right = np.flatnonzero(~(null_right | nan_right))
+                keys_right = values_right[rows_right]
+                rows_right += r1
+                start = np.searchsorted(keys_right, keys, side='left')
+                counts = np.searchsorted(keys_right, keys, side='right') - start
+                found = counts > 0
+                out[rows[found]] = rows_right[start[found]]
+                if duplicates_right:
+                    duplicated = counts > 1
+                    extra_counts = counts[duplicated] - 1
+                    if len(extra_counts):
+                        # the other matches of each duplicated key follow the first match
+                        offsets = np.arange(extra_counts.sum()) - np.repeat(np.cumsum(extra_counts) - extra_counts, extra_counts) + 1
+                        indices_left = np.repeat(rows[duplicated] + i1, extra_counts)
+                        indices_right = rows_right[np.repeat(start[duplicated], extra_counts) + offsets]
+                        lookup_extra_chunks.append((indices_left, indices_right))
+        lookup_masked[thread_index] = lookup_masked[thread_index] or bool(np.any(out == -1))
+    left.map_reduce(map, lambda a, b: None, [left_on], delay=False, name='fill lookup (merge)', info=True, to_numpy=False, ignore_filter=True)
+    return lookup_masked, lookup_extra_chunks, lookup
+
+
+def join(df, other, on=None, left_on=None, right_on=None, lprefix='', rprefix='', lsuffix='', rsuffix='', how='left', allow_duplication=False, prime_growth=False, cardinality_other=None, partitions=None, sort_merge=False, inplace=False):
     # implementation of DataFrameLocal.join
     inner = False
     left: DataFrame = df
@@ -165,48 +492,23 @@ def join(df, other, on=None, left_on=None, right_on=None, lprefix='', rprefix=''
         lookup = None
     else:
         df = left
-        # we index the right side, this assumes right is smaller in size
-        index = right._index(right_on, prime_growth=prime_growth, cardinality=cardinality_other)
-        dtype = left.data_type(left_on)
-        duplicates_right = index.has_duplicates
-
-        if duplicates_right and not allow_duplication:
-            raise ValueError('This join will lead to duplication of rows which is disabled, pass allow_duplication=True')
-
         # our max value for the lookup table is the row index number, so if we join a small
         # df with say 100 rows, we can do it with a int8
         lookup_dtype = vaex.utils.required_dtype_for_max(len(right))
-        # we put in the max value to maximize triggering failures in the case of a bug (we don't want
-        # to point to row 0 in case we do, we'd rather crash)
-        lookup = np.full(left._length_original, np.iinfo(lookup_dtype).max, dtype=lookup_dtype)
-        nthreads = df.executor.thread_pool.nthreads
-        lookup_masked = [False] * nthreads  # does the lookup contain masked/-1 values?
-        lookup_extra_chunks = []
-
-        from vaex.column import _to_string_sequence
-        def map(thread_index, i1, i2, selection_masks, blocks):
-            ar = blocks[0]
-            if vaex.array_types.is_string_type(dtype):
-                previous_ar = ar
-                ar = _to_string_sequence(ar)
-            if dtype.is_datetime:
-                ar = ar.view(np.int64)
-            if np.ma.isMaskedArray(ar):
-                mask = np.ma.getmaskarray(ar)
-                found_masked = index.map_index_masked(ar.data, mask, lookup[i1:i2])
-                lookup_masked[thread_index] = lookup_masked[thread_index] or found_masked
-                if duplicates_right:
-                    extra = index.map_index_duplicates(ar.data, mask, i1)
-                    lookup_extra_chunks.append(extra)
-            else:
-                found_masked = index.map_index(ar, lookup[i1:i2])
-                lookup_masked[thread_index] = lookup_masked[thread_index] or found_masked
-                if duplicates_right:
-                    extra = index.map_index_duplicates(ar, i1)
-                    lookup_extra_chunks.append(extra)
-        def reduce(a, b):
-            pass
-        left.map_reduce(map, reduce, [left_on], delay=False, name='fill looking', info=True, to_numpy=False, ignore_filter=True)
+        result = None
+        if sort_merge:
+            result = _lookup_sort_merge(left, left_on, right, right_on, allow_duplication, lookup_dtype, auto=sort_merge == 'auto')
+        if result is not None:
+            lookup_masked, lookup_extra_chunks, lookup = result
+        elif partitions is not None:
+            # the lookup can be larger than memory, so we memory map it, the file will be
+            # deleted after the last reference to the memory map is gone
+            with tempfile.TemporaryFile(prefix='vaex-join-lookup-') as f:
+                lookup = np.memmap(f, dtype=lookup_dtype, mode='w+', shape=(left._length_original,))
+            lookup[:] = np.iinfo(lookup_dtype).max
+            lookup_masked, lookup_extra_chunks = _lookup_partitioned(left, left_on, right, right_on, partitions, allow_duplication, prime_growth, lookup)
+        else:
+            lookup_masked, lookup_extra_chunks, lookup = _lookup(left, left_on, right, right_on, allow_duplication, prime_growth, cardinality_other, lookup_dtype)
         if len(lookup_extra_chunks):
             # if the right has duplicates, we increase the left of left, and the lookup array
             lookup_left = np.concatenate([k[0] for k in lookup_extra_chunks])
@@ -0,0 +1,181 @@
+"""Persistent materialization of virtual columns.
+
+The values of an expression are written to a directory keyed by the fingerprint of the dataset and
+the expanded expression, and memory mapped when the same expression is evaluated again, even in a
+new process. Since the key includes the fingerprint of the dataset, a stored column is never used
+when the data changes.
+
+Primitive columns are stored as .npy files (with a separate mask for missing values), other columns
+(e.g. strings) as an Arrow IPC file.
+"""
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pyarrow as pa
+
+import vaex.array_types
+import vaex.cache
+import vaex.dataset
+import vaex.settings
+
+
+logger = logging.getLogger("vaex.materialized")
+COLUMN_PREFIX = '__materialized_'
+
+
+def _key(df, expression):
+    expression = df._expr(expression).expand()
+    variables = {name: df.variables[name] for name in sorted(expression.variables()) if name in df.variables}
+    return vaex.cache.fingerprint(df.dataset.fingerprint, expression.expression, variables)
+
+
+def path_for(df, expression, path=None):
+    path = path or vaex.settings.main.materialize.path
+    return os.path.join(path, f'materialized-{_key(df, expression)}')
+
+
+def load(df, expression, path=None):
+    '''Returns the memory mapped values of the (unfiltered) expression, or None when they are not stored'''
+    directory = path_for(df, expression, path)
+    if not os.path.exists(directory):
+        return None
+    if os.path.exists(os.path.join(directory, 'data.arrow')):
+        with pa.memory_map(os.path.join(directory, 'data.arrow')) as source:
+            table = pa.ipc.open_file(source).read_all()
+        return table.column(0)
+    values = np.load(os.path.join(directory, 'data.npy'), mmap_mode='r')
+    if os.path.exists(os.path.join(directory, 'mask.npy')):
+        values = np.ma.array(values, mask=np.load(os.path.join(directory, 'mask.npy'), mmap_mode='r'), shrink=False)
+    return values
+
+
+def store(df, expression, path=None, progress=None):
+    '''Evaluates the (unfiltered) expression in chunks, and stores the values on disk'''
+    directory = path_for(df, expression, path)
+    if os.path.exists(directory):
+        return
+    dtype = df.data_type(expression)
+    row_count = df.dataset.row_count
+    if df.filtered:
+        # we store all rows
+        df = df.copy()
+        df.set_selection(None, name=vaex.dataframe.FILTER_SELECTION_NAME)
+    chunk_size = vaex.settings.main.chunk.size_max
+    # write to a temporary directory first, so concurrent processes never see a partial column
+    os.makedirs(os.path.dirname(directory), exist_ok=True)
+    directory_tmp = tempfile.mkdtemp(prefix='.tmp-', dir=os.path.dirname(directory))
+    try:
+        if dtype.is_primitive or dtype.is_datetime or dtype.is_timedelta:
+            data = np.lib.format.open_memmap(os.path.join(directory_tmp, 'data.npy'), mode='w+', dtype=dtype.numpy, shape=(row_count,))
+            mask = None
+            for i1, i2, chunk in df.evaluate_iterator(expression, array_type='numpy', chunk_size=chunk_size, progress=progress):
+                data[i1:i2] = np.ma.getdata(chunk)
+                if np.ma.is_masked(chunk):
+                    if mask is None:
+                        mask = np.lib.format.open_memmap(os.path.join(directory_tmp, 'mask.npy'), mode='w+', dtype=bool, shape=(row_count,))
+                    mask[i1:i2] = np.ma.getmaskarray(chunk)
+            data.flush()
+            if mask is not None:
+                mask.flush()
+            del data, mask
+        else:
+            writer = None
+            with pa.OSFile(os.path.join(directory_tmp, 'data.arrow'), 'wb') as sink:
+                for i1, i2, chunk in df.evaluate_iterator(expression, array_type='arrow', chunk_size=chunk_size, progress=progress):
+                    chunk = vaex.array_types.to_arrow(chunk)
+                    if isinstance(chunk, pa.ChunkedArray):
+                        chunk = chunk.combine_chunks()
+                    if writer is None:
+                        schema = pa.schema([('values', chunk.type)])
+                        writer = pa.ipc.new_file(sink, schema)
+                    batch = pa.RecordBatch.from_arrays([chunk.cast(schema.field(0).type)], schema=schema)
+                    writer.write_batch(batch)
+                if writer is None:
+                    schema = pa.schema([('values', dtype.arrow)])
+                    writer = pa.ipc.new_file(sink, schema)
+                writer.close()
+        with open(os.path.join(directory_tmp, 'meta.json'), 'w') as f:
+            json.dump({'expression': str(df._expr(expression).expand()), 'dataset': df.dataset.fingerprint, 'row_count': row_count}, f)
+        os.rename(directory_tmp, directory)
+    except OSError:
+        if not os.path.exists(directory):
+            raise
+        # another process beat us
+    finally:
+        shutil.rmtree(directory_tmp, ignore_errors=True)
+    logger.info("stored materialized column %r in %s", str(expression), directory)
+
+
+def lookup(df, expressions):
+    '''Finds stored columns for the expressions, and the virtual columns they depend on
+
+    Returns a dict that maps an expression (or virtual column name) to a column name, and a dict
+    that maps the column names to the memory mapped values.
+    '''
+    settings = vaex.settings.main.materialize
+    if not settings.reuse or not os.path.isdir(settings.path):
+        return {}, {}
+    candidates = set()
+    def add(expression):
+        expression = str(expression)
+        if expression in candidates or expression in df.dataset or expression in df.variables:
+            return
+        candidates.add(expression)
+        if expression in df.virtual_columns:
+            if not isinstance(df.virtual_columns[expression], str):
+                return
+            expression = df.virtual_columns[expression]
+        for name in df._expr(expression).variables(ourself=True, expand_virtual=False):
+            if name in df.virtual_columns:
+                add(name)
+    for expression in expressions:
+        add(expression)
+    mapping = {}
+    columns = {}
+    for expression in sorted(candidates):
+        try:
+            key = _key(df, expression)
+        except Exception:  # e.g. variables we cannot fingerprint
+            logger.exception("cannot compute key for %r", expression)
+            continue
+        name = COLUMN_PREFIX + key
+        if name not in columns:
+            values = load(df, expression)
+            if values is None:
+                continue
+            if len(values) != df.dataset.row_count:
+                logger.error("materialized column %r has %d rows, expected %d", expression, len(values), df.dataset.row_count)
+                continue
+            columns[name] = values
+        mapping[expression] = name
+    return mapping, columns
+
+
+def dependencies(df, expression, mapping):
+    '''Like Expression.dependencies, but a stored expression only depends on its stored column'''
+    expression = str(expression)
+    if expression in mapping:
+        return {mapping[expression]}
+    if expression in df.virtual_columns:
+        definition = df.virtual_columns[expression]
+        if not isinstance(definition, str):
+            return df._expr(expression).expand().variables(ourself=True)
+        return {expression} | dependencies(df, definition, mapping)
+    variables = set()
+    for name in df._expr(expression).variables(ourself=True, expand_virtual=False):
+        if name in df.virtual_columns:
+            variables |= dependencies(df, name, mapping)
+        else:
+            variables.add(name)
+    return variables
+
+
+def merged(dataset, columns):
+    '''Adds the stored columns to the dataset'''
+    if not columns:
+        return dataset
+    return dataset.merged(vaex.dataset.DatasetArrays(columns, hashed=False))
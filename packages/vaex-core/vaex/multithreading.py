@@ -4,18 +4,20 @@ import asyncio
 import threading
 import multiprocessing
 from warnings import warn
+import vaex.array_types
 import vaex.utils
 import logging
 import concurrent.futures
 import time
 import vaex.settings
 
-from .itertools import buffer
+from .itertools import buffer, prefetch
 
 logger = logging.getLogger("vaex.multithreading")
 
 main_pool = None
 main_io_pool = None
+gather_pool = None
 
 
 thread_pools = {}
@@ -42,8 +44,41 @@ def get_main_io_pool():
     return main_io_pool
 
 
+def get_gather_pool():
+    '''Pool for gathering (taking) columns, which may read from the main io pool, so it cannot use that pool itself'''
+    global gather_pool
+    if gather_pool is None:
+        gather_pool = concurrent.futures.ThreadPoolExecutor(max_workers=vaex.settings.main.thread_count_io)
+    return gather_pool
 
 
+def call_all(callables, thread_pool=None):
+    '''Calls all callables (in parallel when a thread pool is given), and returns the results in order
+
+    Only useful for callables that release the GIL, like most of our C++ code.
+    '''
+    callables = list(callables)
+    if thread_pool is None or len(callables) <= 1:
+        return [callable() for callable in callables]
+    futures = [thread_pool.submit(callable) for callable in callables]
+    return [future.result() for future in futures]
+
+
+def tree_reduce(combine, items, thread_pool=None):
+    '''Reduces the items pairwise in a tree, where the pairs of each level are combined in parallel
+
+    With n items, this takes log2(n) levels, instead of n-1 serial calls to combine.
+
+    >>> tree_reduce(lambda a, b: a + b, [1, 2, 3, 4, 5])
+    15
+    '''
+    items = list(items)
+    while len(items) > 1:
+        pairs = list(zip(items[0::2], items[1::2]))
+        rest = items[2 * len(pairs):]
+        items = call_all([lambda a=a, b=b: combine(a, b) for a, b in pairs], thread_pool) + rest
+    return items[0] if items else None
+
 
 class ThreadPoolIndex(concurrent.futures.ThreadPoolExecutor):
     """Thread pools that adds a thread index as first argument to the callback passed to map
@@ -97,9 +132,11 @@ class ThreadPoolIndex(concurrent.futures.ThreadPoolExecutor):
                 loop = asyncio.get_event_loop()
                 iterator = (loop.run_in_executor(self, lambda value=value: wrapped(value)) for value in cancellable_iter())
             else:
-                iterator = super(ThreadPoolIndex, self).map(wrapped, cancellable_iter())
+                iterator = self._map_window(wrapped, cancellable_iter(), self._max_workers + 3)
         total = 0
-        iterator = iter(buffer(iterator, self._max_workers + 3))
+        if self.nthreads == 1 or use_async:
+            iterator = buffer(iterator, self._max_workers + 3)
+        iterator = iter(iterator)
         try:
             for value in iterator:
                 if use_async:
@@ -128,6 +165,28 @@ class ThreadPoolIndex(concurrent.futures.ThreadPoolExecutor):
                 except:
                     pass
 
+    def _map_window(self, callable, iterator, n):
+        '''Keeps at most n calls in flight, and yields the results in order of completion
+
+        Unlike Executor.map, this does not consume the whole iterator upfront, and a slow
+        call does not block collecting the results (and submitting new work) of faster calls.
+        '''
+        pending = set()
+        try:
+            for value in iterator:
+                pending.add(self.submit(callable, value))
+                if len(pending) >= n:
+                    done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+            while pending:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+
     def _map(self, callable, iterator):
         for i in iterator:
             yield callable(i)
@@ -137,3 +196,76 @@ class ThreadPoolIndex(concurrent.futures.ThreadPoolExecutor):
             future = asyncio.Future()
             future.set_result(callable(i))
             yield future
+
+
+class ChunkScheduler:
+    """Splits chunks into pieces of work for the thread pool, based on the measured processing time.
+
+    Large chunks are read from the dataset (efficient for I/O), and are split such that each
+    piece takes about `duration` seconds to process, but never more than a fair share of the
+    rows that are left (guided self-scheduling). This means work gets finer grained towards
+    the end of a pass, so threads that finish early pick up the remaining pieces instead of
+    idling while a single thread processes a large chunk.
+
+    It also keeps track of the time each thread spent processing chunks, see :meth:`utilization`.
+    """
+    def __init__(self, nthreads, row_count, chunk_size, chunk_size_min, chunk_size_max, duration=None, adaptive=True, prefetch=0):
+        self.nthreads = nthreads
+        self.row_count = row_count
+        self.chunk_size = chunk_size
+        self.chunk_size_min = chunk_size_min
+        self.chunk_size_max = chunk_size_max
+        self.duration = duration if duration is not None else vaex.settings.main.chunk.duration
+        self.adaptive = adaptive
+        self.prefetch = prefetch
+        self.rate = None  # rows per second, for a single thread
+        self.busy = [0.] * nthreads
+        self.chunks = [0] * nthreads
+        self.lock = threading.Lock()
+        self.t0 = self.t1 = None
+
+    def chunk_size_io(self):
+        '''The chunk size we ask the dataset for'''
+        return max(self.chunk_size, self.chunk_size_max) if self.adaptive else self.chunk_size
+
+    def piece_size(self, rows_left):
+        size = self.chunk_size
+        if self.rate is not None:
+            size = int(self.rate * self.duration)
+        # a fair share of what is left, so the tail of the pass is balanced between the threads
+        size = min(size, vaex.utils.div_ceil(rows_left, self.nthreads))
+        return max(self.chunk_size_min, min(self.chunk_size_max, size))
+
+    def split(self, chunk_iterator):
+        self.t0 = time.perf_counter()
+        if self.prefetch:
+            chunk_iterator = prefetch(chunk_iterator, self.prefetch)
+        if not self.adaptive:
+            yield from chunk_iterator
+            return
+        for i1, i2, chunks in chunk_iterator:
+            offset = i1
+            while offset < i2:
+                size = self.piece_size(self.row_count - offset)
+                end = min(i2, offset + size)
+                if i2 - end < self.chunk_size_min:  # avoid a tiny piece at the end
+                    end = i2
+                yield offset, end, {name: vaex.array_types.slice(ar, offset - i1, end - offset) for name, ar in chunks.items()}
+                offset = end
+
+    def record(self, thread_index, rows, duration):
+        with self.lock:
+            self.busy[thread_index] += duration
+            self.chunks[thread_index] += 1
+            if duration > 0:
+                rate = rows / duration
+                # exponential moving average, to smooth out noise
+                self.rate = rate if self.rate is None else 0.8 * self.rate + 0.2 * rate
+
+    def finish(self):
+        self.t1 = time.perf_counter()
+
+    def utilization(self):
+        '''Returns per thread the fraction of the wall time spent processing chunks'''
+        wall = ((self.t1 or time.perf_counter()) - self.t0) if self.t0 is not None else 0
+        return [busy / wall if wall > 0 else 0. for busy in self.busy]
@@ -0,0 +1,249 @@
+"""Single pass export of a DataFrame to (hive) partitioned files.
+
+Each chunk is split by the values of the partition columns on the thread pool of
+the executor, and the rows are routed to a buffer per partition. Buffers are
+written to the file of the partition when they are large enough, or when the
+total amount of buffered data exceeds the memory limit. The number of open files
+is capped, the least recently used file is closed when a new one is needed, and
+a new file is started when a file exceeds the size limit. Both require a unique
+filename per file ({i} or {uuid} in the path), when the filename of a partition is
+fixed, its file stays open until the end.
+
+Parquet and Arrow files are written directly, other formats (e.g. HDF5, which
+needs to know the number of rows up front) are written to a temporary Arrow
+file first, and exported when the file is closed.
+"""
+import collections
+import logging
+import os
+import string
+import tempfile
+import threading
+import uuid
+
+from dask.utils import parse_bytes
+import numpy as np
+import pyarrow as pa
+
+import vaex.array_types
+import vaex.file
+import vaex.settings
+import vaex.utils
+
+
+logger = logging.getLogger("vaex.partitioned")
+ROW_NAME = '__row'
+# formats we can write to incrementally
+_formats = {'.parquet': 'parquet', '.arrow': 'arrow', '.feather': 'feather'}
+
+
+class _File:
+    '''A file of a partition that is being written'''
+    def __init__(self, path, schema, directory, fs_options, fs):
+        self.path = path
+        self.bytes = 0
+        self.fs_options = fs_options
+        self.fs = fs
+        naked_path, _ = vaex.file.split_options(path)
+        self.format = _formats.get(os.path.splitext(naked_path)[1])
+        vaex.file.create_dir(os.path.dirname(path), fs_options=fs_options, fs=fs)
+        if self.format is None:
+            self.spill_path = os.path.join(directory, f'spill-{uuid.uuid4()}.arrow')
+            self.sink = pa.OSFile(self.spill_path, 'wb')
+            self.writer = pa.ipc.new_file(self.sink, schema)
+        else:
+            self.sink = vaex.file.open(path=path, mode='wb', fs_options=fs_options, fs=fs)
+            if self.format == 'parquet':
+                import pyarrow.parquet as pq
+                self.writer = pq.ParquetWriter(self.sink, schema)
+            elif self.format == 'arrow':
+                self.writer = pa.RecordBatchStreamWriter(self.sink, schema)
+            else:
+                self.writer = pa.ipc.new_file(self.sink, schema, options=pa.ipc.IpcWriteOptions(compression='lz4'))
+
+    def write(self, table):
+        self.writer.write_table(table)
+        self.bytes += table.nbytes
+
+    def close(self):
+        self.writer.close()
+        self.sink.close()
+        if self.format is None:
+            df = vaex.open(self.spill_path)
+            try:
+                df.export(self.path, fs_options=self.fs_options, fs=self.fs)
+            finally:
+                df.close()
+                os.remove(self.spill_path)
+
+
+class _Partition:
+    def __init__(self, values, subdir):
+        self.values = values
+        self.subdir = subdir
+        self.lock = threading.Lock()  # protects the file
+        self.file = None
+        self.buffer = []
+        self.buffered = 0
+
+
+class PartitionedWriter:
+    '''Routes rows to a (buffered) file per partition, see :meth:`DataFrameLocal.export_partitioned`'''
+    def __init__(self, path, by, schema, directory_format, max_open_files, memory_limit, file_size_limit, directory, fs_options=None, fs=None):
+        self.path = path
+        self.by = by
+        self.schema = schema
+        self.directory_format = directory_format
+        self.max_open_files = max(1, max_open_files)
+        self.memory_limit = memory_limit
+        # a partition can buffer its share of the memory before it is written
+        self.buffer_size = max(1, memory_limit // self.max_open_files)
+        self.file_size_limit = file_size_limit
+        # with a fixed filename per partition, reopening a file would overwrite it, so we cannot close it early
+        fields = {field for _, field, _, _ in string.Formatter().parse(path) if field}
+        self.unique_names = bool(fields & {'i', 'uuid'})
+        if not self.unique_names and file_size_limit is not None:
+            raise ValueError(f'A file_size_limit requires {{i}} or {{uuid}} in the path, otherwise the files of a partition overwrite each other: {path}')
+        self.directory = directory
+        self.fs_options = fs_options
+        self.fs = fs
+        self.lock = threading.Lock()  # protects all state below
+        self.partitions = {}
+        self.open_files = collections.OrderedDict()  # values -> partition with an open file, least recently used first
+        self.buffered = 0
+        self.file_count = 0
+
+    def write(self, table):
+        '''Splits the table by the partition columns, and buffers the rows (without the partition columns)'''
+        if len(table) == 0:
+            return
+        groups = table.select(self.by).append_column(ROW_NAME, pa.array(np.arange(len(table), dtype=np.int64)))
+        groups = groups.group_by(self.by, use_threads=False).aggregate([(ROW_NAME, 'list')])
+        rows = groups[f'{ROW_NAME}_list'].combine_chunks()
+        # sort the rows by partition once, and slice out the partitions
+        table = table.select([name for name in table.column_names if name not in self.by]).take(rows.flatten())
+        offsets = rows.offsets.to_numpy()
+        keys = list(zip(*[groups[name].to_pylist() for name in self.by]))
+        flush = []
+        with self.lock:
+            for i, values in enumerate(keys):
+                partition = self.partitions.get(values)
+                if partition is None:
+                    parts = [self.directory_format.format(key=key, value=value) for key, value in zip(self.by, values)]
+                    partition = self.partitions[values] = _Partition(values, '/'.join(parts))
+                part = table.slice(offsets[i], offsets[i + 1] - offsets[i])
+                partition.buffer.append(part)
+                partition.buffered += part.nbytes
+                self.buffered += part.nbytes
+                if partition.buffered >= self.buffer_size and partition not in flush:
+                    flush.append(partition)
+            if self.buffered > self.memory_limit:
+                # write the largest buffers, until we are well below the limit
+                buffered = self.buffered - sum(partition.buffered for partition in flush)
+                for partition in sorted(self.partitions.values(), key=lambda partition: partition.buffered, reverse=True):
+                    if buffered <= self.memory_limit // 2:
+                        break
+                    if partition not in flush:
+                        flush.append(partition)
+                        buffered -= partition.buffered
+            flush = [(partition, self._take_buffer(partition)) for partition in flush]
+        for partition, tables in flush:
+            self._write(partition, tables)
+
+    def _take_buffer(self, partition):
+        tables = partition.buffer
+        self.buffered -= partition.buffered
+        partition.buffer = []
+        partition.buffered = 0
+        return tables
+
+    def _write(self, partition, tables):
+        table = pa.concat_tables(tables)
+        with partition.lock:
+            if partition.file is None:
+                self._open(partition)
+            partition.file.write(table)
+            close = self.file_size_limit is not None and partition.file.bytes >= self.file_size_limit
+            with self.lock:
+                if close:
+                    self.open_files.pop(partition.values)
+                else:
+                    self.open_files.move_to_end(partition.values)
+            if close:
+                partition.file.close()
+                partition.file = None
+
+    def _open(self, partition):
+        '''Opens a new file for the partition (which we hold the lock of), closing the least recently used files if needed'''
+        evicted = []
+        with self.lock:
+            if not self.unique_names and len(self.open_files) == self.max_open_files:
+                logger.warning("more than %d partitions, but files are not closed since the path has no {i} or {uuid}: %s", self.max_open_files, self.path)
+            for values, other in list(self.open_files.items()) if self.unique_names else []:
+                if len(self.open_files) < self.max_open_files:
+                    break
+                # files that are being written to are skipped, they will be closed later on
+                if other.lock.acquire(blocking=False):
+                    del self.open_files[values]
+                    evicted.append(other)
+            i = self.file_count
+            self.file_count += 1
+            self.open_files[partition.values] = partition
+        for other in evicted:
+            try:
+                other.file.close()
+                other.file = None
+            finally:
+                other.lock.release()
+        path = self.path.format(uuid=uuid.uuid4(), subdir=partition.subdir, i=i)
+        logger.debug("opening %s for partition %r", path, partition.values)
+        partition.file = _File(path, self.schema, self.directory, self.fs_options, self.fs)
+
+    def close(self):
+        '''Writes all buffered rows, and closes all files'''
+        with self.lock:
+            flush = [(partition, self._take_buffer(partition)) for partition in self.partitions.values() if partition.buffer]
+        for partition, tables in flush:
+            self._write(partition, tables)
+        for partition in self.partitions.values():
+            if partition.file is not None:
+                partition.file.close()
+                partition.file = None
+        self.open_files.clear()
+
+
+def export_partitioned(df, path, by, directory_format, progress=None, chunk_size=None, parallel=True, fs_options=None, fs=None,
+                       max_open_files=None, memory_limit=None, file_size_limit=None):
+    settings = vaex.settings.main.export_partitioned
+    if max_open_files is None:
+        max_open_files = settings.max_open_files
+    memory_limit = parse_bytes(memory_limit if memory_limit is not None else settings.memory_limit)
+    if file_size_limit is None:
+        file_size_limit = settings.file_size_limit
+    if file_size_limit is not None:
+        file_size_limit = parse_bytes(file_size_limit)
+    columns = [name for name in df.get_column_names() if name not in by]
+    names = by + columns
+    schema = df[columns].schema_arrow(reduce_large=True)
+
+    def to_table(blocks):
+        arrays = [vaex.array_types.arrow_reduce_large(vaex.array_types.to_arrow(block)) for block in blocks]
+        return pa.Table.from_arrays(arrays, names)
+
+    progressbar = vaex.utils.progressbars(progress, title="export(partitioned)")
+    with tempfile.TemporaryDirectory(prefix='vaex-partitioned-', dir=settings.path) as directory:
+        writer = PartitionedWriter(path, by, schema, directory_format, max_open_files, memory_limit, file_size_limit, directory, fs_options=fs_options, fs=fs)
+        try:
+            if parallel:
+                def map(*blocks):
+                    writer.write(to_table(blocks))
+                    return len(blocks[0])
+                df.map_reduce(map, lambda a, b: a + b, names, to_numpy=False, pre_filter=df.filtered, progress=progressbar, name='export partitioned')
+            else:
+                for i1, i2, chunks in df.evaluate_iterator(names, parallel=False, chunk_size=chunk_size):
+                    writer.write(to_table(chunks))
+                    progressbar(i2 / len(df))
+        finally:
+            writer.close()
+        logger.info("wrote %d partitions into %d files", len(writer.partitions), writer.file_count)
+    progressbar(1)
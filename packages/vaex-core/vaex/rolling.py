@@ -1,18 +1,488 @@
+from typing import List
+import warnings
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from frozendict import frozendict
+
+import vaex.array_types
+import vaex.cache
+import vaex.dataset
+from vaex.shift import chunk_eat, chunk_project, chunk_trim
 from vaex.utils import _issequence
 
 
+KINDS = ['sum', 'mean', 'min', 'max', 'std', 'count', 'quantile']
+# the number of values we gather at once for a window quantile
+QUANTILE_BLOCK = 1024**2
+
+
+def _parse_window(window):
+    '''Returns the window as a number of rows (int), or as a number of nanoseconds (np.timedelta64)'''
+    if isinstance(window, (int, np.integer)) and not isinstance(window, np.timedelta64):
+        if window < 1:
+            raise ValueError(f'window should be at least 1, not {window}')
+        return int(window)
+    if isinstance(window, str):
+        import pandas as pd
+        window = pd.Timedelta(window).to_timedelta64()
+    elif hasattr(window, 'to_timedelta64'):  # pandas
+        window = window.to_timedelta64()
+    window = np.timedelta64(window).astype('timedelta64[ns]')
+    if window <= np.timedelta64(0, 'ns'):
+        raise ValueError(f'window should be positive, not {window}')
+    return window
+
+
+def _result_dtype(kind, dtype):
+    if kind == 'count':
+        return np.dtype('int64')
+    if kind in ['mean', 'std', 'quantile']:
+        return np.dtype('float64')
+    if dtype.kind == 'b':
+        return np.dtype('int64')
+    if kind == 'sum':
+        return np.dtype('float64') if dtype.kind == 'f' else np.dtype('int64')
+    return dtype
+
+
+def _split(ar):
+    '''Splits a chunk into the values, a missing value mask and a nan mask'''
+    ar = vaex.array_types.to_numpy(ar)
+    missing = np.ma.getmaskarray(ar)
+    values = np.ma.getdata(ar)
+    if values.dtype.kind == 'b':
+        values = values.astype(np.int64)
+    if values.dtype.kind not in 'iuf':
+        raise TypeError(f'Rolling window aggregations require numerical data, not {values.dtype}')
+    if values.dtype.kind == 'f':
+        nan = np.isnan(values) & ~missing
+    else:
+        nan = np.zeros(len(values), dtype=bool)
+    return values, missing, nan
+
+
+def _window_sum(x, starts, ends, dtype=None):
+    '''Sum of x[start:end] for each window, using a prefix sum (O(1) per window)'''
+    prefix = np.zeros(len(x) + 1, dtype=dtype or x.dtype)
+    np.cumsum(x, out=prefix[1:])
+    return prefix[ends] - prefix[starts]
+
+
+def _window_sum_compensated(x, starts, ends):
+    '''Like :func:`_window_sum` for floats, but also sums the rounding errors of the prefix sum (TwoSum), such that
+    windows of values that can be added exactly give exact results'''
+    prefix = np.zeros(len(x) + 1, dtype=np.float64)
+    np.cumsum(x, out=prefix[1:])
+    # cumsum adds sequentially, so prefix[i+1] = fl(prefix[i] + x[i]), and we can find the error of each addition
+    a = prefix[:-1]
+    b = prefix[1:] - a
+    error = np.zeros(len(x) + 1, dtype=np.float64)
+    with np.errstate(invalid='ignore'):
+        np.cumsum((a - (prefix[1:] - b)) + (x - b), out=error[1:])
+    return (prefix[ends] - prefix[starts]) + (error[ends] - error[starts])
+
+
+def _window_reduce_fixed(ufunc, x, starts, width, identity):
+    '''Van Herk/Gil-Werman: ufunc over the windows x[start:start+width], with 3 ufunc calls per row'''
+    n = len(x)
+    padded = np.full(-(-n // width) * width, identity, dtype=x.dtype)
+    padded[:n] = x
+    blocks = padded.reshape(-1, width)
+    # the reduction from the start of a block, and to the end of the block
+    prefix = ufunc.accumulate(blocks, axis=1).ravel()
+    suffix = ufunc.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].ravel()
+    # a window covers at most two blocks
+    return ufunc(suffix[starts], prefix[starts + width - 1])
+
+
+def _window_reduce(ufunc, x, starts, ends):
+    '''ufunc over the windows x[start:end] of variable length (>0), using a sparse table (O(log(length)) per row)'''
+    lengths = ends - starts
+    levels = [x]
+    size = 1
+    while size * 2 <= lengths.max():
+        previous = levels[-1]
+        levels.append(ufunc(previous[:-size], previous[size:]))
+        size *= 2
+    # floor(log2(length)), exact for integers
+    level = np.frexp(lengths)[1] - 1
+    result = np.empty(len(starts), dtype=x.dtype)
+    for i in np.unique(level):
+        selected = level == i
+        table = levels[i]
+        result[selected] = ufunc(table[starts[selected]], table[ends[selected] - (1 << i)])
+    return result
+
+
+def _window_quantile(x, starts, ends, q):
+    '''Quantile of each window, ignoring nan values, costs O(length) per row'''
+    lengths = ends - starts
+    length = lengths.max()
+    result = np.empty(len(starts), dtype=np.float64)
+    block = max(1, QUANTILE_BLOCK // length)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)  # all nan windows
+        for i1 in range(0, len(starts), block):
+            i2 = min(len(starts), i1 + block)
+            indices = starts[i1:i2, np.newaxis] + np.arange(length)
+            outside = indices >= ends[i1:i2, np.newaxis]
+            windows = x[np.minimum(indices, len(x) - 1)]
+            windows[outside] = np.nan
+            result[i1:i2] = np.nanquantile(windows, q, axis=1)
+    return result
+
+
+def aggregate(kind, values, missing, nan, starts, ends, width=None, q=0.5, ddof=0):
+    '''Aggregates values[start:end] for each window, ignoring missing values.
+
+    A nan value in a window gives a nan, and a window without any values gives a missing value.
+    When all windows have the same length, pass it as width.
+    '''
+    valid = ~(missing | nan)
+    count = _window_sum(valid, starts, ends, dtype=np.int64)
+    if kind == 'count':
+        return count
+    nans = _window_sum(nan, starts, ends, dtype=np.int64)
+    mask = (count == 0) & (nans == 0)
+    floating = values.dtype.kind == 'f'
+    if kind in ['sum', 'mean']:
+        if floating or kind == 'mean':
+            total = _window_sum_compensated(np.where(valid, values, 0).astype(np.float64), starts, ends)
+        else:
+            total = _window_sum(np.where(valid, values, 0).astype(np.int64), starts, ends)
+        if kind == 'sum':
+            result = total
+        else:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                result = total / count
+    elif kind == 'std':
+        # shift the values, to avoid a loss of precision in the sum of squares
+        reference = values[valid].mean() if valid.any() else 0
+        x = np.where(valid, values - reference, 0).astype(np.float64)
+        total = _window_sum(x, starts, ends)
+        squares = _window_sum(x * x, starts, ends)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            result = np.sqrt(np.maximum(squares - total * total / count, 0) / (count - ddof))
+        mask |= (count <= ddof) & (nans == 0)
+    elif kind in ['min', 'max']:
+        ufunc = np.minimum if kind == 'min' else np.maximum
+        if floating:
+            identity = np.inf if kind == 'min' else -np.inf
+        else:
+            info = np.iinfo(values.dtype)
+            identity = info.max if kind == 'min' else info.min
+        identity = np.array(identity, dtype=values.dtype)
+        x = np.where(valid, values, identity)
+        if width is not None:
+            result = _window_reduce_fixed(ufunc, x, starts, width, identity)
+        else:
+            result = _window_reduce(ufunc, x, starts, ends)
+    elif kind == 'quantile':
+        x = np.where(valid, values, np.nan).astype(np.float64)
+        result = _window_quantile(x, starts, ends, q)
+    else:
+        raise ValueError(f'Unknown aggregation {kind}, should be one of {KINDS}')
+    if result.dtype.kind == 'f':
+        result[nans > 0] = np.nan
+    return np.ma.array(result, mask=mask)
+
+
+class _Rows:
+    '''Split (rolling) columns of a set of rows, optionally with the time column as int64 ns'''
+    def __init__(self, columns, time=None):
+        self.columns = columns  # name -> (values, missing, nan)
+        self.time = time
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()))[0])
+
+    def take(self, indices):
+        columns = {name: tuple(ar[indices] for ar in arrays) for name, arrays in self.columns.items()}
+        return _Rows(columns, None if self.time is None else self.time[indices])
+
+    def slice(self, start, end=None):
+        return self.take(slice(start, end))
+
+    @staticmethod
+    def concat(rows_list):
+        columns = {name: tuple(np.concatenate([rows.columns[name][i] for rows in rows_list]) for i in range(3)) for name in rows_list[0].columns}
+        time = None if rows_list[0].time is None else np.concatenate([rows.time for rows in rows_list])
+        return _Rows(columns, time)
+
+
+class RollingState:
+    '''Streams rolling window aggregations over chunks, carrying the rows needed for the next chunk'''
+    def __init__(self, kind, columns, dtypes, window, edge='right', fill_value=None, on=None, by=None, q=0.5, ddof=0):
+        self.kind = kind
+        self.columns = columns
+        self.dtypes = dtypes
+        self.window = window
+        self.edge = edge
+        self.fill_value = fill_value
+        self.on = on
+        self.by = by or []
+        self.q = q
+        self.ddof = ddof
+        self.fixed = self.on is None
+        self.tails = {}  # group key -> _Rows
+        self.pending = []  # for edge=left: chunks waiting for the rows that follow
+
+    def _padding(self, n):
+        columns = {}
+        for name in self.columns:
+            dtype = self.dtypes[name]
+            if dtype.kind == 'b':
+                dtype = np.dtype('int64')
+            if self.fill_value is None:
+                columns[name] = (np.zeros(n, dtype=dtype), np.ones(n, dtype=bool), np.zeros(n, dtype=bool))
+            elif isinstance(self.fill_value, float) and np.isnan(self.fill_value):
+                columns[name] = (np.zeros(n, dtype=dtype), np.zeros(n, dtype=bool), np.ones(n, dtype=bool))
+            else:
+                columns[name] = (np.full(n, self.fill_value, dtype=dtype), np.zeros(n, dtype=bool), np.zeros(n, dtype=bool))
+        return _Rows(columns, None if self.fixed else np.zeros(0, dtype=np.int64))
+
+    def _rows(self, chunks):
+        time = None
+        if self.on is not None:
+            ar = vaex.array_types.to_numpy(chunks[self.on])
+            if np.ma.is_masked(ar):
+                raise ValueError(f'Column {self.on} should not have missing values for time based windows')
+            time = np.ma.getdata(ar).astype('datetime64[ns]').view(np.int64)
+        return _Rows({name: _split(chunks[name]) for name in self.columns}, time)
+
+    def _groups(self, chunks, length):
+        '''Returns the row order (sorted by group), the boundaries and the keys of the groups in this chunk'''
+        if not self.by:
+            return None, [0, length], [None]
+        codes = []
+        dictionaries = []
+        for name in self.by:
+            ar = vaex.array_types.to_arrow(chunks[name])
+            if isinstance(ar, pa.ChunkedArray):
+                ar = ar.combine_chunks()
+            encoded = pc.dictionary_encode(ar, null_encoding='encode')
+            codes.append(encoded.indices.to_numpy(zero_copy_only=False))
+            dictionaries.append(encoded.dictionary.to_pylist())
+        if len(codes) == 1:
+            unique, inverse = np.unique(codes[0], return_inverse=True)
+            unique = unique[:, np.newaxis]
+        else:
+            unique, inverse = np.unique(np.stack(codes, axis=1), axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        order = np.argsort(inverse, kind='stable')
+        boundaries = np.searchsorted(inverse[order], np.arange(len(unique) + 1))
+        keys = [tuple(dictionary[code] for dictionary, code in zip(dictionaries, codes)) for codes in unique.tolist()]
+        return order, boundaries, keys
+
+    def _aggregate(self, parts):
+        '''Aggregates a list of (rows, starts, ends) and returns the concatenated result for each column'''
+        rows = _Rows.concat([rows for rows, _, _ in parts])
+        offsets = np.cumsum([0] + [len(rows) for rows, _, _ in parts[:-1]])
+        starts = np.concatenate([starts + offset for (_, starts, _), offset in zip(parts, offsets)])
+        ends = np.concatenate([ends + offset for (_, _, ends), offset in zip(parts, offsets)])
+        width = self.window if self.fixed else None
+        return {name: aggregate(self.kind, *rows.columns[name], starts, ends, width=width, q=self.q, ddof=self.ddof) for name in self.columns}
+
+    def _right(self, chunks, length):
+        rows = self._rows(chunks)
+        order, boundaries, keys = self._groups(chunks, length)
+        parts = []
+        for i, key in enumerate(keys):
+            part = rows if order is None else rows.take(order[boundaries[i]:boundaries[i+1]])
+            tail = self.tails.get(key)
+            if tail is None:
+                tail = self._padding(self.window - 1 if self.fixed else 0)
+            extended = _Rows.concat([tail, part])
+            positions = np.arange(len(tail), len(extended))
+            if self.fixed:
+                starts = positions - (self.window - 1)
+                self.tails[key] = extended.slice(len(extended) - (self.window - 1))
+            else:
+                time = extended.time
+                if np.any(time[1:] < time[:-1]):
+                    raise ValueError(f'Column {self.on} should be sorted{" (per group)" if self.by else ""} for time based windows')
+                starts = np.searchsorted(time, time[positions] - self.window.astype(np.int64), side='right')
+                self.tails[key] = extended.slice(np.searchsorted(time, time[-1] - self.window.astype(np.int64), side='right'))
+            parts.append((extended, starts, positions + 1))
+        results = self._aggregate(parts)
+        if order is not None:
+            for name, result in results.items():
+                results[name] = result[np.argsort(order)]
+        return results
+
+    def _left(self, rows, following):
+        # the window starts at the current row, and we need window-1 rows that follow
+        extended = _Rows.concat([rows, following.slice(0, self.window - 1)])
+        starts = np.arange(len(rows))
+        return self._aggregate([(extended, starts, starts + self.window)])
+
+    def process(self, i1, i2, chunks):
+        '''Yields the chunks with the rolling columns aggregated, possibly later, for edge=left'''
+        if self.edge == 'right':
+            yield i1, i2, {**chunks, **self._right(chunks, i2 - i1)}
+        else:
+            self.pending.append((i1, i2, chunks, self._rows(chunks)))
+            while len(self.pending) > 1 and sum(len(rows) for _, _, _, rows in self.pending[1:]) >= self.window - 1:
+                yield self._pop(_Rows.concat([rows for _, _, _, rows in self.pending[1:]]))
+
+    def finish(self):
+        '''Yields the chunks that are still pending'''
+        while self.pending:
+            yield self._pop(_Rows.concat([rows for _, _, _, rows in self.pending[1:]] + [self._padding(self.window - 1)]))
+
+    def _pop(self, following):
+        i1, i2, chunks, rows = self.pending.pop(0)
+        return i1, i2, {**chunks, **self._left(rows, following)}
+
+
+@vaex.dataset.register
+class DatasetRolling(vaex.dataset.DatasetDecorator):
+    '''Replaces columns by a rolling window aggregation, computed in a single streaming pass'''
+    snake_name = "rolling"
+
+    def __init__(self, original, columns: List[str], kind, window, edge='right', fill_value=None, on=None, by=None, q=0.5, ddof=0):
+        super().__init__(original)
+        self.columns = list(columns)
+        self.kind = kind
+        self.window = _parse_window(window)
+        self.edge = edge
+        self.fill_value = fill_value
+        self.on = on
+        self.by = list(by or [])
+        self.q = q
+        self.ddof = ddof
+        if kind not in KINDS:
+            raise ValueError(f'Unknown aggregation {kind}, should be one of {KINDS}')
+        if edge not in ['right', 'left']:
+            raise ValueError(f'edge can be "right" or "left", not {edge}')
+        if isinstance(self.window, int):
+            if on is not None:
+                raise ValueError(f'A time based window (e.g. "10s") is needed for on={on!r}, not {window!r}')
+        else:
+            if on is None:
+                raise ValueError(f'A time based window ({window!r}) needs a datetime column to be passed as on')
+            if edge != 'right' or fill_value is not None:
+                raise ValueError('Time based windows only support edge="right" and no fill_value')
+        if self.by and edge != 'right':
+            raise ValueError('Rolling per group only supports edge="right"')
+        for name in self.columns + self.by + ([on] if on else []):
+            assert name in self.original, f'Expected {name} to be in the current dataset'
+        self._ids = frozendict({name: id for name, id in self.original._ids.items() if name not in self.columns})
+        self._create_columns()
+        self._row_count = self.original.row_count
+
+    def leafs(self) -> List[vaex.dataset.Dataset]:
+        return [self]
+
+    def _params(self):
+        return dict(columns=self.columns, kind=self.kind, window=self.window, edge=self.edge, fill_value=self.fill_value,
+                    on=self.on, by=self.by, q=self.q, ddof=self.ddof)
+
+    @property
+    def _fingerprint(self):
+        params = self._params()
+        params['window'] = str(self.window)
+        id = vaex.cache.fingerprint(self.original.fingerprint, params)
+        return f'dataset-{self.snake_name}-{id}'
+
+    def _encode(self, encoding):
+        params = self._params()
+        if not isinstance(self.window, int):
+            params['window'] = int(self.window.astype(np.int64))
+            params['window_unit'] = 'ns'
+        return {'dataset': encoding.encode('dataset', self.original), **params}
+
+    @classmethod
+    def _decode(cls, encoding, spec):
+        spec = dict(spec)
+        dataset = encoding.decode('dataset', spec.pop('dataset'))
+        unit = spec.pop('window_unit', None)
+        if unit is not None:
+            spec['window'] = np.timedelta64(spec['window'], unit)
+        return cls(dataset, **spec)
+
+    def _create_columns(self):
+        self._columns = {name: vaex.dataset.ColumnProxy(self, name, vaex.array_types.data_type(col)) for name, col in self.original._columns.items()}
+        schema = self.original.schema()
+        self._dtypes = {}
+        for name in self.columns:
+            dtype = vaex.dtype(schema[name])
+            if not (dtype.is_numeric or dtype == bool):
+                raise TypeError(f'Rolling window aggregations require numerical data, column {name} is of type {dtype}')
+            self._dtypes[name] = dtype.numpy
+            self._columns[name] = vaex.dataset.ColumnProxy(self, name, _result_dtype(self.kind, dtype.numpy))
+
+    def chunk_iterator(self, columns, chunk_size=None, reverse=False, start=0, end=None):
+        yield from self._chunk_iterator(columns, chunk_size, start=start, end=end)
+
+    def _chunk_iterator(self, columns, chunk_size, reverse=False, start=0, end=None):
+        if start > self.row_count:
+            raise ValueError(f'start={start} is >= row_count={self.row_count}')
+        end = self.row_count if end is None else end
+        chunk_size = chunk_size or 1024**2
+        assert not reverse
+        columns_rolling = [name for name in self.columns if name in columns]
+        if columns_rolling:
+            columns_original = list(dict.fromkeys(list(columns) + self.by + ([self.on] if self.on else [])))
+            iter = self._rolling(self.original.chunk_iterator(columns_original, chunk_size), columns_rolling)
+            iter = chunk_project(iter, columns)
+        else:
+            iter = self.original.chunk_iterator(list(columns), chunk_size)
+        if start != 0 or end != self.row_count:
+            if start != 0:
+                iter = chunk_eat(iter, start)
+            if end != self.row_count:
+                iter = chunk_trim(iter, end - start)
+            iter = vaex.dataset.chunk_rechunk(iter, chunk_size)
+        yield from iter
+
+    def _rolling(self, chunk_iter, columns):
+        state = RollingState(self.kind, columns, self._dtypes, self.window, edge=self.edge, fill_value=self.fill_value,
+                             on=self.on, by=self.by, q=self.q, ddof=self.ddof)
+        for i1, i2, chunks in chunk_iter:
+            yield from state.process(i1, i2, chunks)
+        yield from state.finish()
+
+    def is_masked(self, column):
+        return column in self.columns or self.original.is_masked(column)
+
+    def slice(self, start, end):
+        if start == 0 and end == self.row_count:
+            return self
+        return vaex.dataset.DatasetSliced(self, start=start, end=end)
+
+    def hashed(self):
+        return type(self)(self.original.hashed(), **self._params())
+
+
 class Rolling:
-    '''Provides rolling window calculations'''
-    def __init__(self, df, window, trim, edge, fill_value=None, columns=None):
+    '''Provides rolling window calculations
+
+    The aggregations (:meth:`sum`, :meth:`mean`, etc.) are computed in a single streaming pass over the data,
+    taking O(1) amortized work per row (O(window) for :meth:`quantile`). Missing values are ignored, a nan in
+    the window gives a nan, and a window without values gives a missing value.
+
+    With `on`, the window is a time span (e.g. '10s') over a sorted datetime column, and a row is aggregated with
+    all rows in (t - window, t]. With `by`, the window only contains rows of the same group, in the original order.
+    '''
+    def __init__(self, df, window, trim, edge, fill_value=None, columns=None, on=None, by=None):
         self.df = df
         self.window = window
         self.trim = trim
         self.edge = edge
         self.fill_value = fill_value
+        self.on = on
+        self.by = [] if by is None else (list(by) if _issequence(by) else [by])
+        if columns is None:
+            columns = [name for name in df.get_column_names() if name not in self.by and name != on]
         self.columns = columns
 
     def array(self):
         '''Creates an array representing each window'''
+        if self.on is not None or self.by:
+            raise ValueError('array() only supports a fixed window size, without on or by')
         if self.edge == "right":
             return self.df.shift((-self.window, 0), column=self.columns, trim=self.trim, fill_value=self.fill_value)
         elif self.edge == "left":
@@ -20,12 +490,62 @@ class Rolling:
         else:
             raise ValueError(f'edge can be "right", "left" or "center", not {self.edge}')
 
+    def _aggregate(self, kind, q=0.5, ddof=0):
+        df = self.df.trim()
+        if df.filtered:
+            df._push_down_filter()
+        names = self.columns + self.by + ([self.on] if self.on else [])
+        virtual = [name for name in names if name in df.virtual_columns]
+        # other virtual columns that use a rolled column should still see the original values
+        virtual += [name for name in df.virtual_columns if name not in virtual and set(df[name].variables()) & set(self.columns)]
+        if virtual:
+            df.materialize(virtual, inplace=True)
+        dataset = DatasetRolling(df.dataset, self.columns, kind, self.window, edge=self.edge, fill_value=self.fill_value,
+                                 on=self.on, by=self.by, q=q, ddof=ddof)
+        if self.trim:
+            if self.on is not None or self.by:
+                raise ValueError('trim only supports a fixed window size, without on or by')
+            n = min(self.window - 1, dataset.row_count)
+            if self.edge == 'right':
+                dataset = dataset.slice(n, dataset.row_count)
+            else:
+                dataset = dataset.slice(0, dataset.row_count - n)
+        df.dataset = dataset
+        return df
+
     def sum(self):
         '''Sum all values in the window'''
-        df = self.array()
-        for column in self.columns:
-            df[column] = df[column].sum(axis=1)
-        return df
+        return self._aggregate('sum')
+
+    def mean(self):
+        '''Mean of the values in the window'''
+        return self._aggregate('mean')
+
+    def min(self):
+        '''Minimum of the values in the window'''
+        return self._aggregate('min')
+
+    def max(self):
+        '''Maximum of the values in the window'''
+        return self._aggregate('max')
+
+    def std(self, ddof=0):
+        '''Standard deviation of the values in the window
+
+        :param int ddof: Delta degrees of freedom, the divisor is the number of values minus ddof.
+        '''
+        return self._aggregate('std', ddof=ddof)
+
+    def count(self):
+        '''Number of (non missing, non nan) values in the window'''
+        return self._aggregate('count')
+
+    def quantile(self, q=0.5):
+        '''Quantile of the values in the window
+
+        :param float q: Quantile between 0 and 1.
+        '''
+        return self._aggregate('quantile', q=q)
 
     # def apply(self, f):
     #     df = self.array()
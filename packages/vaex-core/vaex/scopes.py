@@ -1,9 +1,12 @@
 from __future__ import division, print_function
+import ast
+import functools
 import logging
 import numpy as np
 import pyarrow as pa
 import vaex.array_types
 import vaex.arrow.numpy_dispatch
+import vaex.expresso
 
 
 from .utils import (_ensure_strings_from_expressions,
@@ -42,6 +45,42 @@ def auto_encode(df, expression, values):
     return df._auto_encode_data(expression, values)
 
 
+@functools.lru_cache(maxsize=8192)
+def compile_expression(expression):
+    '''Compile an expression string to a code object, so we parse it only once'''
+    return compile(expression, '<expression>', 'eval')
+
+
+def _compile_node(node):
+    return compile(ast.fix_missing_locations(ast.Expression(body=node)), '<expression>', 'eval')
+
+
+class ExpressionPlan:
+    '''Compiled expressions, where common subexpressions are evaluated only once per chunk
+
+    :param dict codes: maps an expression (or virtual column definition) to its code object
+    :param dict temporaries: maps names of common subexpressions to their code object
+    '''
+    def __init__(self, codes, temporaries):
+        self.codes = codes
+        self.temporaries = temporaries
+
+
+@functools.lru_cache(maxsize=128)
+def _plan(expressions):
+    nodes, temporaries = vaex.expresso.eliminate_common_subexpressions(expressions)
+    codes = {expression: _compile_node(node) for expression, node in nodes.items()}
+    temporaries = {name: _compile_node(node) for name, node in temporaries.items()}
+    return ExpressionPlan(codes, temporaries)
+
+
+def plan(df, expressions):
+    '''Create an :class:`ExpressionPlan` for the expressions and all virtual columns of the DataFrame'''
+    virtual = [expression for expression in df.virtual_columns.values() if isinstance(expression, str)]
+    # sorted to have a stable cache key
+    return _plan(tuple(sorted(set(map(str, expressions)) | set(virtual))))
+
+
 class UnitScope(ScopeBase):
     def __init__(self, df, value=None):
         self.df = df
@@ -61,13 +100,14 @@ class UnitScope(ScopeBase):
 
 
 class _BlockScope(ScopeBase):
-    def __init__(self, df, i1, i2, mask=None, selection=False, values=None):
+    def __init__(self, df, i1, i2, mask=None, selection=False, values=None, plan=None):
         """
 
         :param DataFrameLocal DataFrame: the *local*  DataFrame
         :param i1: start index
         :param i2: end index
         :param values:
+        :param ExpressionPlan plan: compiled expressions to use (optional)
         :return:
         """
         self.df = df
@@ -84,6 +124,7 @@ class _BlockScope(ScopeBase):
         self.buffers = {}
         self.mask = mask if mask is not None else None
         self.selection = selection
+        self.plan = plan
 
     def move(self, i1, i2):
         length_new = i2 - i1
@@ -116,7 +157,12 @@ class _BlockScope(ScopeBase):
             # result = ne.evaluate(expression, local_dict=self, out=out)
             # logger.debug("in eval")
             # eval("def f(")
-            result = eval(expression, expression_namespace, self)
+            code = None
+            if self.plan is not None:
+                code = self.plan.codes.get(expression)
+            if code is None:
+                code = compile_expression(expression)
+            result = eval(code, expression_namespace, self)
             result = auto_encode(self.df, expression, result)
             self.values[expression] = wrap(result)
             # if out is not None:
@@ -175,6 +221,9 @@ class _BlockScope(ScopeBase):
                     return wrap(sub_mask_array[self.filter_mask])
                 else:
                     return wrap(sub_mask_array)
+            elif self.plan is not None and variable in self.plan.temporaries:
+                # common subexpression, evaluate once and keep it around for this chunk
+                self.values[variable] = wrap(eval(self.plan.temporaries[variable], expression_namespace, self))
             elif variable in self.df.columns:
                 raise RuntimeError(f'Failed to detect dependency on column: {variable}')
             elif variable in list(self.df.virtual_columns.keys()):
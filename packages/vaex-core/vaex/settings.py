@@ -85,6 +85,9 @@ class Chunk(BaseSettings):
     size: Optional[int] = Field(None, title="When set, fixes the number of chunks, e.g. do not dynamically adjust between min and max")
     size_min: int = Field(1024, title="Minimum chunk size")
     size_max: int = Field(1024**2, title="Maximum chunk size")
+    adaptive: bool = Field(True, title="When size is not set, split chunks dynamically based on the measured processing time, so that all threads stay busy until the end of a pass")
+    duration: float = Field(0.05, title="Target processing time (in seconds) of a piece of work when chunks are split adaptively")
+    prefetch: int = Field(2, title="Number of chunks read ahead (in a background thread) of the computation when chunks are split adaptively, 0 disables prefetching")
     class Config(ConfigDefault):
         env_prefix = 'vaex_chunk_'
 
@@ -95,11 +98,83 @@ class Cache(BaseSettings):
     disk_size_limit: str = Field('10GB', title='Maximum size for cache on disk, e.g. 10GB, 500MB')
     memory_size_limit: str = Field('1GB', title='Maximum size for cache in memory, e.g. 1GB, 500MB')
     path: Optional[str] = Field(os.path.join(_default_home, "cache"), env="VAEX_CACHE_PATH", title="Storage location for cache results. Defaults to `${VAEX_HOME}/cache`")
+    column_memory_size_limit: Optional[str] = Field(None, title="Maximum size in memory for columns cached by DataFrame.materialize (e.g. 1GB, 500MB), least recently used chunks are evicted first. No limit when not set")
+    column_disk_path: Optional[str] = Field(None, title="When set, chunks of cached columns evicted from memory are spilled to this directory, and memory mapped back on access")
+    column_disk_size_limit: str = Field('10GB', title='Maximum size on disk for spilled chunks of cached columns, e.g. 10GB, 500MB')
+    partial: bool = Field(True, title="Cache the partial results of aggregations per dataset of a concatenated dataframe, such that after appending data, only the new data is processed. Requires a memory cache, since the partial results cannot be pickled")
 
     class Config(ConfigDefault):
         env_prefix = 'vaex_cache_'
 
 
+class Sort(BaseSettings):
+    """Configure out-of-core sorting, used by [DataFrame.sort](api.html#vaex.dataframe.DataFrame.sort) and exporting sorted data."""
+    memory_limit: Optional[str] = Field(None, title="When set (e.g. 1GB, 500MB), sort keys that do not fit in this amount of memory are sorted externally, by spilling sorted chunks to disk")
+    path: Optional[str] = Field(None, title="Directory to spill sorted chunks to, defaults to the temporary directory of the system")
+
+    class Config(ConfigDefault):
+        env_prefix = 'vaex_sort_'
+
+
+class ExportPartitioned(BaseSettings):
+    """Configure exporting partitioned files, used by [DataFrame.export_partitioned](api.html#vaex.dataframe.DataFrameLocal.export_partitioned)."""
+    max_open_files: int = Field(64, title="Maximum number of files that are open for writing at the same time, the least recently used file is closed (and a new file started) when more are needed", gt=0)
+    memory_limit: str = Field('512MB', title="Maximum amount of memory used to buffer rows before they are written to the file of their partition, e.g. 1GB, 500MB")
+    file_size_limit: Optional[str] = Field(None, title="When set (e.g. 1GB, 500MB), a new file is started for a partition when the (uncompressed) amount of data written exceeds this size")
+    path: Optional[str] = Field(None, title="Directory to write temporary files to for formats that cannot be written incrementally (e.g. HDF5), defaults to the temporary directory of the system")
+
+    class Config(ConfigDefault):
+        env_prefix = 'vaex_export_partitioned_'
+
+
+class GroupBy(BaseSettings):
+    """Configure groupby (and out-of-core groupby), used by [DataFrame.groupby](api.html#vaex.dataframe.DataFrame.groupby)."""
+    memory_limit: Optional[str] = Field(None, title="When set (e.g. 10GB), a groupby with more groups than fit in this amount of memory spills the rows to disk, partitioned by the hash of the keys, and aggregates each partition separately. Defaults to the maximum memory of the memory tracker")
+    path: Optional[str] = Field(None, title="Directory to spill rows and the aggregated partitions to, defaults to the temporary directory of the system")
+    hash_map_per_thread: bool = Field(True, title="Let each thread fill its own hash map with the keys (of a primitive type) of a groupby or unique, and merge them in parallel afterwards. Uses more memory when there are many unique keys, otherwise all threads share a single hash map")
+
+    class Config(ConfigDefault):
+        env_prefix = 'vaex_groupby_'
+
+
+class Csv(BaseSettings):
+    """Configure lazy reading of CSV files, see [vaex.from_csv_arrow](api.html#vaex.from_csv_arrow)."""
+    index: bool = Field(False, title="Store the row and byte offsets of the chunks, the offsets of the frames of a block compressed file, and the inferred schema of a CSV file on disk (keyed by the fingerprint of the file), so that opening the file again does not require a pass over the file")
+    path: str = Field(os.path.join(_default_home, "csv"), title="Storage location for the CSV indices. Defaults to `${VAEX_HOME}/csv`")
+
+    class Config(ConfigDefault):
+        env_prefix = 'vaex_csv_'
+
+
+class Index(BaseSettings):
+    """Configure persistent indices, used by [DataFrame.join](api.html#vaex.dataframe.DataFrame.join) to avoid rebuilding the index of the right DataFrame for each join."""
+    persist: bool = Field(False, title="Store the index of a column on disk (keyed by the fingerprint of the DataFrame and the expression), and memory map it when the same index is needed again")
+    path: str = Field(os.path.join(_default_home, "index"), title="Storage location for persisted indices. Defaults to `${VAEX_HOME}/index`")
+
+    class Config(ConfigDefault):
+        env_prefix = 'vaex_index_'
+
+
+class Materialize(BaseSettings):
+    """Configure persistent materialization of virtual columns, used by [DataFrame.materialize](api.html#vaex.dataframe.DataFrame.materialize)."""
+    persist: bool = Field(False, title="Store materialized virtual columns on disk (keyed by the expression and the fingerprint of the dataset), instead of in memory")
+    reuse: bool = Field(True, title="When evaluating an expression, read its values from the stored materialization when it exists")
+    path: str = Field(os.path.join(_default_home, "materialized"), title="Storage location for materialized columns. Defaults to `${VAEX_HOME}/materialized`")
+
+    class Config(ConfigDefault):
+        env_prefix = 'vaex_materialize_'
+
+
+class ZoneMap(BaseSettings):
+    """Configure zone maps (statistics per range of rows of a column), used to skip reading chunks of data that cannot pass a filter."""
+    enabled: bool = Field(True, title="Use the zone maps stored in HDF5 and Parquet files to skip chunks that cannot pass the filter")
+    size: int = Field(2**16, title="Number of rows per zone when writing zone maps to HDF5 files, 0 disables writing them")
+    bloom: int = Field(0, title="Size in bytes of the bloom filter per zone written to HDF5 files, used for equality filters (0 disables it)")
+
+    class Config(ConfigDefault):
+        env_prefix = 'vaex_zonemap_'
+
+
 class AsyncEnum(str, Enum):
     nest = 'nest'
     awaitio = 'awaitio'
@@ -161,6 +236,7 @@ class Settings(BaseSettings):
     home: str = Field(_default_home, env="VAEX_HOME", title="Home directory for vaex, which defaults to `$HOME/.vaex`, "\
         " If both `$VAEX_HOME` and `$HOME` are not defined, the current working directory is used. (Note that this setting cannot be configured from the vaex home directory itself).")
     mmap: bool = Field(True, title="Experimental to turn off, will avoid using memory mapping if set to False")
+    shared_pass: bool = Field(True, title="Pass over the data once for DataFrames whose datasets share the same leafs (e.g. copies with added or renamed columns), reading each column only once")
     process_count: Optional[int] = Field(None, title="Number of processes to use for multiprocessing (e.g. apply), defaults to thread_count setting", gt=0)
     thread_count: Optional[int] = Field(None, env='VAEX_NUM_THREADS', title="Number of threads to use for computations, defaults to multiprocessing.cpu_count()", gt=0)
     thread_count_io: Optional[int] = Field(None, env='VAEX_NUM_THREADS_IO', title="Number of threads to use for IO, defaults to thread_count_io + 1", gt=0)
@@ -171,13 +247,20 @@ class Settings(BaseSettings):
     # avoid name collisions of VAEX_CACHE with configurting the whole object via json in env var
     cache: Cache = Field(Cache(), env='_VAEX_CACHE')
     chunk: Chunk = Field(Chunk(), env='_VAEX_CHUNK')
+    csv: Csv = Field(Csv(), env='_VAEX_CSV')
     data: Data = Field(Data(), env='_VAEX_DATA')
     display: Display = Field(Display(), env='_VAEX_DISPLAY')
     fs: FileSystem = Field(FileSystem(), env='_VAEX_FS')
+    groupby: GroupBy = Field(GroupBy(), env='_VAEX_GROUPBY')
+    index: Index = Field(Index(), env='_VAEX_INDEX')
+    materialize: Materialize = Field(Materialize(), env='_VAEX_MATERIALIZE')
     memory_tracker: MemoryTracker = Field(MemoryTracker(), env='_VAEX_MEMORY_TRACKER')
     task_tracker: TaskTracker = Field(TaskTracker(), env='_VAEX_TASK_TRACKER')
     logging: Logging = Field(Logging(), env="_VAEX_LOGGING")
     progress: Progress = Field(Progress(), env="_VAEX_PROGRESS")
+    sort: Sort = Field(Sort(), env="_VAEX_SORT")
+    export_partitioned: ExportPartitioned = Field(ExportPartitioned(), env="_VAEX_EXPORT_PARTITIONED")
+    zonemap: ZoneMap = Field(ZoneMap(), env="_VAEX_ZONEMAP")
 
     if has_server:
         server: vaex.server.settings.Settings = vaex.server.settings.Settings()
@@ -280,6 +363,7 @@ def _to_md(cls, f=sys.stdout):
         flat = {
             Settings: 'main',
             Chunk: 'main.chunk',
+            Csv: 'main.csv',
             Display: 'display',
             vaex.server.settings.Settings: 'server',
             Cache: 'cache',
@@ -290,6 +374,12 @@ def _to_md(cls, f=sys.stdout):
             Data: 'data',
             Logging: 'main.logging',
             Progress: 'main.progress',
+            Sort: 'main.sort',
+            ExportPartitioned: 'main.export_partitioned',
+            GroupBy: 'main.groupby',
+            Index: 'main.index',
+            Materialize: 'main.materialize',
+            ZoneMap: 'main.zonemap',
         }[cls]
         pyvar = f'vaex.settings.{flat}.{pyname}'
         printf(f'Python settings `{pyvar}`')
@@ -0,0 +1,227 @@
+"""Out-of-core (external merge) sorting of DataFrames.
+
+The sort keys are evaluated chunk by chunk on the thread pool of the executor,
+each thread collects its sorted chunks until its share of the memory limit is
+reached, and spills them (sorted together) to disk as a memory mapped Arrow IPC
+file (a 'run'). The runs are then merged into a single permutation array, which
+is memory mapped as well, so that only a bounded amount of keys needs to be in
+memory at any moment.
+"""
+import logging
+import os
+import tempfile
+import threading
+
+from dask.utils import parse_bytes
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute
+
+import vaex.array_types
+import vaex.execution
+import vaex.multithreading
+import vaex.settings
+import vaex.utils
+
+
+logger = logging.getLogger("vaex.sort")
+INDEX_NAME = '__index'
+CHUNK_NAME = '__chunk'
+RUN_NAME = '__run'
+# we estimate the number of bytes per row from a small sample
+SAMPLE_SIZE = 1000
+
+
+def parse_memory_limit(value=None):
+    '''Returns the memory limit for sorting in bytes, or None when not set'''
+    if value is None:
+        value = vaex.settings.main.sort.memory_limit
+    if value is None:
+        return None
+    return parse_bytes(value)
+
+
+def estimate_bytes_per_row(df, by):
+    '''Estimates how many bytes a row of sort keys (including the index) occupies in memory'''
+    n = min(len(df), SAMPLE_SIZE)
+    table = df[by][:n].to_arrow_table()
+    return max(1, table.nbytes // n) + 8
+
+
+def _key_names(by):
+    # expressions can contain any character, so we use simple names
+    return [f'key_{i}' for i in range(len(by))]
+
+
+def _normalize(array):
+    # all runs should have the same schema, so we avoid mixing (large) string types
+    if pa.types.is_string(array.type):
+        array = array.cast(pa.large_string())
+    elif pa.types.is_binary(array.type):
+        array = array.cast(pa.large_binary())
+    return array
+
+
+class Run:
+    '''A sorted piece of the sort keys, stored on disk
+
+    A run contains the rows of multiple chunks, which are not adjacent, so we store per row the first row of its chunk,
+    and the index in the chunk, which are translated to a row number (of the filtered rows) when reading.
+    '''
+    def __init__(self, path, length):
+        self.path = path
+        self.length = length
+        self.chunks = None  # (first row, row offset in filtered rows) of all chunks
+        self.table = None
+
+    def open(self):
+        # zero copy, pages are loaded on demand (and the buffers keep the file mapped)
+        source = pa.memory_map(self.path)
+        self.table = pa.ipc.open_file(source).read_all()
+
+    def read(self, start, count):
+        table = self.table.slice(start, count)
+        starts, offsets = self.chunks
+        chunk = np.searchsorted(starts, vaex.array_types.to_numpy(table[CHUNK_NAME]))
+        index = offsets[chunk] + vaex.array_types.to_numpy(table[INDEX_NAME])
+        table = table.select([name for name in table.column_names if name != CHUNK_NAME])
+        return table.set_column(table.schema.get_field_index(INDEX_NAME), INDEX_NAME, pa.array(index))
+
+
+def _write_runs(df, by, sort_keys, directory, run_size, progress):
+    '''Sort the chunks in parallel, and write them to disk as runs of about run_size bytes (per thread)'''
+    names = _key_names(by)
+    # equal keys are ordered by their row number, which is the order of (chunk, index)
+    sort_keys = sort_keys + [(CHUNK_NAME, 'ascending'), (INDEX_NAME, 'ascending')]
+    runs = []
+    chunks = []  # (first row, length)
+    buffers = {}  # thread index -> sorted chunks that are not written yet
+    lock = threading.Lock()
+
+    def write(tables):
+        table = pa.concat_tables(tables)
+        if len(tables) > 1:
+            table = table.take(pa.compute.sort_indices(table, sort_keys=sort_keys))
+        path = os.path.join(directory, f'run-{tables[0][CHUNK_NAME][0].as_py()}.arrow')
+        with pa.OSFile(path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        with lock:
+            runs.append(Run(path, len(table)))
+
+    def map(thread_index, i1, i2, selection_mask, blocks):
+        length = len(blocks[0])
+        if length == 0:  # can happen due to filtering
+            return 0
+        table = pa.table({name: _normalize(vaex.array_types.to_arrow(block)) for name, block in zip(names, blocks)})
+        indices = pa.compute.sort_indices(table, sort_keys=sort_keys[:len(names)])
+        table = table.take(indices)
+        table = table.append_column(CHUNK_NAME, pa.array(np.full(length, i1, dtype=np.int64)))
+        table = table.append_column(INDEX_NAME, indices.cast(pa.int64()))
+        with lock:
+            chunks.append((i1, length))
+        # a thread processes its chunks one by one, so only this thread uses its buffer
+        buffer = buffers.setdefault(thread_index, [])
+        buffer.append(table)
+        if sum(part.nbytes for part in buffer) >= run_size:
+            write(buffer)
+            buffer.clear()
+        return length
+
+    df.map_reduce(map, lambda a, b: a + b, by, info=True, to_numpy=False, pre_filter=df.filtered,
+                  progress=progress, name='sort runs')
+    vaex.multithreading.call_all([lambda buffer=buffer: write(buffer) for buffer in buffers.values() if buffer], df.executor.thread_pool)
+    # the order of the chunks defines the row number (of the filtered rows)
+    chunks.sort()
+    starts = np.array([i1 for i1, length in chunks], dtype=np.int64)
+    offsets = np.cumsum([0] + [length for i1, length in chunks[:-1]], dtype=np.int64)
+    for run in runs:
+        run.chunks = starts, offsets
+    return runs
+
+
+def _merge_runs(runs, sort_keys, out, block_size, progress):
+    '''k-way merge of the runs into the permutation array 'out'
+
+    Instead of merging row by row, we merge in blocks: we keep up to `block_size`
+    rows of each run in memory (the 'pending' rows). The smallest of the last
+    loaded rows of each run is a bound, all pending rows up to and including that
+    bound are guaranteed to be in their final order, since the rows still on disk
+    are all larger. Adding the row index as last key makes all keys unique, and
+    the sort stable.
+    '''
+    sort_keys = sort_keys + [(INDEX_NAME, 'ascending')]
+    cursors = np.zeros(len(runs), dtype=np.int64)
+    lengths = np.array([run.length for run in runs], dtype=np.int64)
+    pending_counts = np.zeros(len(runs), dtype=np.int64)
+    pending = []
+    written = 0
+
+    def load(run_index, count):
+        count = min(count, lengths[run_index] - cursors[run_index])
+        if count > 0:
+            table = runs[run_index].read(cursors[run_index], count)
+            pending.append(table.append_column(RUN_NAME, pa.array(np.full(count, run_index, dtype=np.int64))))
+            cursors[run_index] += count
+            pending_counts[run_index] += count
+
+    for run_index in range(len(runs)):
+        load(run_index, block_size)
+    while True:
+        table = pa.concat_tables(pending)
+        indices = pa.compute.sort_indices(table, sort_keys=sort_keys)
+        table = table.take(indices)
+        row_indices = vaex.array_types.to_numpy(table[INDEX_NAME])
+        active = np.flatnonzero(cursors < lengths)
+        if len(active) == 0:
+            out[written:written + len(row_indices)] = row_indices
+            written += len(row_indices)
+            break
+        # the smallest last loaded row of all runs that are still on disk
+        last_rows = pa.concat_tables([runs[i].read(cursors[i] - 1, 1) for i in active])
+        bound = last_rows[INDEX_NAME][pa.compute.sort_indices(last_rows, sort_keys=sort_keys)[0].as_py()].as_py()
+        count = int(np.flatnonzero(row_indices == bound)[0]) + 1
+        out[written:written + count] = row_indices[:count]
+        written += count
+        pending_counts -= np.bincount(vaex.array_types.to_numpy(table[RUN_NAME])[:count], minlength=len(runs))
+        pending = [table.slice(count)]
+        # top up all runs that are still on disk
+        for run_index in active:
+            load(run_index, block_size - pending_counts[run_index])
+        if progress(written / len(out)) is False:
+            raise vaex.execution.UserAbort('Sorting was cancelled')
+    assert written == len(out), f'Expected {len(out)} sorted rows, but merged {written}'
+    progress(1)
+
+
+def sort_indices(df, by, ascending, memory_limit, progress=None):
+    '''Returns the indices (of the filtered rows) that sort the DataFrame, using at most ~memory_limit bytes for the sort keys
+
+    The indices are stored in a memory mapped (temporary) file.
+    '''
+    names = _key_names(by)
+    sort_keys = [(name, 'ascending' if order else 'descending') for name, order in zip(names, ascending)]
+    length = len(df)
+    bytes_per_row = estimate_bytes_per_row(df, by)
+    directory = vaex.settings.main.sort.path
+    progressbar = vaex.utils.progressbars(progress, title="sort")
+    progressbar_runs = progressbar.add("sort runs")
+    progressbar_merge = progressbar.add("merge runs")
+    with tempfile.TemporaryDirectory(prefix='vaex-sort-', dir=directory) as run_directory:
+        # each thread sorts a run in memory, which can take twice the memory due to the sorting
+        run_size = max(1, memory_limit // (2 * df.executor.thread_pool.nthreads))
+        runs = _write_runs(df, by, sort_keys, run_directory, run_size, progressbar_runs)
+        if not runs:
+            return np.zeros(0, dtype=np.int64)
+        for run in runs:
+            run.open()
+        # pending rows can be twice as large due to the sorting
+        block_size = max(1, memory_limit // (2 * bytes_per_row * len(runs)))
+        logger.info("merging %d runs of %d rows, in blocks of %d rows", len(runs), length, block_size)
+        # the file will be deleted after the last reference to the memory map is gone
+        with tempfile.TemporaryFile(prefix='vaex-sort-indices-', dir=directory) as f:
+            indices = np.memmap(f, dtype=np.int64, mode='w+', shape=(length,))
+        _merge_runs(runs, sort_keys, indices, block_size, progressbar_merge)
+        for run in runs:
+            run.table = None
+    return indices
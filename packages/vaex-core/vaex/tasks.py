@@ -113,6 +113,15 @@ class Task(vaex.promise.Promise):
             self._fingerprint = f'task-{self.name}-{task_fp}-{df_fp}'
         return self._fingerprint
 
+    def fingerprint_partial(self, dataset):
+        '''Id of the partial result of this task on a part (a leaf) of the dataset of the dataframe'''
+        state = self.df._fingerprint_state(self.dependencies())
+        # the active range changes when the dataframe grows, the parts stay the same
+        del state['active_range']
+        fp = vaex.cache.fingerprint(state, dataset.fingerprint)
+        task_fp = vaex.encoding.fingerprint('task', self)
+        return f'task-part-{self.name}-{task_fp}-{fp}'
+
     def progress(self, fraction):
         if not self.cancelled:
             self.cancelled = not all(self.signal_progress.emit(fraction))
@@ -252,6 +261,43 @@ class TaskValueCounts(Task):
         return cls(df, expression=spec["expression"])
 
 
+@register
+class TaskTopK(Task):
+    """Approximate most frequent values (with their counts) per bin, using bounded memory."""
+    snake_name = "top_k"
+
+    def __init__(self, df, binners, expression, capacity, dropnan=False, dropmissing=False, selection=None):
+        expression = str(expression)
+        super().__init__(df=df, expressions=[binner.expression for binner in binners] + [expression], pre_filter=df.filtered, name=self.snake_name)
+        self.binners = binners
+        self.expression = expression
+        self.dtype = self.df.data_type(expression)
+        self.capacity = capacity
+        self.dropnan = dropnan
+        self.dropmissing = dropmissing
+        self.selection = str(selection) if selection is not None else None
+        self.selections = [self.selection]
+
+    def __repr__(self):
+        return f"task-{self.snake_name}: expression={self.expression!r} capacity={self.capacity} selection={self.selection!r} binners={self.binners!r}"
+
+    def encode(self, encoding):
+        return {
+            "binners": encoding.encode_list("binner", self.binners),
+            "expression": self.expression,
+            "dtype": encoding.encode("dtype", self.dtype),
+            "capacity": self.capacity,
+            "dropnan": self.dropnan,
+            "dropmissing": self.dropmissing,
+            "selection": self.selection,
+        }
+
+    @classmethod
+    def decode(cls, encoding, spec, df):
+        binners = tuple(encoding.decode_list('binner', spec['binners']))
+        return cls(df, binners, spec["expression"], spec["capacity"], dropnan=spec["dropnan"], dropmissing=spec["dropmissing"], selection=spec["selection"])
+
+
 @register
 class TaskMapReduce(Task):
     snake_name = "map_reduce"
@@ -0,0 +1,559 @@
+"""Zone maps: statistics per range of rows (a zone) of a column.
+
+A zone map stores for each zone the minimum and maximum value, the number of
+missing values, and optionally a bloom filter. They are written by the HDF5
+writer, and read from the row group statistics of Parquet files. The executor
+uses them to skip reading chunks of which the zone maps prove that no row can
+pass the filter.
+
+Datasets can also prune rows themselves: the filter is translated to a
+``pyarrow.dataset`` expression, which Arrow datasets use to select fragments
+(e.g. hive partitions) and row groups (see :meth:`vaex.dataset.Dataset.pushdown`).
+"""
+import ast
+import logging
+
+import numpy as np
+import pandas as pd
+
+import vaex.array_types
+import vaex.settings
+
+
+logger = logging.getLogger("vaex.zonemap")
+BLOOM_HASHES = 3
+# for isin with more values, we only compare to the smallest and largest value
+ISIN_VALUES_MAX = 64
+_flip = {'>': '<', '>=': '<=', '<': '>', '<=': '>=', '==': '=='}
+_operators = {ast.Gt: '>', ast.GtE: '>=', ast.Lt: '<', ast.LtE: '<=', ast.Eq: '=='}
+
+
+def _bloom_bits(values, bits):
+    '''Returns the bit positions (shape (k, N)) of the values in a bloom filter of the given number of bits'''
+    values = np.asarray(values)
+    if values.dtype.kind == 'f':
+        values = values + 0.0  # -0.0 should hash the same as 0.0
+    if values.dtype.kind in 'mM':
+        values = values.view(np.int64)
+    hashes = pd.util.hash_array(values, categorize=False)
+    # double hashing, we derive the k hashes from two 32 bit hashes
+    h1 = hashes & np.uint64(0xffffffff)
+    h2 = hashes >> np.uint64(32)
+    return np.array([(h1 + np.uint64(i) * h2) % np.uint64(bits) for i in range(BLOOM_HASHES)], dtype=np.int64)
+
+
+class ZoneMap:
+    '''Statistics per zone of a column
+
+    :param offsets: Row offsets of the zones (length is the number of zones + 1)
+    :param min: Minimum value per zone, masked when unknown
+    :param max: Maximum value per zone, masked when unknown
+    :param null_count: Number of missing values per zone, -1 when unknown
+    :param count: Number of values that can compare (not missing or nan) per zone, -1 when unknown
+    :param bloom: Optional bloom filter (uint8 array of shape (zones, bytes)) of the values per zone
+    '''
+    def __init__(self, offsets, min, max, null_count=None, count=None, bloom=None):
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        zones = len(self.offsets) - 1
+        self.min = np.ma.asarray(min)
+        self.max = np.ma.asarray(max)
+        self.null_count = np.full(zones, -1, dtype=np.int64) if null_count is None else np.asarray(null_count, dtype=np.int64)
+        self.count = np.full(zones, -1, dtype=np.int64) if count is None else np.asarray(count, dtype=np.int64)
+        self.bloom = bloom
+        assert len(self.min) == len(self.max) == len(self.null_count) == len(self.count) == zones
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __repr__(self):
+        return f'ZoneMap(zones={len(self)}, rows={self.offsets[-1]})'
+
+    @classmethod
+    def unknown(cls, row_count, dtype=np.float64):
+        '''A single zone without any statistics'''
+        return cls([0, row_count], np.ma.masked_all(1, dtype=dtype), np.ma.masked_all(1, dtype=dtype))
+
+    @classmethod
+    def concat(cls, zone_maps):
+        offsets = [np.zeros(1, dtype=np.int64)]
+        offset = 0
+        for zone_map in zone_maps:
+            offsets.append(zone_map.offsets[1:] + offset)
+            offset += zone_map.offsets[-1]
+        blooms = [zone_map.bloom for zone_map in zone_maps]
+        bloom = None
+        if all(b is not None for b in blooms) and len(set(b.shape[1] for b in blooms)) == 1:
+            bloom = np.concatenate(blooms)
+        return cls(np.concatenate(offsets),
+                   np.ma.concatenate([zone_map.min for zone_map in zone_maps]),
+                   np.ma.concatenate([zone_map.max for zone_map in zone_maps]),
+                   np.concatenate([zone_map.null_count for zone_map in zone_maps]),
+                   np.concatenate([zone_map.count for zone_map in zone_maps]),
+                   bloom)
+
+    def slice(self, start, end):
+        '''Zone map for rows start to end, zones that are partially included keep their statistics'''
+        first = np.searchsorted(self.offsets, start, side='right') - 1
+        last = np.searchsorted(self.offsets, end, side='left')
+        offsets = np.clip(self.offsets[first:last + 1], start, end) - start
+        return self.take(np.arange(first, last), offsets)
+
+    def take(self, indices, offsets):
+        '''Zone map with the statistics of the zones at indices, but with new offsets'''
+        return ZoneMap(offsets, self.min[indices], self.max[indices], self.null_count[indices], self.count[indices],
+                       None if self.bloom is None else self.bloom[indices])
+
+    def align(self, offsets):
+        '''Zone map with zones at the given offsets, which should include all our offsets'''
+        indices = np.searchsorted(self.offsets, offsets[:-1], side='right') - 1
+        return self.take(indices, offsets)
+
+    def may_match(self, op, value):
+        '''Returns per zone if any row can satisfy `column <op> value`'''
+        known = ~np.ma.getmaskarray(self.min) & ~np.ma.getmaskarray(self.max)
+        min = np.ma.getdata(self.min)
+        max = np.ma.getdata(self.max)
+        result = np.ones(len(self), dtype=bool)
+        if known.any():
+            if op == '>':
+                match = max[known] > value
+            elif op == '>=':
+                match = max[known] >= value
+            elif op == '<':
+                match = min[known] < value
+            elif op == '<=':
+                match = min[known] <= value
+            elif op == '==':
+                match = (min[known] <= value) & (max[known] >= value)
+            else:
+                raise ValueError(f'Unsupported operator {op}')
+            result[known] = np.asarray(match, dtype=bool)
+        if op == '==' and self.bloom is not None:
+            bits = self.bloom.shape[1] * 8
+            value_typed = np.array([value]).astype(self.min.dtype)
+            if value_typed[0] != value:
+                # e.g. 1.5 for an integer column
+                return np.zeros(len(self), dtype=bool)
+            positions = _bloom_bits(value_typed, bits)[:, 0]
+            for position in positions:
+                result &= (self.bloom[:, position // 8] & (1 << (position % 8))) != 0
+        # missing values and nan's never compare true
+        result &= self.count != 0
+        return result
+
+
+class ZoneMatch:
+    '''Per zone if any row can pass a filter, as told by a dataset
+
+    :param offsets: Row offsets of the zones (length is the number of zones + 1)
+    :param match: Boolean array, False when no row in the zone can pass the filter
+    '''
+    def __init__(self, offsets, match):
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.match = np.asarray(match, dtype=bool)
+        assert len(self.match) == len(self.offsets) - 1
+
+    def __len__(self):
+        return len(self.match)
+
+    def __repr__(self):
+        return f'ZoneMatch(zones={len(self)}, rows={self.offsets[-1]}, match={self.match.sum()})'
+
+    @classmethod
+    def unknown(cls, row_count):
+        return cls([0, row_count], [True])
+
+    @classmethod
+    def concat(cls, zone_matches):
+        offsets = [np.zeros(1, dtype=np.int64)]
+        offset = 0
+        for zone_match in zone_matches:
+            offsets.append(zone_match.offsets[1:] + offset)
+            offset += zone_match.offsets[-1]
+        return cls(np.concatenate(offsets), np.concatenate([zone_match.match for zone_match in zone_matches]))
+
+    def slice(self, start, end):
+        first = np.searchsorted(self.offsets, start, side='right') - 1
+        last = np.searchsorted(self.offsets, end, side='left')
+        offsets = np.clip(self.offsets[first:last + 1], start, end) - start
+        return ZoneMatch(offsets, self.match[first:last])
+
+    def align(self, offsets):
+        '''Per zone match at the given offsets, which should include all our offsets'''
+        indices = np.searchsorted(self.offsets, offsets[:-1], side='right') - 1
+        return self.match[indices]
+
+
+class ZoneMapBuilder:
+    '''Builds a zone map from values that are passed in order (e.g. while writing a column)'''
+    def __init__(self, length, zone_size, dtype, bloom=0):
+        self.zone_size = zone_size
+        self.dtype = dtype
+        self.bloom_bytes = bloom
+        zones = max(1, (length + zone_size - 1) // zone_size)
+        self.offsets = np.minimum(np.arange(zones + 1, dtype=np.int64) * zone_size, length)
+        self.min = np.ma.masked_all(zones, dtype=dtype)
+        self.max = np.ma.masked_all(zones, dtype=dtype)
+        self.null_count = np.zeros(zones, dtype=np.int64)
+        self.count = np.zeros(zones, dtype=np.int64)
+        self.bloom = np.zeros((zones, bloom), dtype=np.uint8) if bloom else None
+        self.offset = 0
+
+    def update(self, values):
+        values = vaex.array_types.to_numpy(values)
+        while len(values):
+            zone = self.offset // self.zone_size
+            length = min(len(values), self.offsets[zone + 1] - self.offset)
+            self._update_zone(zone, values[:length])
+            values = values[length:]
+            self.offset += length
+
+    def _update_zone(self, zone, values):
+        null = np.ma.getmaskarray(values)
+        data = np.ma.getdata(values)
+        valid = ~null
+        if data.dtype.kind == 'f':
+            valid &= ~np.isnan(data)
+        data = data[valid]
+        self.null_count[zone] += null.sum()
+        self.count[zone] += len(data)
+        if len(data):
+            min, max = data.min(), data.max()
+            if self.min.mask[zone] or min < self.min[zone]:
+                self.min[zone] = min
+            if self.max.mask[zone] or max > self.max[zone]:
+                self.max[zone] = max
+            if self.bloom is not None:
+                positions = _bloom_bits(data, self.bloom_bytes * 8).ravel()
+                np.bitwise_or.at(self.bloom[zone], positions // 8, (1 << (positions % 8)).astype(np.uint8))
+
+    def finish(self):
+        return ZoneMap(self.offsets, self.min, self.max, self.null_count, self.count, self.bloom)
+
+
+def _constant(df, node):
+    '''Returns the value of an ast node if it is a constant, otherwise raises ValueError'''
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float, str)) and not isinstance(node.value, bool):
+        return node.value
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+        return -_constant(df, node.operand)
+    if isinstance(node, ast.Name) and node.id in df.variables:
+        value = df.variables[node.id]
+        if np.ndim(value) == 0 and isinstance(value, (int, float, np.number, np.datetime64, np.timedelta64)):
+            return value
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in ['scalar_datetime', 'scalar_timedelta'] and not node.keywords:
+        args = [_constant(df, arg) for arg in node.args]
+        if node.func.id == 'scalar_datetime':
+            return np.datetime64(*args)
+        else:
+            return np.timedelta64(*args)
+    raise ValueError('not a constant')
+
+
+def _isin_values(df, node):
+    '''Returns the values of the variable passed to isin or isin_set, raises ValueError if unknown or containing missing values or nan'''
+    if not (isinstance(node, ast.Name) and node.id in df.variables):
+        raise ValueError('not a variable')
+    values = df.variables[node.id]
+    if hasattr(values, 'keys') and hasattr(values, 'has_null'):  # a HashMapUnique created by isin
+        if values.has_null or values.has_nan:
+            raise ValueError('contains missing values or nan')
+        values = values.keys()
+    if vaex.array_types.is_string(values):
+        if values.null_count:
+            raise ValueError('contains missing values')
+        values = np.array(values.to_pylist(), dtype=object)
+    values = vaex.array_types.to_numpy(values)
+    if values.ndim != 1 or np.ma.is_masked(values) or (values.dtype.kind == 'f' and np.isnan(values).any()):
+        raise ValueError('contains missing values or nan')
+    return np.ma.getdata(values)
+
+
+def _is_isin(node):
+    return isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in ['isin', 'isin_set'] and len(node.args) == 2 and not node.keywords
+
+
+class _Predicate:
+    '''Evaluates (a subset of) a boolean expression on zone maps, giving per zone if a row can pass'''
+    def __init__(self, df, dataset):
+        self.df = df
+        self.dataset = dataset
+        self.zone_maps = {}
+        self.zone_matches = {}  # id of the selection -> ZoneMatch
+        import vaex.dataset
+        # only translate the filter into an arrow expression when a dataset can use it
+        self.can_pushdown = any(type(leaf).pushdown is not vaex.dataset.Dataset.pushdown for leaf in dataset.leafs())
+
+    def columns(self, node):
+        '''Collects the zone maps for all columns we can use'''
+        for child in ast.walk(node):
+            if isinstance(child, ast.Name) and child.id not in self.zone_maps and self._is_column(child.id):
+                zone_map = self.dataset.zone_map(child.id)
+                if zone_map is not None:
+                    self.zone_maps[child.id] = zone_map
+
+    def _is_column(self, name):
+        return name in self.dataset and name not in self.df.virtual_columns and name not in self.df.variables
+
+    def evaluate(self, node, zones):
+        '''Returns a boolean array (per zone), or None when unknown'''
+        if isinstance(node, ast.Expression):
+            return self.evaluate(node.body, zones)
+        if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.BitAnd, ast.BitOr)) or isinstance(node, ast.BoolOp):
+            if isinstance(node, ast.BoolOp):
+                is_and = isinstance(node.op, ast.And)
+                operands = node.values
+            else:
+                is_and = isinstance(node.op, ast.BitAnd)
+                operands = [node.left, node.right]
+            results = [self.evaluate(operand, zones) for operand in operands]
+            if is_and:
+                results = [result for result in results if result is not None]
+                return np.logical_and.reduce(results) if results else None
+            else:
+                if any(result is None for result in results):
+                    return None
+                return np.logical_or.reduce(results)
+        comparison = None
+        if isinstance(node, ast.Compare) and len(node.ops) == 1 and type(node.ops[0]) in _operators:
+            comparison = _operators[type(node.ops[0])], node.left, node.comparators[0]
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == 'str_equals' and len(node.args) == 2 and not node.keywords:
+            # string comparisons are rewritten to str_equals(a, b)
+            comparison = '==', node.args[0], node.args[1]
+        if comparison is not None:
+            op, left, right = comparison
+            if isinstance(right, ast.Name) and right.id in self.zone_maps:
+                left, right = right, left
+                op = _flip[op]
+            if isinstance(left, ast.Name) and left.id in self.zone_maps:
+                try:
+                    value = _constant(self.df, right)
+                except ValueError:
+                    return None
+                return self._may_match(self.zone_maps[left.id].align(zones), op, value)
+        if _is_isin(node) and isinstance(node.args[0], ast.Name) and node.args[0].id in self.zone_maps:
+            try:
+                values = _isin_values(self.df, node.args[1])
+            except ValueError:
+                return None
+            zone_map = self.zone_maps[node.args[0].id].align(zones)
+            if len(values) == 0:
+                return np.zeros(len(zone_map), dtype=bool)
+            if len(values) <= ISIN_VALUES_MAX:
+                results = [self._may_match(zone_map, '==', value) for value in values]
+            else:
+                results = [self._may_match(zone_map, '>=', values.min()), self._may_match(zone_map, '<=', values.max())]
+                results = [np.logical_and.reduce(results)] if all(result is not None for result in results) else [None]
+            if any(result is None for result in results):
+                return None
+            return np.logical_or.reduce(results)
+        return None
+
+    def _may_match(self, zone_map, op, value):
+        dtype = zone_map.min.dtype
+        try:
+            if dtype.kind in 'mM':
+                value = np.array(value)
+                rounded = value.astype(dtype)
+                if value.dtype.kind in 'mM' and rounded.astype(value.dtype) != value:
+                    # a constant with a finer resolution than the column is rounded, such that
+                    # we never skip a zone that may match: down for > and >=, and up for < and <=
+                    if op == '==':
+                        return None
+                    if rounded > value:
+                        rounded = rounded - 1
+                    if op in ('<', '<='):
+                        rounded = rounded + 1
+                value = rounded
+            elif dtype.kind in 'biuf' and isinstance(value, str):
+                return None
+            elif dtype.kind in 'OSU' and not isinstance(value, str):
+                return None
+            return zone_map.may_match(op, value)
+        except (TypeError, ValueError):
+            return None
+
+    def pushdown(self, key, node):
+        '''Lets the dataset tell which zones can pass (a subset of) the expression'''
+        if not self.can_pushdown:
+            return
+        filter = self.to_arrow(node)
+        if filter is not None:
+            columns = {child.id for child in ast.walk(node) if isinstance(child, ast.Name) and self._is_column(child.id)}
+            zone_match = self.dataset.pushdown(filter, sorted(columns))
+            if zone_match is not None:
+                self.zone_matches[key] = zone_match
+
+    def to_arrow(self, node):
+        '''Translates (a subset of) a boolean expression into a pyarrow.dataset expression, or None when unknown
+
+        Parts of an and that cannot be translated are left out, which gives a filter that passes a superset of the rows.
+        '''
+        import pyarrow as pa
+        import pyarrow.dataset
+        if isinstance(node, ast.Expression):
+            return self.to_arrow(node.body)
+        if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.BitAnd, ast.BitOr)) or isinstance(node, ast.BoolOp):
+            if isinstance(node, ast.BoolOp):
+                is_and = isinstance(node.op, ast.And)
+                operands = node.values
+            else:
+                is_and = isinstance(node.op, ast.BitAnd)
+                operands = [node.left, node.right]
+            results = [self.to_arrow(operand) for operand in operands]
+            if is_and:
+                results = [result for result in results if result is not None]
+            if not results or any(result is None for result in results):
+                return None
+            filter = results[0]
+            for result in results[1:]:
+                filter = (filter & result) if is_and else (filter | result)
+            return filter
+        comparison = None
+        if isinstance(node, ast.Compare) and len(node.ops) == 1 and type(node.ops[0]) in _operators:
+            comparison = _operators[type(node.ops[0])], node.left, node.comparators[0]
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == 'str_equals' and len(node.args) == 2 and not node.keywords:
+            comparison = '==', node.args[0], node.args[1]
+        if comparison is not None:
+            op, left, right = comparison
+            if isinstance(right, ast.Name) and self._is_column(right.id):
+                left, right = right, left
+                op = _flip[op]
+            if isinstance(left, ast.Name) and self._is_column(left.id):
+                try:
+                    value = _constant(self.df, right)
+                except ValueError:
+                    return None
+                field = pyarrow.dataset.field(left.id)
+                try:
+                    value = _arrow_scalar(value)
+                except (TypeError, ValueError, pa.ArrowException):
+                    return None
+                return {'>': field > value, '>=': field >= value, '<': field < value, '<=': field <= value, '==': field == value}[op]
+        if _is_isin(node) and isinstance(node.args[0], ast.Name) and self._is_column(node.args[0].id):
+            try:
+                values = _isin_values(self.df, node.args[1])
+            except ValueError:
+                return None
+            return pyarrow.dataset.field(node.args[0].id).isin(pa.array(values))
+        return None
+
+
+def _arrow_scalar(value):
+    import pyarrow as pa
+    if isinstance(value, (np.datetime64, np.timedelta64)):
+        unit, _ = np.datetime_data(value.dtype)
+        if unit not in ('s', 'ms', 'us', 'ns'):
+            # arrow only knows these units, coarser units (days, minutes, ...) convert exactly to seconds
+            converted = value.astype(f'{value.dtype.kind}8[s]')
+            if converted.astype(value.dtype) != value:
+                raise ValueError(f'cannot represent {value} in arrow')
+            value = converted
+        return pa.scalar(value)
+    return pa.scalar(value.item() if isinstance(value, np.number) else value)
+
+
+def _selection_zones(predicate, selection, zones):
+    import vaex.selections
+    if selection is None:
+        return None
+    if isinstance(selection, vaex.selections.SelectionExpression):
+        try:
+            node = ast.parse(selection.boolean_expression, mode='eval')
+        except SyntaxError:
+            current = None
+        else:
+            current = predicate.evaluate(node, zones)
+        zone_match = predicate.zone_matches.get(id(selection))
+        if zone_match is not None:
+            match = zone_match.align(zones)
+            current = match if current is None else current & match
+    else:
+        current = None
+    if selection.mode == 'replace' or selection.previous_selection is None:
+        return current if selection.mode in ['replace', 'and', 'or'] else None
+    previous = _selection_zones(predicate, selection.previous_selection, zones)
+    if selection.mode == 'and':
+        if previous is None:
+            return current
+        if current is None:
+            return previous
+        return previous & current
+    if selection.mode == 'or':
+        if previous is None or current is None:
+            return None
+        return previous | current
+    if selection.mode == 'subtract':
+        # a subset of previous
+        return previous
+    return None
+
+
+def _collect(predicate, selection):
+    import vaex.selections
+    while selection is not None:
+        if isinstance(selection, vaex.selections.SelectionExpression):
+            try:
+                node = ast.parse(selection.boolean_expression, mode='eval')
+            except SyntaxError:
+                pass
+            else:
+                predicate.columns(node)
+                predicate.pushdown(id(selection), node)
+        selection = selection.previous_selection
+
+
+def filter_zones(dataset, dfs):
+    '''Returns (offsets, match) where match says per zone if any row can pass the filter of any of the DataFrames
+
+    Returns None if the zone maps of the dataset cannot tell anything.
+    '''
+    import vaex.dataframe
+    predicates = []
+    offsets = []
+    for df in dfs:
+        if not df.filtered:
+            return None
+        predicate = _Predicate(df, dataset)
+        selection = df.get_selection(vaex.dataframe.FILTER_SELECTION_NAME)
+        _collect(predicate, selection)
+        if not predicate.zone_maps and not predicate.zone_matches:
+            return None
+        predicates.append((predicate, selection))
+        offsets.extend(zone_map.offsets for zone_map in predicate.zone_maps.values())
+        offsets.extend(zone_match.offsets for zone_match in predicate.zone_matches.values())
+    zones = np.unique(np.concatenate(offsets))
+    if zones[0] != 0 or zones[-1] != dataset.row_count:
+        logger.warning("zone maps do not cover all rows of the dataset, ignoring them")
+        return None
+    match = np.zeros(len(zones) - 1, dtype=bool)
+    for predicate, selection in predicates:
+        match_df = _selection_zones(predicate, selection, zones)
+        if match_df is None:
+            return None
+        match |= match_df
+    return zones, match
+
+
+def read_ranges(dataset, dfs):
+    '''Returns the row ranges [(i1, i2), ...] that need to be read, or None if no zone can be skipped'''
+    if not vaex.settings.main.zonemap.enabled:
+        return None
+    result = filter_zones(dataset, dfs)
+    if result is None:
+        return None
+    zones, match = result
+    if match.all():
+        return None
+    ranges = []
+    for i1, i2, keep in zip(zones[:-1], zones[1:], match):
+        if keep:
+            if ranges and ranges[-1][1] == i1:
+                ranges[-1] = (ranges[-1][0], int(i2))
+            else:
+                ranges.append((int(i1), int(i2)))
+    if not ranges:
+        # consumers (like evaluate) expect at least one (possibly empty after filtering) chunk
+        ranges = [(int(zones[0]), int(zones[1]))]
+    logger.debug("zone maps skip %d of %d rows", dataset.row_count - sum(i2 - i1 for i1, i2 in ranges), dataset.row_count)
+    return ranges
@@ -16,6 +16,7 @@ import vaex.column
 from vaex.column import ColumnNumpyLike, ColumnStringArrow
 import vaex.arrow.convert
 import vaex.array_types
+import vaex.zonemap
 
 astropy = vaex.utils.optional_import("astropy.units")
 
@@ -53,6 +54,20 @@ def _try_unit(unit):
     else:
         return unit
 
+
+def _read_zone_map(group):
+    count = group["count"][:]
+    values = {}
+    for name in ["min", "max"]:
+        data = group[name][:]
+        if "dtype" in group[name].attrs:
+            data = data.view(group[name].attrs["dtype"])
+        # zones without values (only missing values or nan's) have no min or max
+        values[name] = np.ma.array(data, mask=count == 0)
+    bloom = group["bloom"][:] if "bloom" in group else None
+    return vaex.zonemap.ZoneMap(group["offsets"][:], values["min"], values["max"], group["null_count"][:], count, bloom)
+
+
 @vaex.dataset.register
 class Hdf5MemoryMapped(DatasetMemoryMapped):
     snake_name = "hdf5"
@@ -187,6 +202,7 @@ class Hdf5MemoryMapped(DatasetMemoryMapped):
         self.ucds = {}
         self.descriptions = {}
         self.units = {}
+        self._zone_maps = {}
 
         if self.group is None:
             if "data" in self.h5file:
@@ -370,6 +386,8 @@ class Hdf5MemoryMapped(DatasetMemoryMapped):
                     column = self._map_hdf5_array(column)
                     self.add_column(column_name, column)
                 elif hasattr(column["data"], "dtype"):
+                    if "zonemap" in column:
+                        self._zone_maps[column_name] = _read_zone_map(column["zonemap"])
                     column = self._map_column(column)
                     self.add_column(column_name, column)
                     dtype = vaex.dtype_of(column)
@@ -413,6 +431,9 @@ class Hdf5MemoryMapped(DatasetMemoryMapped):
                     return self._map_hdf5_array(data, as_arrow=as_arrow)
 
 
+    def zone_map(self, column):
+        return self._zone_maps.get(column)
+
     def close(self):
         super().close()
         self.h5file.close()
@@ -9,7 +9,9 @@ from pyarrow.types import is_temporal
 
 import vaex
 import vaex.array_types
+import vaex.settings
 import vaex.utils
+import vaex.zonemap
 from .utils import h5mmap
 from vaex.column import ColumnStringArrow, _to_string_sequence
 
@@ -32,11 +34,16 @@ class Writer:
         self._layout_called = False
 
     def close(self):
+        zone_maps = {name: writer.zone_map.finish() for name, writer in getattr(self, 'column_writers', {}).items()
+                     if getattr(writer, 'zone_map', None) is not None and writer.zone_map.offset == writer.count}
         # make sure we don't have references to the numpy arrays any more
         self.column_writers = {}
         if self.mmap is not None:
             self.mmap.close()
             self.file.close()
+        # the zone maps are small, and written after all data, via h5py
+        for name, zone_map in zone_maps.items():
+            write_zone_map(self.columns[name], zone_map)
         self.h5.close()
         
     def __enter__(self):
@@ -134,6 +141,20 @@ class Writer:
                         list(map(write, enumerate(column_names_subgroup)))
 
 
+def write_zone_map(h5parent, zone_map):
+    group = h5parent.require_group("zonemap")
+    group.create_dataset("offsets", data=zone_map.offsets, track_times=False)
+    for name in ["min", "max"]:
+        values = np.ma.getdata(getattr(zone_map, name))
+        dataset = group.create_dataset(name, data=values.view(np.int64) if values.dtype.kind in 'mM' else values, track_times=False)
+        if values.dtype.kind in 'mM':
+            dataset.attrs["dtype"] = values.dtype.name
+    group.create_dataset("null_count", data=zone_map.null_count, track_times=False)
+    group.create_dataset("count", data=zone_map.count, track_times=False)
+    if zone_map.bloom is not None:
+        group.create_dataset("bloom", data=zone_map.bloom, track_times=False)
+
+
 class ColumnWriterDictionaryEncoded:
     def __init__(self, h5parent, name, dtype, values, shape, has_null, byteorder="=", df=None):
         if has_null:
@@ -220,6 +241,11 @@ class ColumnWriterPrimitive:
         else:
             self.mask = None
 
+        self.zone_map = None
+        zone_size = vaex.settings.main.zonemap.size
+        if zone_size and dtype.kind in 'biufmM' and len(self.shape) == 1:
+            self.zone_map = vaex.zonemap.ZoneMapBuilder(self.count, zone_size, dtype.numpy, bloom=vaex.settings.main.zonemap.bloom)
+
     @property
     def progress(self):
         return self.to_offset/self.count
@@ -236,6 +262,8 @@ class ColumnWriterPrimitive:
             target_set_item = slice(self.to_offset, self.to_offset + no_values)
             if vaex.array_types.is_arrow_array(values):
                 values = vaex.arrow.convert.ensure_not_chunked(values)
+            if self.zone_map is not None:
+                self.zone_map.update(values)
             if self.dtype.kind in 'mM':
                 if vaex.array_types.is_arrow_array(values):
                     values = values.view(pa.int64())
@@ -24,6 +24,8 @@ class Client:
         self.df_map = {}
         self.executor = Executor(self)
         self._msg_id_to_tasks = {}
+        # jobs with a higher priority are executed first by the server
+        self.priority = 0
 
     def _check_version(self):
         versions = self.get_versions()
@@ -37,6 +39,11 @@ class Client:
         reply, encoding = self._send({'command': 'versions'})
         return reply
 
+    def get_metrics(self):
+        '''Returns the queue depth and latency metrics of the job scheduler of the server'''
+        reply, encoding = self._send({'command': 'metrics'})
+        return reply
+
     def close(self):
         raise NotImplementedError
 
@@ -79,7 +86,7 @@ class Client:
         msg_id = str(uuid.uuid4())
         self._msg_id_to_tasks[msg_id] = tuple(tasks)
         task_specs = encoder.encode_list("task", tasks)
-        msg = {'command': 'execute', 'df': df.name, 'state': df.state_get(), 'tasks': task_specs}
+        msg = {'command': 'execute', 'df': df.name, 'state': df.state_get(), 'tasks': task_specs, 'priority': self.priority}
         try:
             results, encoding = self._send(msg, msg_id=msg_id)
             results = encoding.decode_list('vaex-task-result', results)
@@ -93,7 +100,7 @@ class Client:
         msg_id = str(uuid.uuid4())
         self._msg_id_to_tasks[msg_id] = tuple(tasks)
         task_specs = encoder.encode_list("task", tasks)
-        msg = {'command': 'execute', 'df': df.name, 'state': df.state_get(), 'tasks': task_specs}
+        msg = {'command': 'execute', 'df': df.name, 'state': df.state_get(), 'tasks': task_specs, 'priority': self.priority}
         try:
             results, encoding = await self._send_async(msg, msg_id=msg_id)
             results = encoding.decode_list('vaex-task-result', results)
@@ -121,6 +121,11 @@ async def root():
     return content
 
 
+@router.get("/metrics", summary="Queue depth and latency of the job scheduler")
+async def metrics():
+    return service_threaded.metrics()
+
+
 @router.get("/dataset", summary="Lists all dataset names")
 async def dataset():
     return list(datasets.keys())
@@ -409,7 +414,13 @@ def update_service(dfs=None):
     service_bare = vaex.server.service.Service(dfs)
     server_thread_count = 1
     threads_per_job = 32
-    service_threaded = vaex.server.service.AsyncThreadedService(service_bare, server_thread_count, threads_per_job)
+    fair_share = vaex.settings.main.server.fair_share
+    # with fair share, the extra thread is only used by a job that preempts another
+    service_threaded = vaex.server.service.AsyncThreadedService(service_bare, server_thread_count + (1 if fair_share else 0), threads_per_job)
+    if fair_share:
+        service_threaded = vaex.server.service.FairShareService(service_threaded, concurrent_jobs=vaex.settings.main.server.concurrent_jobs or server_thread_count)
+    if vaex.settings.main.server.coalesce:
+        service_threaded = vaex.server.service.CoalescingService(service_threaded)
 
 
 def main(argv=sys.argv):
@@ -1,7 +1,13 @@
 import asyncio
+import collections
 import concurrent.futures
 import logging
+import sys
 import threading
+import time
+
+import cachetools
+import numpy as np
 
 import vaex
 
@@ -33,7 +39,13 @@ class Service:
         method = getattr(df, methodname)
         return method(*args, **kwargs)
 
-    async def execute(self, df, tasks, progress=None):
+    def metrics(self):
+        return {}
+
+    async def execute(self, df, tasks, progress=None, client=None, priority=0, on_start=None):
+        # on_start is called when the tasks are taken, after that no tasks can be added
+        if on_start:
+            on_start()
         assert df.executor.tasks == []
         tasks = [df.executor.schedule(task) for task in tasks]
         await df.execute_async()
@@ -57,10 +69,14 @@ class Proxy:
     def _rmi(self, df, methodname, args, kwargs):
         return self.service._rmi(df, methodname, args, kwargs)
 
+    def metrics(self):
+        return self.service.metrics()
+
 
 class AsyncThreadedService(Proxy):
     def __init__(self, service, thread_count, threads_per_job):
         super().__init__(service)
+        self.thread_count = thread_count
         self.threads_per_job = threads_per_job
         self.thread_pool = concurrent.futures.ThreadPoolExecutor(thread_count)
         self.thread_local = threading.local()
@@ -71,7 +87,11 @@ class AsyncThreadedService(Proxy):
         for thread_pool in self.thread_pools:
             thread_pool.shutdown()
 
-    async def execute(self, df, tasks, progress=None):
+    async def execute(self, df, tasks, progress=None, client=None, priority=0, on_start=None):
+        if on_start:
+            on_start()
+        tasks = list(tasks)
+
         def execute():
             if not hasattr(self.thread_local, "executor"):
                 logger.debug("creating thread pool and executor")
@@ -93,3 +113,375 @@ class AsyncThreadedService(Proxy):
 
         loop = asyncio.get_event_loop()
         return await loop.run_in_executor(self.thread_pool, execute)
+
+
+def _result_size(result):
+    if isinstance(result, (list, tuple)):
+        return sum(_result_size(k) for k in result)
+    nbytes = getattr(result, 'nbytes', None)
+    return nbytes if nbytes is not None else sys.getsizeof(result)
+
+
+class _Shared:
+    '''A task that is shared by all requests with the same fingerprint'''
+    def __init__(self, task, key):
+        self.task = task
+        self.key = key
+        self.waiters = []  # (task of the request, future)
+
+
+class _Pass:
+    def __init__(self, df, client, priority):
+        self.df = df
+        self.client = client
+        self.priority = priority
+        self.shared = []
+        self.tasks = []  # can grow until the pass starts
+        self.progress_listeners = []
+        self.on_progress = None
+
+    def progress(self, fraction):
+        if self.on_progress:
+            self.on_progress()
+        for listener in list(self.progress_listeners):
+            listener(fraction)
+        return True
+
+
+class CoalescingService(Proxy):
+    '''Shares the work of the requests of all clients
+
+    A task that is already queued or executing (with the same fingerprint) is not executed again, and the
+    results of earlier tasks are served from an LRU cache. A pass over the data is handed to the underlying
+    service right away, and tasks on the same data that come in before that pass has started (e.g. while it
+    waits for a thread) are added to it. Tasks that come in later go into a new pass, which can run at the
+    same time. Each pass goes to the underlying service (e.g. the FairShareService) with the priority of its
+    requests, and a task is only shared with a pass of the same or a higher priority, so a request never
+    waits in the queue of a lower priority.
+
+    The service executes its own copy of a task that is shared, so a client that cancels its request (by
+    cancelling its tasks) only stops waiting for it. The shared task is only cancelled when all requests
+    that wait for it are cancelled.
+
+    Should only be used from the thread that runs the event loop.
+    '''
+    def __init__(self, service, cache_size=None):
+        super().__init__(service)
+        if cache_size is None:
+            cache_size = vaex.settings.main.server.result_cache_size
+        if isinstance(cache_size, str):
+            from dask.utils import parse_bytes
+            cache_size = parse_bytes(cache_size)
+        self.cache = cachetools.LRUCache(cache_size, getsizeof=_result_size) if cache_size else None
+        self._shared = {}  # fingerprint -> _Shared for tasks that are queued or executing
+        self._pending = {}  # (data key, priority) -> pass that has not started yet
+        self._passes = set()  # passes that are not finished
+
+    def _key(self, task):
+        if not task.cacheable:
+            return None
+        try:
+            return task.fingerprint()
+        except Exception:  # we can always execute it
+            logger.exception("cannot compute fingerprint for %r", task)
+            return None
+
+    def _data_key(self, df):
+        return df.dataset.fingerprint, df._index_start, df._index_end
+
+    def _copy(self, task):
+        encoding = vaex.encoding.Encoding()
+        return encoding.decode('task', encoding.encode('task', task), df=task.df)
+
+    async def execute(self, df, tasks, progress=None, client=None, priority=0):
+        loop = asyncio.get_event_loop()
+        futures = []
+        pass_key = self._data_key(df), priority
+        for task in tasks:
+            key = self._key(task)
+            future = loop.create_future()
+            if key is not None and self.cache is not None and key in self.cache:
+                logger.debug("task result from cache: %r", key)
+                future.set_result(self.cache[key])
+            elif key is not None and key in self._shared and self._shared[key].pass_.priority >= priority:
+                logger.debug("task already queued or executing: %r", key)
+                shared = self._shared[key]
+                shared.waiters.append((task, future))
+                if progress and progress not in shared.pass_.progress_listeners:
+                    shared.pass_.progress_listeners.append(progress)
+            else:
+                if pass_key not in self._pending:
+                    # the pass is scheduled for the client that came first
+                    pass_ = self._pending[pass_key] = _Pass(df, client, priority)
+                    pass_.on_progress = lambda: loop.call_soon_threadsafe(self._detach_cancelled)
+                    self._passes.add(pass_)
+                    asyncio.ensure_future(self._execute_pass(pass_key, pass_))
+                pass_ = self._pending[pass_key]
+                if key is not None:
+                    try:
+                        shared = _Shared(self._copy(task), key)
+                    except Exception:  # we can always execute it, but not share it
+                        logger.exception("cannot copy %r", task)
+                        shared = _Shared(task, key=None)
+                else:
+                    shared = _Shared(task, key)
+                shared.pass_ = pass_
+                shared.waiters.append((task, future))
+                pass_.shared.append(shared)
+                pass_.tasks.append(shared.task)
+                if progress and progress not in pass_.progress_listeners:
+                    pass_.progress_listeners.append(progress)
+                if shared.key is not None:
+                    self._shared[key] = shared
+            futures.append(future)
+        return await asyncio.gather(*futures)
+
+    def _detach_cancelled(self):
+        # called at each progress update, and before a pass starts
+        for pass_ in self._passes:
+            for shared in pass_.shared:
+                if shared.key is None or shared.task.cancelled:
+                    continue
+                for waiter in list(shared.waiters):
+                    task, future = waiter
+                    if task.cancelled or future.done():
+                        shared.waiters.remove(waiter)
+                        if not future.done():
+                            future.set_exception(vaex.execution.UserAbort("Task was cancelled"))
+                if not shared.waiters:
+                    logger.debug("all requests cancelled, cancelling task: %r", shared.key)
+                    shared.task.cancel()
+                    if self._shared.get(shared.key) is shared:
+                        del self._shared[shared.key]
+
+    def _start(self, pass_key, pass_):
+        # from now on, new tasks go into a new pass
+        if self._pending.get(pass_key) is pass_:
+            del self._pending[pass_key]
+        self._detach_cancelled()
+        logger.debug("executing %d tasks in a single pass", len(pass_.tasks))
+
+    async def _execute_pass(self, pass_key, pass_):
+        error = None
+        try:
+            await self.service.execute(pass_.df, pass_.tasks, progress=pass_.progress, client=pass_.client, priority=pass_.priority,
+                                       on_start=lambda: self._start(pass_key, pass_))
+        except Exception as e:
+            error = e  # not all tasks might have failed
+        finally:
+            if self._pending.get(pass_key) is pass_:
+                del self._pending[pass_key]
+            self._passes.discard(pass_)
+        for shared in pass_.shared:
+            if shared.key is not None and self._shared.get(shared.key) is shared:
+                del self._shared[shared.key]
+            task = shared.task
+            if task.isFulfilled:
+                result = task.get()
+                if shared.key is not None and self.cache is not None:
+                    try:
+                        self.cache[shared.key] = result
+                    except ValueError:
+                        pass  # too large for the cache
+                for _, future in shared.waiters:
+                    if not future.done():
+                        future.set_result(result)
+            else:
+                exception = error or RuntimeError(f'Task {task} was not executed')
+                if task.isRejected:
+                    try:
+                        task.get()
+                    except Exception as e:
+                        exception = e
+                for _, future in shared.waiters:
+                    if not future.done():
+                        future.set_exception(exception)
+
+
+class _Job:
+    def __init__(self, df, client, priority):
+        self.df = df
+        self.client = client
+        self.priority = priority
+        self.created = time.time()
+        self.started = None  # when it got an executor thread
+        self.slice_start = None  # when the current time slice started
+        self.tick = None  # until when the compute time is accounted
+        self.resume = threading.Event()
+        self.admitted = None  # future that is set when the job may start
+        self.error = None
+
+
+class FairShareService(Proxy):
+    '''Decides which job (an execute request) may compute, with a queue per priority and client
+
+    Jobs with a higher priority go first, and between clients with the same priority, the client that
+    used the least compute time of all clients with pending jobs goes first. At most `concurrent_jobs`
+    jobs compute at the same time, by default as many as the underlying service has threads (`max_jobs`).
+
+    A job that has computed longer than `time_slice` seconds is paused at a chunk boundary (in the
+    progress callback of the executor) when a job with the same or a higher priority is waiting (a
+    higher priority does not wait for the time slice), and resumed later. A paused job keeps its
+    executor thread, so new jobs only preempt a running job when the underlying service has a thread
+    available for them. Give the underlying service more threads than `concurrent_jobs` (the servers
+    use one extra thread) to keep a thread free that is only used when a job preempts another.
+
+    When `memory_limit` is set, a job whose task parts use more memory (see TaskPart.memory_usage) is
+    cancelled with a MemoryError.
+    '''
+    def __init__(self, service, concurrent_jobs=None, time_slice=None, memory_limit=None, max_jobs=None):
+        super().__init__(service)
+        settings = vaex.settings.main.server
+        self.max_jobs = max_jobs or getattr(service, 'thread_count', 1)
+        self.concurrent_jobs = concurrent_jobs or settings.concurrent_jobs or self.max_jobs
+        self.time_slice = time_slice if time_slice is not None else settings.time_slice
+        memory_limit = memory_limit or settings.job_memory_limit
+        if isinstance(memory_limit, str):
+            from dask.utils import parse_bytes
+            memory_limit = parse_bytes(memory_limit)
+        self.memory_limit = memory_limit
+        self.lock = threading.Lock()
+        self._queues = collections.defaultdict(lambda: collections.defaultdict(collections.deque))  # priority -> client -> jobs
+        self._active = set()
+        self._started = 0  # jobs that have an executor thread (active or paused)
+        self._usage = collections.defaultdict(float)  # client -> seconds of compute time
+        self._latencies = collections.deque(maxlen=1000)  # (wait, latency) of the last jobs
+        self._counters = collections.Counter()
+
+    def stop(self):
+        with self.lock:
+            for job in self._all_queued():
+                job.resume.set()
+        super().stop()
+
+    def _all_queued(self):
+        return [job for clients in self._queues.values() for jobs in clients.values() for job in jobs]
+
+    def _pending_clients(self):
+        return set(job.client for job in self._all_queued()) | set(job.client for job in self._active)
+
+    def _startable(self, job):
+        return job.started is not None or self._started < self.max_jobs
+
+    def _pick(self, priority_min=None):
+        # the job with the highest priority, of the client that used least compute time
+        for priority in sorted(self._queues, reverse=True):
+            if priority_min is not None and priority < priority_min:
+                break
+            candidates = [jobs[0] for jobs in self._queues[priority].values() if jobs and self._startable(jobs[0])]
+            if candidates:
+                return min(candidates, key=lambda job: self._usage[job.client])
+        return None
+
+    def _remove(self, job):
+        jobs = self._queues[job.priority][job.client]
+        if job in jobs:
+            jobs.remove(job)
+        if not jobs:
+            del self._queues[job.priority][job.client]
+            if not self._queues[job.priority]:
+                del self._queues[job.priority]
+
+    def _schedule(self):
+        while len(self._active) < self.concurrent_jobs:
+            job = self._pick()
+            if job is None:
+                break
+            self._remove(job)
+            self._active.add(job)
+            job.slice_start = job.tick = time.time()
+            if job.started is None:
+                job.started = job.slice_start
+                self._started += 1
+                job.admitted.get_loop().call_soon_threadsafe(lambda future=job.admitted: future.done() or future.set_result(None))
+            else:
+                job.resume.set()
+
+    def _forget_idle_clients(self):
+        # fair share is between clients with pending jobs, a client that starts again starts at 0
+        for client in set(self._usage) - self._pending_clients():
+            del self._usage[client]
+
+    def _progress(self, job, fraction):
+        # called from the thread that executes the job, at a chunk boundary
+        with self.lock:
+            now = time.time()
+            if job in self._active:
+                self._usage[job.client] += now - job.tick
+                job.tick = now
+            if self.memory_limit and hasattr(job.df.executor, 'memory_usage'):
+                memory_usage = job.df.executor.memory_usage()
+                if memory_usage > self.memory_limit:
+                    job.error = MemoryError(f'Job uses {vaex.utils.filesize_format(memory_usage)}, which is more than the limit of {vaex.utils.filesize_format(self.memory_limit)}')
+                    self._counters['memory_aborts'] += 1
+                    job.df.executor.cancel_run(job.error)
+                    return False
+            preempt = False
+            if job in self._active:
+                other = self._pick(priority_min=job.priority)
+                if other is not None and (other.priority > job.priority or now - job.slice_start >= self.time_slice):
+                    preempt = True
+            if preempt:
+                logger.debug("pausing job of client %r", job.client)
+                self._counters['preemptions'] += 1
+                self._active.remove(job)
+                job.resume.clear()
+                self._queues[job.priority][job.client].append(job)
+                self._schedule()
+        if preempt:
+            job.resume.wait()
+        return True
+
+    async def execute(self, df, tasks, progress=None, client=None, priority=0, on_start=None):
+        job = _Job(df, client, priority)
+        job.admitted = asyncio.get_event_loop().create_future()
+
+        def progress_job(fraction):
+            ok = self._progress(job, fraction)
+            if progress:
+                ok = progress(fraction) is not False and ok
+            return ok
+        try:
+            with self.lock:
+                self._queues[priority][client].append(job)
+                self._schedule()
+            await job.admitted
+            try:
+                return await self.service.execute(df, tasks, progress=progress_job, client=client, priority=priority, on_start=on_start)
+            except vaex.execution.UserAbort:
+                if job.error is not None:
+                    raise job.error
+                raise
+        finally:
+            with self.lock:
+                if job in self._active:
+                    self._usage[client] += time.time() - job.tick
+                if job.started is not None:
+                    self._started -= 1
+                    self._latencies.append((job.started - job.created, time.time() - job.created))
+                    self._counters['completed'] += 1
+                self._active.discard(job)
+                self._remove(job)
+                self._schedule()
+                self._forget_idle_clients()
+
+    def metrics(self):
+        def summary(values):
+            if not values:
+                return {'mean': None, 'p50': None, 'p95': None, 'max': None}
+            values = np.array(values)
+            return {'mean': values.mean(), 'p50': np.percentile(values, 50), 'p95': np.percentile(values, 95), 'max': values.max()}
+        with self.lock:
+            queued = self._all_queued()
+            waits, latencies = zip(*self._latencies) if self._latencies else ((), ())
+            return {
+                **self.service.metrics(),
+                'queued': sum(job.started is None for job in queued),
+                'queued_per_priority': {priority: sum(len(jobs) for jobs in clients.values()) for priority, clients in self._queues.items()},
+                'running': len(self._active),
+                'paused': sum(job.started is not None for job in queued),
+                'usage_per_client': {str(client): usage for client, usage in self._usage.items()},
+                'wait': summary(waits),
+                'latency': summary(latencies),
+                **self._counters,
+            }
@@ -1,5 +1,5 @@
 
-from typing import Dict
+from typing import Dict, Optional
 from pydantic import Field
 import pydantic
 import vaex.config
@@ -13,6 +13,14 @@ class Settings(BaseSettings):
     # vaex_config: dict = None
     graphql: bool = Field(False, title="Add graphql endpoint")
     files: Dict[str, str] = Field(default_factory=dict, title="Mapping of name to path")
+    compression: Optional[str] = Field(None, title="Compress the binary data of results send over the websocket with this codec ('lz4' or 'zstd') when the client supports it")
+    coalesce: bool = Field(True, title="Compute tasks with the same fingerprint only once for all clients, and execute tasks of different clients on the same data in a single pass")
+    result_cache_size: str = Field('256MB', title="Maximum size of the LRU cache of task results shared by all clients (e.g. 1GB, 256MB), 0 disables the cache. Only used when coalesce is enabled")
+    fair_share: bool = Field(True, title="Schedule jobs with a queue per priority and client, and pause long running jobs at chunk boundaries when other jobs are waiting")
+    concurrent_jobs: Optional[int] = Field(None, title="Number of jobs that compute at the same time when fair_share is enabled, defaults to the number of server threads. The server has one extra thread, which is only used by a job that preempts another")
+    time_slice: float = Field(0.5, title="Number of seconds a job computes before it is paused in favour of a waiting job with the same priority")
+    job_memory_limit: Optional[str] = Field(None, title="When set (e.g. 1GB, 500MB), jobs whose task parts (e.g. grids or hash maps) use more memory are cancelled with a MemoryError")
+    frame_size: Optional[str] = Field('8MB', title="Results larger than this (e.g. 8MB, 1MB) are streamed over the websocket in frames of this size when the client supports it, so memory use and latency stay bounded. Not framed when not set")
     class Config(vaex.config.ConfigDefault):
         env_file = '.env'
         env_file_encoding = 'utf-8'
@@ -4,6 +4,7 @@ import logging
 from urllib.parse import urlparse
 import uuid
 
+import pyarrow as pa
 import tornado.websocket
 
 import vaex
@@ -42,9 +43,11 @@ class ClientWebsocket(Client):
             msg_id = str(uuid.uuid4())
         self.msg_reply_futures[msg_id] = asyncio.Future()
         auth = {'token': self.token, 'token-trusted': self.token_trusted}
+        # the server may compress and stream the results when we tell it we support it
+        accept = {'compression': [codec for codec in ['lz4', 'zstd'] if pa.Codec.is_available(codec)], 'frames': True}
 
         msg_encoding = vaex.encoding.Encoding()
-        data = vaex.encoding.serialize({'msg_id': msg_id, 'msg': msg, 'auth': auth}, msg_encoding)
+        data = vaex.encoding.serialize({'msg_id': msg_id, 'msg': msg, 'auth': auth, 'accept': accept}, msg_encoding)
 
         self.websocket.write_message(data, binary=True)
         return msg_id
@@ -77,6 +80,10 @@ class ClientWebsocket(Client):
     def _on_websocket_message(self, websocket_msg):
         if websocket_msg is None:
             return
+        if vaex.encoding.frames.is_frame(websocket_msg):
+            websocket_msg = self._frames.add(websocket_msg)
+            if websocket_msg is None:
+                return  # wait for the rest of the frames
         logger.debug("websocket msg: %r", websocket_msg)
         try:
             encoding = vaex.encoding.Encoding()
@@ -105,6 +112,7 @@ class ClientWebsocket(Client):
             self.msg_reply_futures[msg_id].set_exception(e)
 
     async def connect_async(self):
+        self._frames = vaex.encoding.FrameAssembler()
         self.websocket = await tornado.websocket.websocket_connect(self._url, on_message_callback=self._on_websocket_message)
 
     def connect(self):
@@ -89,9 +89,15 @@ class WebServer(threading.Thread):
                 self.base_url = f'{self.address}:{self.port}'
 
         self.service_bare = vaex.server.service.Service({})
-        self.service_threaded = vaex.server.service.AsyncThreadedService(self.service_bare, self.webserver_thread_count,
+        fair_share = vaex.settings.main.server.fair_share
+        # with fair share, the extra thread is only used by a job that preempts another
+        self.service_threaded = vaex.server.service.AsyncThreadedService(self.service_bare, self.webserver_thread_count + (1 if fair_share else 0),
                                                                          self.threads_per_job)
         self.service = self.service_threaded
+        if fair_share:
+            self.service = vaex.server.service.FairShareService(self.service, concurrent_jobs=vaex.settings.main.server.concurrent_jobs or self.webserver_thread_count)
+        if vaex.settings.main.server.coalesce:
+            self.service = vaex.server.service.CoalescingService(self.service, cache_size=cache_byte_size)
         self.set_datasets(datasets)
         self.token = token
         self.token_trusted = token_trusted
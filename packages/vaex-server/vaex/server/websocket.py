@@ -1,5 +1,6 @@
 import asyncio
 import logging
+import uuid
 
 import vaex
 import vaex.asyncio
@@ -7,6 +8,7 @@ import vaex.core._version
 import vaex.server._version
 import vaex.server.dataframe
 
+import vaex.encoding
 from vaex.encoding import serialize, deserialize, Encoding
 from .utils import exception
 
@@ -24,6 +26,11 @@ class WebSocketHandler:
         self.trusted = False
         self._msg_id_to_tasks = {}
         self.tasks = []
+        # each connection is a client for fair share scheduling
+        self.client = str(uuid.uuid4())
+        # what the client supports, see _negotiate
+        self.compression = None
+        self.frame_size = None
 
     async def handle_message(self, websocket_msg):
         try:
@@ -45,6 +52,7 @@ class WebSocketHandler:
             websocket_msg = deserialize(websocket_msg, encoding)
             logger.debug("websocket message: %s", websocket_msg)
             msg_id, msg, auth = websocket_msg['msg_id'], websocket_msg['msg'], websocket_msg['auth']
+            self._negotiate(websocket_msg.get('accept', {}))
 
             token = auth['token']  # are we even allowed to execute?
             token_trusted = auth['token-trusted']  # do we trust arbitrary code execution?
@@ -85,6 +93,8 @@ class WebSocketHandler:
             elif command == 'versions':
                 result = {'vaex.core': vaex.core._version.__version_tuple__, 'vaex.server': vaex.server._version.__version_tuple__}
                 await self.write_json({'msg_id': msg_id, 'msg': {'result': result}})
+            elif command == 'metrics':
+                await self.write_json({'msg_id': msg_id, 'msg': {'result': self.service.metrics()}})
             elif command == 'execute':
                 df = self.service[msg['df']].copy()
                 df.state_set(msg['state'], use_active_range=True, trusted=trusted)
@@ -92,14 +102,14 @@ class WebSocketHandler:
                 self._msg_id_to_tasks[msg_id] = tasks  # keep a reference for cancelling
                 try:
                     # TODO: this assumes all tasks succeed, but we also support 1 failing
-                    results = await self.service.execute(df, tasks, progress=progress)
+                    results = await self.service.execute(df, tasks, progress=progress, client=self.client, priority=msg.get('priority', 0))
                 finally:
                     del self._msg_id_to_tasks[msg_id]
                 await asyncio.gather(*progress_futures)
                 # make sure the final progress value is send, and also old values are not send
                 last_progress = 1.0
                 await self.write_json({'msg_id': msg_id, 'msg': {'progress': 1.0}})
-                encoding = Encoding()
+                encoding = Encoding(compression=self.compression)
                 results = encoding.encode_list('vaex-task-result', results)
                 await self.write_json({'msg_id': msg_id, 'msg': {'result': results}}, encoding)
             elif command == 'cancel':
@@ -117,7 +127,7 @@ class WebSocketHandler:
                 if msg['method'] not in vaex.server.dataframe.allowed_method_names:
                     raise NotImplementedError("Method is not rmi invokable")
                 results = self.service._rmi(df, msg['method'], msg['args'], msg['kwargs'])
-                encoding = Encoding()
+                encoding = Encoding(compression=self.compression)
                 if msg['method'] == "_evaluate_implementation":
                     results = encoding.encode('vaex-evaluate-result', results)
                 else:
@@ -131,11 +141,26 @@ class WebSocketHandler:
             msg = exception(e)
             await self.write_json({'msg_id': msg_id, 'msg': msg})
 
+    def _negotiate(self, accept):
+        # old clients do not send what they accept, and get uncompressed and unframed messages
+        settings = vaex.settings.main.server
+        if settings.compression and settings.compression in accept.get('compression', []):
+            self.compression = settings.compression
+        if settings.frame_size and accept.get('frames'):
+            from dask.utils import parse_bytes
+            self.frame_size = parse_bytes(settings.frame_size)
+
     async def write_json(self, msg, encoding=None):
         encoding = encoding or Encoding()
         logger.debug("writing json: %r", msg)
         try:
-            return await self.send(serialize(msg, encoding))
+            if self.frame_size and sum(memoryview(k).nbytes for k in encoding.blobs.values()) > self.frame_size:
+                # awaiting each frame gives backpressure, we do not serialize faster than we can send
+                for frame in vaex.encoding.frames.serialize(msg, encoding, self.frame_size):
+                    await self.send(frame)
+            else:
+                # a websocket message is a single buffer, so this copies the blobs once
+                return await self.send(serialize(msg, encoding))
         except:  # noqa
             logger.exception('Failed to write: %s', msg)
 
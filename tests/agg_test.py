@@ -334,6 +334,80 @@ def test_nunique_filtered():
     assert items == [(0, 2), (1, 2)]
 
 
+def test_nunique_approx():
+    s = ['aap', 'aap', 'noot', 'mies', None, 'mies', 'kees', 'mies', 'aap']
+    x = [0,     0,     0,      0,      0,     1,      1,     1,      2]
+    df = vaex.from_arrays(x=x, s=s)
+    # small counts are exact
+    dfg = df.groupby(df.x, agg={'nunique': vaex.agg.nunique_approx(df.s)}, sort=True)
+    assert dfg.nunique.tolist() == [4, 2, 1]
+    dfg = df.groupby(df.x, agg={'nunique': vaex.agg.nunique_approx(df.s, dropmissing=True)}, sort=True)
+    assert dfg.nunique.tolist() == [3, 2, 1]
+
+    mapping = {'aap': 1.2, 'noot': 2.5, 'mies': 3.7, 'kees': 4.8, None: np.nan}
+    df = vaex.from_arrays(x=x, s=np.array([mapping[k] for k in s], dtype=np.float64))
+    dfg = df.groupby(df.x, agg={'nunique': vaex.agg.nunique_approx(df.s, dropnan=True)}, sort=True)
+    assert dfg.nunique.tolist() == [3, 2, 1]
+
+    x = np.arange(100_000) % 40_000
+    df = vaex.from_arrays(x=x, g=x % 2)
+    # the relative error is about 1.04/sqrt(2**precision)
+    assert df._agg(vaex.agg.nunique_approx('x', precision=10)) == pytest.approx(40_000, rel=5 * 1.04 / 2**5)
+    # without binning, the estimate is a scalar (not a 0d array)
+    assert isinstance(vaex.agg._hll_estimate(np.zeros(16, dtype=np.int8)), np.int64)
+    binner = df._binner_scalar('g', [-0.5, 1.5], 2)
+    assert df._agg(vaex.agg.nunique_approx('x', selection='x < 1000'), (binner,)).tolist() == pytest.approx([500, 500], rel=0.01)
+    with pytest.raises(ValueError):
+        vaex.agg.nunique_approx('x', precision=20)
+
+
+def test_quantile():
+    x = np.random.default_rng(42).pareto(1.5, 10_000) * 10 - 3
+    x = np.ma.array(x, mask=np.arange(len(x)) % 17 == 0)
+    g = np.arange(len(x)) % 3
+    df = vaex.from_arrays(x=x, g=g)
+    for q in [0, 0.01, 0.5, 0.99, 1]:
+        expected = np.quantile(x.compressed(), q, method='lower')
+        assert df._agg(vaex.agg.quantile('x', q)) == pytest.approx(expected, rel=0.01)
+
+    dfg = df.groupby('g', agg={'p10': vaex.agg.quantile('x', 0.1), 'p90': vaex.agg.quantile('x', 0.9, relative_accuracy=0.001)}, sort=True)
+    for k in range(3):
+        values = x[g == k].compressed()
+        assert dfg.p10.tolist()[k] == pytest.approx(np.quantile(values, 0.1, method='lower'), rel=0.01)
+        assert dfg.p90.tolist()[k] == pytest.approx(np.quantile(values, 0.9, method='lower'), rel=0.001)
+
+    binner = df._binner_scalar('g', [-0.5, 2.5], 3)
+    medians = df._agg(vaex.agg.quantile('x', selection='x > 0'), (binner,))
+    assert medians.tolist() == pytest.approx([np.median(x[(g == k) & (x > 0)].compressed()) for k in range(3)], rel=0.02)
+    assert np.isnan(df[df.x > 1e20]._agg(vaex.agg.quantile('x')))
+    with pytest.raises(ValueError):
+        vaex.agg.quantile('x', 1.5)
+
+
+def test_top_k():
+    s = ['aap', 'aap', 'noot', 'mies', None, 'mies', 'kees', 'mies', 'aap', 'mies']
+    x = [0,     0,     0,      0,      0,     1,      1,     1,      2,     2]
+    df = vaex.from_arrays(x=np.array(x), s=s)
+    assert df._agg(vaex.agg.top_k('s', 2)) == ['mies', 'aap']
+    dfg = df.groupby(df.x, agg={'top': vaex.agg.top_k(df.s, 1), 'top2': vaex.agg.top_k(df.s, 2, selection=df.s != 'mies')}, sort=True)
+    assert dfg.top.tolist()[:2] == [['aap'], ['mies']]
+    assert dfg.top2.tolist() == [['aap', 'noot'], ['kees'], ['aap']]
+    binner = df._binner_ordinal('x', 3)
+    top = df._agg(vaex.agg.top_k('s', 5), (binner,))
+    assert top[0] == ['aap', 'noot', 'mies', None]
+    top = df._agg(vaex.agg.top_k('s', 5, dropmissing=True), (binner,))
+    assert top[0] == ['aap', 'noot', 'mies']
+
+    # with a capacity smaller than the number of unique values, the heavy hitters are still found
+    x = np.arange(10_000) % 1000
+    x[::5] = 7
+    x[1::5] = 8
+    df = vaex.from_arrays(x=x, g=x % 2)
+    assert sorted(df._agg(vaex.agg.top_k('x', 2, capacity=10))) == [7, 8]
+    binner = df._binner_scalar('g', [-0.5, 1.5], 2)
+    assert df._agg(vaex.agg.top_k('x', 1, capacity=10), (binner,)).tolist() == [[8], [7]]
+
+
 def test_unique_missing_groupby():
     s = ['aap', 'aap', 'noot', 'mies', None, 'mies', 'kees', 'mies', 'aap']
     x = [0,     0,     0,      np.nan,      np.nan,     1,      1,     np.nan,      2]
@@ -3,6 +3,7 @@ import shutil
 import glob
 
 import numpy as np
+import pytest
 import pyarrow as pa
 import pyarrow.parquet as pq
 import pyarrow.dataset
@@ -94,3 +95,49 @@ def test_partitioning_write_directory():
     assert set(df.value.tolist()) == set(values)
     assert set(df.year.tolist()) == set(years)
     assert set(df.country.tolist()) == set(countries)
+
+
+def test_partitioning_write_single_pass(tmpdir):
+    x = np.arange(1000)
+    df = vaex.from_arrays(x=x, key=x % 7, name=np.array([f'n{k % 3}' for k in x]))
+    df = df[df.x >= 10]
+    # write from multiple threads
+    df.executor = vaex.execution.ExecutorLocal(vaex.multithreading.ThreadPoolIndex(4), chunk_size=100)
+    passes = df.executor.passes
+    # at most 2 open files, and buffers of 1000 bytes, so partitions are written to multiple files
+    df.export_partitioned(str(tmpdir / 'partitioned/{subdir}/{i}.parquet'), ['key', 'name'], max_open_files=2, memory_limit=2000)
+    assert df.executor.passes == passes + 1
+    assert len(glob.glob(str(tmpdir / 'partitioned/*/*'))) == 21
+    assert len(glob.glob(str(tmpdir / 'partitioned/*/*/*.parquet'))) > 21
+    dfp = vaex.open(str(tmpdir / 'partitioned'), partitioning='hive')
+    assert len(dfp) == 990
+    assert sorted(dfp.x.tolist()) == list(range(10, 1000))
+    assert dfp[dfp.x == 500].key.tolist() == [500 % 7]
+    assert dfp[dfp.x == 500]['name'].tolist() == ['n2']
+
+    dfp = vaex.open(glob.glob(str(tmpdir / 'partitioned/key=3/name=n1/*.parquet')))
+    assert sorted(dfp.x.tolist()) == [k for k in range(10, 1000) if k % 7 == 3 and k % 3 == 1]
+
+
+def test_partitioning_write_file_size_limit(tmpdir):
+    x = np.arange(1000)
+    df = vaex.from_arrays(x=x, key=x % 2)
+    df.export_partitioned(str(tmpdir / '{subdir}/{i}.hdf5'), ['key'], chunk_size=100, memory_limit=0, file_size_limit=800, parallel=False)
+    paths = glob.glob(str(tmpdir / 'key=1/*.hdf5'))
+    # each chunk has 50 rows for this key (400 bytes), so each file has 2 chunks
+    assert len(paths) == 5
+    dfp = vaex.open(paths)
+    assert sorted(dfp.x.tolist()) == list(range(1, 1000, 2))
+
+
+def test_partitioning_write_fixed_name(tmpdir):
+    x = np.arange(40_000)
+    df = vaex.from_arrays(x=x, key=x % 8)
+    # more partitions than open files, a fixed name should not be reopened (and overwritten)
+    df.export_partitioned(str(tmpdir / 'partitioned/{subdir}/fixed_name.parquet'), ['key'], chunk_size=500, max_open_files=2, memory_limit='4KB', parallel=False)
+    assert len(glob.glob(str(tmpdir / 'partitioned/*/fixed_name.parquet'))) == 8
+    dfp = vaex.open(str(tmpdir / 'partitioned'), partitioning='hive')
+    assert len(dfp) == len(x)
+    assert sorted(dfp.x.tolist()) == x.tolist()
+    with pytest.raises(ValueError, match='file_size_limit'):
+        df.export_partitioned(str(tmpdir / 'partitioned2/{subdir}/fixed_name.parquet'), ['key'], file_size_limit='1KB')
@@ -349,3 +349,35 @@ def test_value_counts():
         df.x.value_counts()
         assert vaex.cache._cache_miss == 2
         assert vaex.cache._cache_hit == 1
+
+
+def test_partial_concat():
+    x1 = np.arange(10.)
+    df1 = vaex.from_arrays(x=x1, g=np.arange(10) % 3)
+    df2 = vaex.from_arrays(x=np.arange(10, 20.), g=np.arange(10, 20) % 3)
+    df3 = vaex.from_arrays(x=np.arange(20, 25.), g=np.arange(20, 25) % 3)
+    df = vaex.concat([df1, df2])
+    with vaex.cache.memory_infinite(clear=True):
+        assert df.x.sum() == sum(range(20))
+        assert df.count(binby='g', limits=[0, 3], shape=3).tolist() == [7, 7, 6]
+        assert df.mean('x', binby='g', limits=[0, 3], shape=3).tolist() == [9, 10, 9.5]
+        assert df[df.x > 4].x.max() == 19
+        # we modify the data behind the back of vaex, to show the partial results are used
+        x1[:] = -1
+        dfa = vaex.concat([df1, df2, df3])
+        assert dfa.x.sum() == sum(range(25))
+        assert dfa.count(binby='g', limits=[0, 3], shape=3).tolist() == [9, 8, 8]
+        assert dfa.mean('x', binby='g', limits=[0, 3], shape=3).tolist() == [12, 11.5, 12.5]
+        assert dfa[dfa.x > 4].x.max() == 24
+        # aggregators we cannot combine (and other tasks) are always computed over all rows
+        assert dfa.x.nunique() == 16
+        assert dfa.groupby('g', agg={'first': vaex.agg.first('x', 'x')}, sort=True)['first'].tolist() == [-1, -1, -1]
+    x1[:] = np.arange(10.)
+    with vaex.cache.memory_infinite(clear=True):
+        vaex.settings.main.cache.partial = False
+        try:
+            df.x.sum()
+            x1[:] = -1
+            assert dfa.x.sum() == sum(range(10, 25)) - 10
+        finally:
+            vaex.settings.main.cache.partial = True
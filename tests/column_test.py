@@ -186,6 +186,45 @@ def test_column_indexed_some_masked():
     assert column[0:2].tolist() == [None, 1]
 
 
+def test_gather(monkeypatch):
+    indices = np.array([5000, 3, 5002, -1, 4, 3])
+    gather = vaex.column.Gather(indices, masked=True)
+    assert gather.sorted.tolist() == [0, 3, 3, 4, 5000, 5002]
+    assert gather.blocks(8) == [(0, 6)]
+    monkeypatch.setattr(vaex.column, 'GATHER_BLOCK_GAP', 80)
+    # rows that are far apart are read in separate blocks
+    assert gather.blocks(8) == [(0, 4), (4, 6)]
+    x = np.arange(10000)
+    for column in [x, pa.array(x), vaex.column.ColumnNumpyLike(x)]:
+        assert gather.take(column).tolist() == [5000, 3, 5002, None, 4, 3]
+    s = pa.array([str(k) for k in x])
+    assert vaex.column.Gather(indices[[0, 1, 2, 4]]).take(s).tolist() == ['5000', '3', '5002', '4']
+
+
+def test_gather_mmap(tmpdir):
+    x = np.arange(100_000)
+    df = vaex.from_arrays(x=x)
+    path = str(tmpdir / 'test.hdf5')
+    df.export_hdf5(path)
+    df = vaex.open(path)
+    assert vaex.column._mmap_of(df.columns['x']) is not None
+    dfs = df.shuffle(random_state=42)
+    assert isinstance(dfs.dataset, vaex.dataset.DatasetTake)
+    assert sorted(dfs.x.tolist()) == x.tolist()
+    assert dfs.sort('x').x.tolist() == x.tolist()
+    assert dfs.x.sum() == x.sum()
+
+
+def test_gather_parquet(tmpdir):
+    # reading parquet uses the io pool, gathering on that same pool used to deadlock
+    import pyarrow.parquet as pq
+    x = np.arange(20_000, dtype='f8')
+    path = str(tmpdir / 'test.parquet')
+    pq.write_table(pa.table({f'c{i}': x for i in range(8)}), path, row_group_size=1000)
+    df = vaex.open(path).shuffle()
+    assert df.sum([f'c{i}' for i in range(8)]).tolist() == [x.sum()] * 8
+
+
 @pytest.mark.skipif(pa.__version__.split(".")[0] == '1', reason="segfaults in arrow v1")
 @pytest.mark.parametrize("i1", list(range(0, 8)))
 @pytest.mark.parametrize("i2", list(range(0, 8)))
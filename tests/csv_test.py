@@ -147,3 +147,115 @@ def test_convert_options():
     df = vaex.from_csv_arrow(HERE / "data" / "small2.csv", convert_options=pyarrow.csv.ConvertOptions(column_types={'x': pyarrow.float64()}), lazy=True)
     assert df.x.dtype == float
     assert df.x.tolist() == [1, 3]
+
+
+@pytest.mark.skipif(vaex.utils.osname == 'windows',
+                    reason="windows lazy not supported due to line ending differences")
+def test_lazy_index(tmpdir, monkeypatch):
+    monkeypatch.setattr(vaex.settings.main.csv, 'path', str(tmpdir / 'index'))
+    x = np.arange(100)
+    path = str(tmpdir / 'test.csv')
+    vaex.from_arrays(x=x, s=[f'v{k}' for k in x]).export(path)
+    df = vaex.from_csv_arrow(path, chunk_size=100, newline_readahead=20, lazy=True, index=True)
+    assert df.x.sum() == x.sum()
+    assert len(list((tmpdir / 'index').listdir())) == 1
+
+    # opening again does not need a pass over the file
+    def fail(*args, **kwargs):
+        raise AssertionError('should use the index')
+    monkeypatch.setattr(vaex.csv, 'file_chunks_mmap', fail)
+    df = vaex.from_csv_arrow(path, chunk_size=100, newline_readahead=20, lazy=True, index=True)
+    assert df.dataset.row_count == 100
+    assert df.s.dtype == str
+    assert df.x.tolist() == x.tolist()
+    # and slices seek to the chunks they need
+    assert df[33:77].x.tolist() == x[33:77].tolist()
+    assert df[33:77].s.tolist() == [f'v{k}' for k in x[33:77]]
+
+
+def _write_bgzf(path, data, block_size=100):
+    import struct
+    import zlib
+    with open(path, 'wb') as f:
+        for i in list(range(0, len(data), block_size)) + [len(data)]:  # the last block is the empty EOF block
+            block = data[i:i + block_size]
+            compressor = zlib.compressobj(wbits=-15)
+            deflated = compressor.compress(block) + compressor.flush()
+            header = b'\x1f\x8b\x08\x04' + b'\x00' * 4 + b'\x00\xff' + struct.pack('<H', 6) + b'BC' + struct.pack('<HH', 2, 18 + len(deflated) + 8 - 1)
+            f.write(header + deflated + struct.pack('<II', zlib.crc32(block), len(block)))
+
+
+def _write_seekable_zstd(path, data, frame_size=100):
+    import struct
+    codec = pyarrow.Codec('zstd')
+    entries = []
+    with open(path, 'wb') as f:
+        for i in range(0, len(data), frame_size):
+            frame = codec.compress(data[i:i + frame_size], asbytes=True)
+            f.write(frame)
+            entries.append(struct.pack('<II', len(frame), len(data[i:i + frame_size])))
+        table = b''.join(entries) + struct.pack('<IBI', len(entries), 0, 0x8F92EAB1)
+        f.write(struct.pack('<II', 0x184D2A5E, len(table)) + table)
+
+
+@pytest.mark.skipif(vaex.utils.osname == 'windows',
+                    reason="windows lazy not supported due to line ending differences")
+@pytest.mark.parametrize("ext,writer", [('.csv.gz', _write_bgzf), ('.csv.zst', _write_seekable_zstd)])
+def test_lazy_block_compressed(tmpdir, ext, writer):
+    x = np.arange(100)
+    path_csv = str(tmpdir / 'test.csv')
+    vaex.from_arrays(x=x, s=[f'v{k}' for k in x]).export(path_csv)
+    path = str(tmpdir / 'test') + ext
+    with open(path_csv, 'rb') as f:
+        writer(path, f.read())
+
+    df = vaex.open(path)
+    assert isinstance(df.dataset, vaex.csv.DatasetCsvLazy)
+    df = vaex.from_csv_arrow(path, chunk_size=150, newline_readahead=50, lazy=True)
+    assert df.dataset._compressed.frame_count > 1
+    assert df.x.tolist() == x.tolist()
+    assert df.s.tolist() == [f'v{k}' for k in x]
+    assert df[33:77].x.tolist() == x[33:77].tolist()
+
+
+@pytest.mark.skipif(vaex.utils.osname == 'windows',
+                    reason="windows lazy not supported due to line ending differences")
+def test_lazy_block_compressed_index(tmpdir, monkeypatch):
+    monkeypatch.setattr(vaex.settings.main.csv, 'path', str(tmpdir / 'index'))
+    x = np.arange(100)
+    path_csv = str(tmpdir / 'test.csv')
+    vaex.from_arrays(x=x).export(path_csv)
+    path = str(tmpdir / 'test.csv.gz')
+    with open(path_csv, 'rb') as f:
+        _write_bgzf(path, f.read())
+
+    # the offsets of the frames are read once per file
+    opened = []
+    _open = vaex.file.compressed._open
+    def count(*args, **kwargs):
+        opened.append(args)
+        return _open(*args, **kwargs)
+    monkeypatch.setattr(vaex.file.compressed, '_open', count)
+    assert vaex.csv.DatasetCsvLazy.can_open(path)
+    df = vaex.from_csv_arrow(path, chunk_size=150, newline_readahead=50, lazy=True, index=True)
+    df = vaex.from_csv_arrow(path, chunk_size=150, newline_readahead=50, lazy=True)
+    assert len(opened) == 1
+
+    # and are stored in the index, so we do not need to read all block headers again
+    def fail(*args, **kwargs):
+        raise AssertionError('should use the index')
+    monkeypatch.setattr(vaex.file.compressed, '_open', fail)
+    monkeypatch.setattr(vaex.file.compressed, '_cache', type(vaex.file.compressed._cache)())
+    df = vaex.from_csv_arrow(path, chunk_size=150, newline_readahead=50, lazy=True, index=True)
+    assert df.dataset._compressed.frame_count > 1
+    assert df.x.tolist() == x.tolist()
+    assert df[33:77].x.tolist() == x[33:77].tolist()
+
+
+def test_lazy_compressed_not_seekable(tmpdir):
+    import gzip
+    path = str(tmpdir / 'test.csv.gz')
+    with open(path, 'wb') as f:
+        f.write(gzip.compress(b'x,y\n1,2\n3,4\n'))
+    with pytest.raises(NotImplementedError):
+        vaex.from_csv_arrow(path, lazy=True)
@@ -493,3 +493,33 @@ def test_cache(buffer_size):
         assert len(cache) == 4
         df.y.sum()
         assert len(cache) == 4
+
+
+def test_cache_blocks(tmpdir):
+    x = np.arange(10)
+    s = pa.array([str(k) for k in range(10)])
+    df = vaex.from_arrays(x=x, s=s, z=x * 2)
+    # a block of 5 rows of x takes 40 bytes, and ~30 for s, so at most 1 block fits into memory
+    cache = vaex.cache.ChunkCache(memory_size_limit=60, path=str(tmpdir))
+    ds = vaex.dataset.DatasetCached(df.dataset, ['x', 's'], cache, block_size=5)
+    for reverse in [False, True]:
+        chunks = list(ds.chunk_iterator(['x', 's', 'z'], chunk_size=3, reverse=reverse))
+        if reverse:
+            chunks = chunks[::-1]
+        assert [(i1, i2) for i1, i2, _ in chunks] == ([(0, 2), (2, 5), (5, 7), (7, 10)] if reverse else [(0, 3), (3, 6), (6, 9), (9, 10)])
+        assert sum([k['x'].tolist() for _, _, k in chunks], []) == x.tolist()
+        assert sum([k['s'].to_pylist() for _, _, k in chunks], []) == s.to_pylist()
+        assert sum([k['z'].tolist() for _, _, k in chunks], []) == (x * 2).tolist()
+    assert len(cache) == 4
+    assert cache.memory_size <= 60
+    assert cache.disk_size > 0
+    # spilled blocks are memory mapped
+    assert isinstance(cache[f'{ds.fingerprint}-x-0-5'], np.memmap)
+    assert cache[f'{ds.fingerprint}-s-0-5'].to_pylist() == s[:5].to_pylist()
+
+    # without disk, the least recently used blocks get dropped
+    cache = vaex.cache.ChunkCache(memory_size_limit=60)
+    ds = vaex.dataset.DatasetCached(df.dataset, ['x', 's'], cache, block_size=5)
+    values = [k['x'].tolist() for _, _, k in ds.chunk_iterator(['x', 's'], chunk_size=5)]
+    assert sum(values, []) == x.tolist()
+    assert list(cache) == [f'{ds.fingerprint}-s-5-10']
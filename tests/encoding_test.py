@@ -1,3 +1,4 @@
+import pytest
 import vaex.encoding
 import numpy as np
 import pyarrow as pa
@@ -113,3 +114,43 @@ def test_encoding_dtype():
     value = encoding.decode('dtype', data)
     assert value == dtype
     assert value.is_numpy
+
+
+@pytest.mark.parametrize("compression", ['lz4', 'zstd'])
+def test_encoding_compression(compression):
+    x = np.arange(10_000, dtype='f8')
+    s = pa.array(['vaex', 'is', 'fast'] * 1000)
+    encoding = vaex.encoding.Encoding(compression=compression)
+    data = {'x': encoding.encode('ndarray', x), 's': encoding.encode('arrow-array', s)}
+    wiredata = vaex.encoding.serialize(data, encoding)
+    assert len(wiredata) < x.nbytes
+    assert encoding.blob_compression
+
+    encoding = vaex.encoding.Encoding()
+    data = vaex.encoding.deserialize(wiredata, encoding)
+    assert np.all(encoding.decode('ndarray', data['x']) == x)
+    assert encoding.decode('arrow-array', data['s']).to_pylist() == s.to_pylist()
+
+
+def test_encoding_frames():
+    x = np.arange(10_000, dtype='f8')
+    encoding = vaex.encoding.Encoding()
+    data = encoding.encode('ndarray', x)
+    wiredata = vaex.encoding.serialize(data, encoding)
+    frames = list(vaex.encoding.frames.serialize(data, encoding, 1000))
+    assert len(frames) == (len(wiredata) + 999) // 1000
+    assert all(vaex.encoding.frames.is_frame(frame) for frame in frames)
+    assert not vaex.encoding.frames.is_frame(wiredata)
+
+    assembler = vaex.encoding.FrameAssembler()
+    # frames of another message can be interleaved
+    other = list(vaex.encoding.frames.serialize(data, encoding, 1000))
+    assert assembler.add(other[0]) is None
+    for frame in frames[:-1]:
+        assert assembler.add(frame) is None
+    message = assembler.add(frames[-1])
+    assert bytes(message) == wiredata
+
+    encoding = vaex.encoding.Encoding()
+    data = vaex.encoding.deserialize(message, encoding)
+    assert np.all(encoding.decode('ndarray', data) == x)
@@ -36,6 +36,30 @@ def test_evaluate_expression_once():
     assert calls == 1
 
 
+def test_evaluate_common_subexpression_once():
+    calls = 0
+    def add(a, b):
+        nonlocal calls
+        if len(a) > 1:  # skip dtype calls
+            calls += 1
+        return a + b
+    x = np.arange(5)
+    y = x**2
+    df = vaex.from_arrays(x=x, y=y)
+    df.add_function('add', add)
+    df['z'] = df.func.add(df.x, df.y) * 2
+    df['w'] = df.func.add(df.x, df.y) + 1
+    df.executor.passes = 0
+    df.z.sum(delay=True)
+    df.w.sum(delay=True)
+    calls = 0
+    df.execute()
+    assert df.executor.passes == 1
+    assert calls == 1
+    assert df.z.tolist() == ((x + y) * 2).tolist()
+    assert df.w.tolist() == (x + y + 1).tolist()
+
+
 def test_nested_use_of_executor():
     df = vaex.from_scalars(x=1, y=2)
     @vaex.delayed
@@ -131,6 +155,43 @@ def test_passes_mixed_filtering():
     assert result2.get() == 45
 
 
+def test_passes_shared_leafs(tmpdir):
+    path = str(tmpdir / 'test.hdf5')
+    x = np.arange(10.)
+    vaex.from_arrays(x=x, y=x**2).export_hdf5(path)
+    df = vaex.open(path)
+    df1 = df.copy()
+    df1['z'] = x * 3  # different dataset, but same leaf
+    df2 = df.copy()
+    df2.rename('x', 'a')
+    df3 = df1[df1.z > 10]
+    assert df1.dataset != df.dataset
+    assert df2.dataset != df.dataset
+
+    executor = df.executor
+    executor.passes = 0
+    result = df.sum('x', delay=True)
+    result1 = df1.sum('z', delay=True)
+    result2 = df2.sum('a + y', delay=True)
+    result3 = df3.count('x', delay=True)
+    df.execute()
+    assert executor.passes == 1
+    assert result.get() == 45
+    assert result1.get() == 45 * 3
+    assert result2.get() == 45 + (x**2).sum()
+    assert result3.get() == 6
+
+    vaex.settings.main.shared_pass = False
+    try:
+        executor.passes = 0
+        df.sum('x', delay=True)
+        df1.sum('z', delay=True)
+        df.execute()
+        assert executor.passes == 2
+    finally:
+        vaex.settings.main.shared_pass = True
+
+
 def test_multiple_tasks_different_columns_names():
     df1 = vaex.from_scalars(x=1, y=2)
     df2 = vaex.from_scalars(x=1, y=2)
@@ -358,6 +419,95 @@ def test_continue_next_task_after_cancel():
     assert result.isFulfilled
 
 
+def test_adaptive_chunks():
+    x = np.arange(10_000)
+    df = vaex.from_arrays(x=x)
+    df.executor = vaex.execution.ExecutorLocal(vaex.multithreading.ThreadPoolIndex(4), chunk_size_min=100, chunk_size_max=4000, adaptive=True)
+    pieces = []
+    def map(thread_index, i1, i2, selection_mask, blocks):
+        pieces.append((i1, i2))
+        return blocks[0].sum()
+    assert df.map_reduce(map, lambda a, b: a + b, ['x'], info=True) == x.sum()
+    pieces.sort()
+    # all rows are covered exactly once
+    assert [i1 for i1, i2 in pieces[1:]] == [i2 for i1, i2 in pieces[:-1]]
+    assert pieces[0][0] == 0 and pieces[-1][1] == len(x)
+    # the work gets more fine grained towards the end
+    assert pieces[-1][1] - pieces[-1][0] < pieces[0][1] - pieces[0][0]
+    assert len(df.executor.thread_utilization) == 4
+
+
+def test_chunk_scheduler_split():
+    scheduler = vaex.multithreading.ChunkScheduler(nthreads=2, row_count=1000, chunk_size=500, chunk_size_min=10, chunk_size_max=1000)
+    chunks = [(0, 1000, {'x': np.arange(1000)})]
+    pieces = [(i1, i2) for i1, i2, chunk in scheduler.split(iter(chunks))]
+    assert pieces[:3] == [(0, 500), (500, 750), (750, 875)]
+    assert pieces[-1][1] == 1000
+    # once we know how fast we are, we aim for the target duration
+    scheduler.record(0, 1000, 1.)
+    assert scheduler.piece_size(1000) == int(1000 * scheduler.duration)
+    assert scheduler.busy == [1., 0.]
+
+
+def test_tree_reduce():
+    pool = vaex.multithreading.ThreadPoolIndex(4)
+    for n in range(1, 10):
+        assert vaex.multithreading.tree_reduce(lambda a, b: a + b, [[k] for k in range(n)], pool) == list(range(n))
+    assert vaex.multithreading.tree_reduce(lambda a, b: a + b, [], pool) is None
+
+
+def test_parallel_reduce():
+    x = np.arange(20_000) % 101
+    df = vaex.from_arrays(x=x, y=x**2)
+    df.executor = vaex.execution.ExecutorLocal(vaex.multithreading.ThreadPoolIndex(4), chunk_size=1000)
+    counts = df.x.value_counts()
+    assert counts[0] == (x == 0).sum()
+    assert counts.sum() == len(x)
+    dfg = df.groupby('x', agg=['count', vaex.agg.sum('y'), vaex.agg.max('y')], sort=True)
+    assert dfg['count'].tolist() == np.bincount(x).tolist()
+    assert dfg['y_sum'].tolist() == np.bincount(x, weights=x**2).tolist()
+    assert dfg['y_max'].tolist() == (np.arange(101)**2).tolist()
+    values, codes = df.unique('x', return_inverse=True)
+    assert np.array(values)[codes].tolist() == x.tolist()
+
+
+def test_parallel_hash_map_merge():
+    x = np.arange(20_000, dtype='f8') % 1001
+    x[::7] = np.nan
+    mask = np.arange(len(x)) % 11 == 0
+    df = vaex.from_arrays(x=np.ma.array(x, mask=mask))
+    df.executor = vaex.execution.ExecutorLocal(vaex.multithreading.ThreadPoolIndex(4), chunk_size=1000)
+
+    def unique():
+        values = df.x.unique(dropna=False)
+        return sorted(str(k) for k in vaex.array_types.tolist(values))
+    # each thread fills its own hash map, which are merged per map
+    values = unique()
+    assert len(values) == len(np.unique(x[~mask & ~np.isnan(x)])) + 2  # plus nan and null
+    groupby_counts = df.groupby('x', agg='count', sort=True)['count'].tolist()
+    assert sum(groupby_counts) == len(x)
+    hash_map_per_thread = vaex.settings.main.groupby.hash_map_per_thread
+    try:
+        vaex.settings.main.groupby.hash_map_per_thread = False
+        assert unique() == values
+        assert df.groupby('x', agg='count', sort=True)['count'].tolist() == groupby_counts
+    finally:
+        vaex.settings.main.groupby.hash_map_per_thread = hash_map_per_thread
+
+
+def test_prefetch():
+    assert list(vaex.itertools.prefetch(iter(range(10)), 3)) == list(range(10))
+    def fail():
+        yield 1
+        raise ValueError('oops')
+    with pytest.raises(ValueError, match='oops'):
+        list(vaex.itertools.prefetch(fail()))
+    # stopping early should stop the background thread
+    values = vaex.itertools.prefetch(iter(range(1000)), 2)
+    assert next(values) == 0
+    values.close()
+
+
 @pytest.mark.skipif(not hasattr(contextlib, 'asynccontextmanager'), reason="Python 36 has no asynccontextmanager")
 @pytest.mark.asyncio
 async def test_auto_execute():
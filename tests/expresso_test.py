@@ -1,6 +1,8 @@
+import ast
+
 import pytest
 
-from vaex.expresso import parse_expression, node_to_string, simplify, translate, validate_expression
+from vaex.expresso import parse_expression, node_to_string, simplify, translate, validate_expression, eliminate_common_subexpressions
 import vaex
 
 
@@ -77,3 +79,12 @@ def test_validate():
 
 def test_unicode():
     validate_expression('实体 + 1', {'实体'})
+
+
+def test_common_subexpressions():
+    nodes, temporaries = eliminate_common_subexpressions(['sqrt(x**2 + y**2)', 'arctan2(y, x**2)', 'f(lambda x: x**2)'])
+    assert node_to_string(nodes['sqrt(x**2 + y**2)']) == 'sqrt((__cse_0 + (y ** 2)))'
+    assert node_to_string(nodes['arctan2(y, x**2)']) == 'arctan2(y, __cse_0)'
+    assert node_to_string(temporaries['__cse_0']) == '(x ** 2)'
+    # names inside the lambda refer to its arguments
+    assert 'lambda x: x ** 2' in ast.unparse(nodes['f(lambda x: x**2)'])
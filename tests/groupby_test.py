@@ -779,3 +779,51 @@ def test_groupby_int_overflow():
     df = vaex.from_arrays(x=x)
     gdf = df.groupby(['x'], assume_sparse=True, agg={'cnt': 'count'})
     assert set(gdf.x.tolist()) == set(x)
+
+
+def test_groupby_partitioned(df_factory):
+    x = np.arange(1000) % 37
+    s = [str(k % 11) for k in range(1000)]
+    df = df_factory(x=x, s=s, y=np.arange(1000.))
+    df['z'] = df.y * 2
+    df = df[df.y > 10]
+    agg = {'c': 'count', 'm': vaex.agg.mean('z'), 'f': vaex.agg.first('y', 'y'), 'n': vaex.agg.nunique('y', selection='y>500'), 'l': vaex.agg.list('y')}
+    dfg = df.groupby(['x', 's'], agg=agg, sort=True)
+    dfp = df.groupby(['x', 's'], agg=agg, sort=True, partitions=5)
+    assert dfp.column_names == dfg.column_names
+    for name in ['x', 's', 'c', 'm', 'f', 'n']:
+        assert dfp[name].tolist() == dfg[name].tolist()
+    assert [sorted(k) for k in dfp.l.tolist()] == [sorted(k) for k in dfg.l.tolist()]
+
+
+def test_groupby_partitioned_nullable_arrow(tmpdir):
+    # an integer chunk with missing values should hash the keys the same as chunks without missing values
+    import pyarrow.parquet as pq
+    k = pa.array([None] + [i % 50 for i in range(1, 10_000)], type=pa.int64())
+    path = str(tmpdir / 'test.parquet')
+    pq.write_table(pa.table({'k': k}), path, row_group_size=1000)
+    df = vaex.open(path)
+    df.executor.chunk_size = 1000
+    try:
+        dfg = df.groupby('k', agg='count', sort=True)
+        dfp = df.groupby('k', agg='count', sort=True, partitions=4)
+        assert len(dfg) == 51
+        assert dfp.k.tolist() == dfg.k.tolist()
+        assert dfp['count'].tolist() == dfg['count'].tolist()
+    finally:
+        df.executor.chunk_size = None
+
+
+def test_groupby_partitioned_auto():
+    df = vaex.from_arrays(x=np.arange(1000) % 100, y=np.arange(1000))
+    memory_limit = vaex.settings.main.groupby.memory_limit
+    vaex.settings.main.groupby.memory_limit = '1KB'
+    try:
+        assert isinstance(df.groupby('x', agg='sum').dataset, vaex.dataset.DatasetConcatenated)
+        dfg = df.groupby('x', agg='sum', sort=True)
+        assert dfg.x.tolist() == list(range(100))
+        assert dfg.y_sum.tolist() == [sum(range(k, 1000, 100)) for k in range(100)]
+        # fits in memory
+        assert not isinstance(df.groupby('x', agg='sum', partitions=False).dataset, vaex.dataset.DatasetConcatenated)
+    finally:
+        vaex.settings.main.groupby.memory_limit = memory_limit
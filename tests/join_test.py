@@ -486,3 +486,110 @@ def test_join_f_c_inner_none_fillna():
     assert df.w2.tolist() == [True, False]
     assert df.z1.tolist() == [-1.0, -2.0]
     assert df.z2.tolist() == [True, False]
+
+
+def test_join_persistent_index(tmpdir):
+    x = np.array([3, 1, 2, 1, np.nan, 5, 1])
+    right = vaex.from_arrays(id=np.ma.array(x, mask=[0, 0, 0, 0, 0, 1, 0]), y=np.arange(7))
+    left = vaex.from_arrays(id=np.array([1, 2, 4, np.nan, 0]), x=np.arange(5))
+    df_expected = left.join(right, on='id', allow_duplication=True, rsuffix='_r')
+    expected = sorted(zip(df_expected.x.tolist(), df_expected.y.tolist()), key=str)
+    path = vaex.settings.main.index.path
+    vaex.settings.main.index.path = str(tmpdir)
+    vaex.settings.main.index.persist = True
+    try:
+        for i in range(2):  # first creates, then loads the index
+            df = left.join(right, on='id', allow_duplication=True, rsuffix='_r')
+            assert sorted(zip(df.x.tolist(), df.y.tolist()), key=str) == expected
+            assert len(tmpdir.listdir()) == 1
+        index = vaex.hash.PersistentIndex.load(right, 'id')
+        assert isinstance(index.keys, np.memmap)
+        assert index.has_duplicates
+        assert index.map_index(np.array([1., 5., np.nan, 3.])).tolist() == [1, -1, 4, 0]
+    finally:
+        vaex.settings.main.index.persist = False
+        vaex.settings.main.index.path = path
+
+
+@pytest.mark.parametrize("how", ["left", "inner", "right"])
+@pytest.mark.parametrize("partitions", [1, 3])
+def test_join_partitioned(how, partitions):
+    executor = vaex.execution.ExecutorLocal(vaex.multithreading.ThreadPoolIndex(4))
+    s = np.array(['aap', 'noot', 'mies', None, 'kees', 'jet', 'wim'], dtype=object)
+    left = vaex.from_arrays(i=np.array([3, 1, 2, 6, 9, 4, 0]), f=np.array([1., 2., np.nan, -0., 5., 6., 7.]), s=s, x=np.arange(7))
+    right = vaex.from_arrays(i=np.ma.array([1, 2, 3, 4, 5], mask=[0, 0, 0, 0, 1]), f=np.array([0., 2., np.nan, 5., 9.]), s=['noot', 'aap', 'wim', 'zus', None], y=np.arange(5))
+    left.executor = executor
+    for on in ['i', 'f', 's']:
+        df_expected = left.join(right, on=on, how=how, rsuffix='_r', allow_duplication=True)
+        df = left.join(right, on=on, how=how, rsuffix='_r', allow_duplication=True, partitions=partitions)
+        assert sorted(zip(df.x.tolist(), df.y.tolist()), key=str) == sorted(zip(df_expected.x.tolist(), df_expected.y.tolist()), key=str)
+
+
+def test_join_partitioned_duplicates():
+    left = vaex.from_arrays(i=np.array([1, 2, 3, 4]), x=np.arange(4))
+    right = vaex.from_arrays(i=np.array([1, 2, 1, 4, 1]), y=np.arange(5))
+    with pytest.raises(ValueError, match='duplication'):
+        left.join(right, on='i', rsuffix='_r', partitions=2)
+    df_expected = left.join(right, on='i', rsuffix='_r', allow_duplication=True)
+    df = left.join(right, on='i', rsuffix='_r', allow_duplication=True, partitions=2)
+    assert sorted(zip(df.x.tolist(), df.y.tolist()), key=str) == sorted(zip(df_expected.x.tolist(), df_expected.y.tolist()), key=str)
+    assert len(df) == 6
+
+
+def test_join_partitioned_many():
+    # more partitions than files we may keep open, and buffers that are written multiple times
+    settings = vaex.settings.main.export_partitioned
+    max_open_files, memory_limit = settings.max_open_files, settings.memory_limit
+    settings.max_open_files = 4
+    settings.memory_limit = '1KB'
+    try:
+        left = vaex.from_arrays(i=np.arange(2000) % 700, x=np.arange(2000))
+        right = vaex.from_arrays(i=np.arange(600), y=np.arange(600))
+        with small_buffer(left, 300):
+            df = left.join(right, on='i', rsuffix='_r', partitions=520)
+            assert df.y.tolist() == [i if i < 600 else None for i in np.arange(2000) % 700]
+    finally:
+        settings.max_open_files = max_open_files
+        settings.memory_limit = memory_limit
+
+
+@pytest.mark.parametrize("how", ["left", "inner", "right"])
+def test_join_sort_merge(how):
+    executor = vaex.execution.ExecutorLocal(vaex.multithreading.ThreadPoolIndex(4))
+    left = vaex.from_arrays(i=np.ma.array([0, 1, 2, 3, 5, 6, 9, 10], mask=[0, 0, 0, 1, 0, 0, 0, 0]),
+                            f=np.array([-1., 0., 0.5, 1., 2., 3., 4., np.nan]),
+                            s=['aap', 'kees', 'mies', 'noot', None, 'wim', 'zus', 'zz'], x=np.arange(8))
+    right = vaex.from_arrays(i=np.ma.array([1, 2, 3, 6, 7, 9], mask=[0, 0, 0, 0, 1, 0]),
+                             f=np.array([0., 1., 2., 3., 3.5, np.nan]),
+                             s=['aap', 'mies', 'noot', None, 'wim', 'x'], y=np.arange(6))
+    left.executor = executor
+    for on in ['i', 'f', 's']:
+        df_expected = left.join(right, on=on, how=how, rsuffix='_r')
+        df = left.join(right, on=on, how=how, rsuffix='_r', sort_merge=True)
+        assert sorted(zip(df.x.tolist(), df.y.tolist()), key=str) == sorted(zip(df_expected.x.tolist(), df_expected.y.tolist()), key=str)
+
+
+def test_join_sort_merge_duplicates():
+    left = vaex.from_arrays(i=np.array([1, 2, 3, 4, 4]), x=np.arange(5))
+    right = vaex.from_arrays(i=np.array([0, 1, 1, 1, 2, 4, 4]), y=np.arange(7))
+    with pytest.raises(ValueError, match='duplication'):
+        left.join(right, on='i', rsuffix='_r', sort_merge=True)
+    with small_buffer(left, 2), small_buffer(right, 2):
+        df_expected = left.join(right, on='i', rsuffix='_r', allow_duplication=True)
+        df = left.join(right, on='i', rsuffix='_r', allow_duplication=True, sort_merge=True)
+    assert sorted(zip(df.x.tolist(), df.y.tolist()), key=str) == sorted(zip(df_expected.x.tolist(), df_expected.y.tolist()), key=str)
+    assert len(df) == 9
+
+
+def test_join_sort_merge_unsorted():
+    left = vaex.from_arrays(i=np.array([1, 2, 3]), x=np.arange(3))
+    right = vaex.from_arrays(i=np.array([2, 1, 3]), y=np.arange(3))
+    with pytest.raises(ValueError, match='not sorted'):
+        left.join(right, on='i', rsuffix='_r', sort_merge=True)
+    df = left.join(right, on='i', rsuffix='_r', sort_merge='auto')
+    assert df.y.tolist() == [1, 0, 2]
+    # the left should be sorted as well
+    with pytest.raises(ValueError, match="'i' of the DataFrame is not sorted"):
+        right.join(left, on='i', rsuffix='_r', sort_merge=True)
+    df = right.join(left, on='i', rsuffix='_r', sort_merge='auto')
+    assert df.x.tolist() == [1, 0, 2]
@@ -20,3 +20,39 @@ def test_materialize_dataset():
     df = vaex.from_scalars(x=1, __y=2)
     df = df.materialize()
     assert df.dataset.names == ['x', '__y']
+
+
+def test_materialize_persist(tmpdir):
+    path = vaex.settings.main.materialize.path
+    vaex.settings.main.materialize.path = str(tmpdir / 'materialized')
+    x = np.arange(10.)
+    vaex.from_arrays(x=x, s=[f'k{i}' for i in range(10)]).export(str(tmpdir / 'test.hdf5'))
+
+    def open():
+        df = vaex.open(str(tmpdir / 'test.hdf5'))
+        df['r'] = df.x**2
+        df['t'] = df.s + '!'
+        return df
+    try:
+        df = open()
+        df.materialize(['r', 't'], persist=True)
+        assert 'r' in df.virtual_columns
+        assert len((tmpdir / 'materialized').listdir()) == 2
+        # change the stored values, to see they are used
+        stored = np.load(str(tmpdir / 'materialized' / os.path.basename(vaex.materialized.path_for(df, 'r')) / 'data.npy'), mmap_mode='r+')
+        stored[:] = -stored
+        stored.flush()
+        df = open()
+        assert df.r.tolist() == (-x**2).tolist()
+        assert (df.r + 1).sum() == (1 - x**2).sum()
+        assert df[df.x > 7].r.tolist() == [-64, -81]
+        # also when the expression matches
+        assert df['x**2'].sum() == -(x**2).sum()
+        assert df.t.tolist()[:2] == ['k0!', 'k1!']
+        mapping, columns = vaex.materialized.lookup(df, ['t', 'r * 2'])
+        assert set(mapping) == {'r', 't'}
+        # not used for a different dataset
+        dfc = vaex.concat([df, df])
+        assert dfc.r.sum() == 2 * (x**2).sum()
+    finally:
+        vaex.settings.main.materialize.path = path
@@ -1,4 +1,8 @@
 import numpy as np
+import pytest
+
+import vaex
+from common import small_buffer
 
 
 def test_rolling_sum(df_factory):
@@ -26,3 +30,90 @@ def test_rolling_array(df_factory):
     df = df_factory(x=x, y=y)
     df = df.rolling(2, column='x', edge="right").array()
     assert df.x.tolist() == [[None, 0], [0, 1], [1, 2], [2, 3], [3, 4]]
+
+
+@pytest.mark.parametrize("kind", ['sum', 'mean', 'min', 'max', 'std', 'count', 'quantile'])
+@pytest.mark.parametrize("edge", ['right', 'left'])
+def test_rolling_aggregate(kind, edge):
+    x = np.array([0, 5, np.nan, 3, 1, 8, 2, 7, 7, 4, 9, 6.0])
+    x[9] = 4
+    df = vaex.from_arrays(x=np.ma.array(x, mask=[0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0]), i=np.arange(12) % 5)
+    dfp = df.to_pandas_df()
+    args = {'std': dict(ddof=1), 'quantile': dict(q=0.3)}.get(kind, {})
+    if edge == 'left':
+        expected = getattr(dfp[::-1].rolling(3, min_periods=1), kind)(**args)[::-1]
+    else:
+        expected = getattr(dfp.rolling(3, min_periods=1), kind)(**args)
+    # a window with a nan gives a nan in vaex, pandas ignores it
+    nan = np.convolve(np.isnan(x), np.ones(3), mode='full')[:12] if edge == 'right' else np.convolve(np.isnan(x), np.ones(3), mode='full')[2:]
+    with small_buffer(df, 2):
+        result = getattr(df.rolling(3, edge=edge), kind)(**args)
+        for name in ['x', 'i']:
+            values = np.ma.filled(result[name].values.astype('f8'), np.nan)
+            if name == 'x' and kind != 'count':
+                assert np.isnan(values[nan > 0]).all()
+                values, target = values[nan == 0], expected[name].values[nan == 0]
+            else:
+                target = expected[name].values
+            np.testing.assert_allclose(values, target)
+        # a slice streams from the start
+        assert result[3:9].i.tolist() == result.i.tolist()[3:9]
+
+
+def test_rolling_int_types():
+    df = vaex.from_arrays(x=np.array([3, 1, 2], dtype='i2'), b=np.array([True, False, True]))
+    assert df.rolling(2).min().x.tolist() == [3, 1, 1]
+    assert df.rolling(2).min().x.dtype == np.dtype('i2')
+    assert df.rolling(2).sum().b.tolist() == [1, 1, 1]
+    assert df.rolling(2, trim=True).max().x.tolist() == [3, 2]
+    assert df.rolling(2, fill_value=0, edge='left').mean().x.tolist() == [2, 1.5, 1]
+
+
+def test_rolling_time():
+    t = np.array([0, 1, 2, 5, 6, 6, 10, 30], dtype='datetime64[s]')
+    x = np.array([1, 2, 3, 4, 5, 6, 7, 8])
+    df = vaex.from_arrays(t=t, x=x)
+    dfp = df.to_pandas_df()
+    with small_buffer(df, 3):
+        for kind in ['sum', 'min', 'max', 'count']:
+            expected = getattr(dfp.rolling('5s', on='t').x, kind)()
+            assert getattr(df.rolling('5s', on='t'), kind)().x.tolist() == expected.tolist()
+        assert df.rolling(np.timedelta64(2, 's'), on='t').max().t.tolist() == df.t.tolist()
+    with pytest.raises(ValueError, match='sorted'):
+        vaex.from_arrays(t=t[::-1], x=x).rolling('5s', on='t').sum().x.tolist()
+
+
+def test_rolling_by():
+    g = ['a', 'b', 'a', 'a', None, 'b', 'a', None]
+    x = np.arange(8)
+    df = vaex.from_arrays(g=g, x=x)
+    with small_buffer(df, 3):
+        assert df.rolling(2, by='g').sum().x.tolist() == [0, 1, 2, 5, 4, 6, 9, 11]
+        assert df.rolling(2, by='g').sum().g.tolist() == g
+        t = np.array([0, 1, 1, 9, 9, 9, 10, 10], dtype='datetime64[s]')
+        df['t'] = t
+        assert df.rolling('2s', on='t', by='g').count().x.tolist() == [1, 1, 2, 1, 1, 1, 2, 2]
+
+
+def test_rolling_exact():
+    # windows of values that can be added exactly give exact results
+    x = np.array([0.5, 1, 1, 1e10, 0.25, 3, 1, 1, 1])
+    df = vaex.from_arrays(x=x, i=np.array([1, 1, 1, 2, 7, 1, 1, 1, 1]))
+    with small_buffer(df, 4):
+        assert df.rolling(3).sum().x.tolist() == [0.5, 1.5, 2.5, 1e10 + 2, 1e10 + 1.25, 1e10 + 3.25, 4.25, 5, 3]
+        assert df.rolling(3).mean().i.tolist() == [1, 1, 1, 4 / 3, 10 / 3, 10 / 3, 3, 1, 1]
+        assert df.rolling(2).mean().x.tolist()[-3:] == [2, 1, 1]
+
+
+def test_rolling_virtual():
+    df = vaex.from_arrays(x=np.arange(5), z=np.arange(5) * 10)
+    df['y'] = df.x * 2
+    df['w'] = df.y + df.z
+    df['v'] = df.z + 1
+    result = df.rolling(2, column='x').sum()
+    assert result.x.tolist() == [0, 1, 3, 5, 7]
+    # virtual columns that depend on the rolled column use the original values
+    assert result.y.tolist() == [0, 2, 4, 6, 8]
+    assert result.w.tolist() == [0, 12, 24, 36, 48]
+    assert result.v.tolist() == [1, 11, 21, 31, 41]
+    assert 'v' in result.virtual_columns
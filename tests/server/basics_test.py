@@ -1,5 +1,269 @@
+import asyncio
+import concurrent.futures
+import threading
+import time
+
+import numpy as np
+import pytest
+import vaex
+import vaex.execution
+import vaex.server.service
+import vaex.server.websocket
+
+
 def test_count_huge(client):
     # this catched a bug introduced in https://github.com/vaexio/vaex/pull/557
     # where remote dataframe calculations were cancelled
     df = client['huge']
     assert df.count() == len(df)
+
+
+def test_websocket_compression_and_frames(event_loop):
+    df = vaex.from_arrays(x=np.arange(10_000, dtype='f8'))
+    settings = vaex.settings.main.server
+    sent = []
+
+    async def send(data):
+        sent.append(data)
+    service = vaex.server.service.Service({'test': df})
+    handler = vaex.server.websocket.WebSocketHandler(send, service)
+    msg = {'command': 'call-dataframe', 'df': 'test', 'state': df.state_get(), 'method': '_evaluate_implementation',
+           'args': ['x'], 'kwargs': {'array_type': 'numpy'}}
+    auth = {'token': None, 'token-trusted': None}
+    accept = {'compression': ['zstd'], 'frames': True}
+    previous = settings.compression, settings.frame_size
+    try:
+        settings.compression, settings.frame_size = 'zstd', '1KB'
+        data = vaex.encoding.serialize({'msg_id': '1', 'msg': msg, 'auth': auth, 'accept': accept}, vaex.encoding.Encoding())
+        event_loop.run_until_complete(handler.handle_message(data))
+    finally:
+        settings.compression, settings.frame_size = previous
+    assert len(sent) > 1
+    assert all(vaex.encoding.frames.is_frame(frame) for frame in sent)
+    assembler = vaex.encoding.FrameAssembler()
+    messages = [assembler.add(frame) for frame in sent]
+    assert messages[:-1] == [None] * (len(sent) - 1)
+    encoding = vaex.encoding.Encoding()
+    reply = vaex.encoding.deserialize(messages[-1], encoding)
+    assert encoding.blob_compression
+    values = encoding.decode('vaex-evaluate-result', reply['msg']['result'])
+    assert values.tolist() == df.x.tolist()
+
+    # old clients do not accept anything
+    sent.clear()
+    handler = vaex.server.websocket.WebSocketHandler(send, service)
+    data = vaex.encoding.serialize({'msg_id': '2', 'msg': msg, 'auth': auth}, vaex.encoding.Encoding())
+    event_loop.run_until_complete(handler.handle_message(data))
+    assert len(sent) == 1
+    encoding = vaex.encoding.Encoding()
+    reply = vaex.encoding.deserialize(sent[0], encoding)
+    assert not encoding.blob_compression
+    assert encoding.decode('vaex-evaluate-result', reply['msg']['result']).tolist() == df.x.tolist()
+
+
+def test_coalescing_service(event_loop):
+    df = vaex.from_arrays(x=np.arange(1000, dtype='f8'))
+    calls = []
+
+    class CountingService(vaex.server.service.Service):
+        async def execute(self, df, tasks, progress=None):
+            calls.append(len(tasks))
+            return await super().execute(df, tasks, progress=progress)
+
+    def request(method, expression):
+        # like a client, each request has its own copy of the dataframe and its own tasks
+        df_client = df.copy()
+        df_client.executor = vaex.execution.Executor()
+        getattr(df_client, method)(expression, delay=True)
+        return service.execute(df_client, df_client.executor.tasks)
+
+    service_threaded = vaex.server.service.AsyncThreadedService(CountingService({'df': df}), 1, 2)
+    service = vaex.server.service.CoalescingService(service_threaded, cache_size='1MB')
+    try:
+        async def concurrent():
+            return await asyncio.gather(request('sum', 'x'), request('sum', 'x'), request('max', 'x'), request('count', 'x'))
+        assert event_loop.run_until_complete(concurrent()) == [[df.x.sum()], [df.x.sum()], [df.x.max()], [len(df)]]
+        # the same sum is computed once, and all tasks share a pass
+        assert calls == [3]
+        assert event_loop.run_until_complete(request('sum', 'x')) == [df.x.sum()]
+        assert calls == [3]
+        assert event_loop.run_until_complete(request('sum', 'x**2')) == [(df.x**2).sum()]
+        assert calls == [3, 1]
+    finally:
+        service.stop()
+
+
+def test_coalescing_service_concurrent_passes(event_loop):
+    df = vaex.from_arrays(x=np.arange(1000, dtype='f8'))
+    second_pass = threading.Event()
+    passes = []
+    waited = []
+
+    class BlockingService(vaex.server.service.Service):
+        async def execute(self, df, tasks, progress=None, client=None, priority=0):
+            passes.append(tasks)
+            if len(passes) == 1:
+                # the first pass only finishes when the second pass runs
+                waited.append(second_pass.wait(5))
+            else:
+                second_pass.set()
+            return await super().execute(df, tasks)
+
+    def request(expression):
+        df_client = df.copy()
+        df_client.executor = vaex.execution.Executor()
+        df_client.sum(expression, delay=True)
+        return service.execute(df_client, df_client.executor.tasks)
+
+    service_threaded = vaex.server.service.AsyncThreadedService(BlockingService({'df': df}), 2, 2)
+    service = vaex.server.service.CoalescingService(service_threaded, cache_size='1MB')
+
+    async def requests():
+        first = asyncio.ensure_future(request('x'))
+        await asyncio.sleep(0.1)
+        # the first pass has started, so this does not wait for it
+        return await asyncio.gather(first, request('x**2'))
+    try:
+        assert event_loop.run_until_complete(requests()) == [[df.x.sum()], [(df.x**2).sum()]]
+        assert waited == [True]
+    finally:
+        service.stop()
+
+
+def test_coalescing_service_priority(event_loop):
+    df = vaex.from_arrays(x=np.arange(1000, dtype='f8'))
+    passes = []
+
+    class RecordingService(vaex.server.service.Proxy):
+        async def execute(self, df, tasks, **kwargs):
+            passes.append((kwargs['priority'], len(tasks)))
+            return await self.service.execute(df, tasks, **kwargs)
+
+    def request(priority):
+        df_client = df.copy()
+        df_client.executor = vaex.execution.Executor()
+        df_client.sum('x', delay=True)
+        return service.execute(df_client, df_client.executor.tasks, priority=priority)
+
+    service_threaded = vaex.server.service.AsyncThreadedService(vaex.server.service.Service({'df': df}), 2, 2)
+    service = vaex.server.service.CoalescingService(RecordingService(service_threaded), cache_size=0)
+    try:
+        async def requests():
+            return await asyncio.gather(request(0), request(0), request(1))
+        assert event_loop.run_until_complete(requests()) == [[df.x.sum()]] * 3
+        # the request with a higher priority does not wait for the pass with a lower priority
+        assert sorted(passes) == [(0, 1), (1, 1)]
+    finally:
+        service.stop()
+
+
+def test_coalescing_service_cancel(event_loop):
+    df = vaex.from_arrays(x=np.arange(1000, dtype='f8'))
+    executor = df.executor
+    release = None
+
+    class WaitingService(vaex.server.service.Service):
+        async def execute(self, df, tasks, progress=None, client=None, priority=0, on_start=None):
+            await release.wait()
+            progress(0)  # cancelled requests are detached at a progress update
+            await asyncio.sleep(0)
+            df.executor = executor
+            return await super().execute(df, tasks, on_start=on_start)
+
+    service = vaex.server.service.CoalescingService(WaitingService({'df': df}), cache_size=0)
+
+    def request():
+        df_client = df.copy()
+        df_client.executor = vaex.execution.Executor()
+        df_client.sum('x', delay=True)
+        tasks = df_client.executor.tasks
+        return tasks, asyncio.ensure_future(service.execute(df_client, tasks))
+
+    async def requests(cancel):
+        nonlocal release
+        release = asyncio.Event()
+        requests = [request() for i in range(2)]
+        await asyncio.sleep(0)
+        for i in cancel:
+            for task in requests[i][0]:
+                task.cancel()
+        release.set()
+        return await asyncio.gather(*[future for tasks, future in requests], return_exceptions=True)
+
+    # a request that is cancelled does not cancel the shared task for the other request
+    first, second = event_loop.run_until_complete(requests(cancel=[0]))
+    assert isinstance(first, vaex.execution.UserAbort)
+    assert second == [df.x.sum()]
+    # but when all requests are cancelled, the shared task is cancelled
+    first, second = event_loop.run_until_complete(requests(cancel=[0, 1]))
+    assert isinstance(first, vaex.execution.UserAbort)
+    assert isinstance(second, vaex.execution.UserAbort)
+    assert service._shared == {}
+
+
+def test_fair_share_service(event_loop):
+    log = []
+    thread_pool = concurrent.futures.ThreadPoolExecutor(2)
+
+    class StepService(vaex.server.service.Service):
+        # executes 'tasks' steps, and calls progress after each step like the executor does after each chunk
+        async def execute(self, df, tasks, progress=None, client=None, priority=0, on_start=None):
+            def steps():
+                for i in range(tasks):
+                    time.sleep(0.01)
+                    log.append(client)
+                    if progress((i + 1) / tasks) is False:
+                        raise vaex.execution.UserAbort('cancelled')
+                return client
+            return await asyncio.get_event_loop().run_in_executor(thread_pool, steps)
+
+    service = vaex.server.service.FairShareService(StepService({}), concurrent_jobs=1, time_slice=0.05, max_jobs=2)
+
+    async def requests():
+        done = []
+        async def request(client, steps, priority=0, delay=0):
+            await asyncio.sleep(delay)
+            done.append(await service.execute(None, steps, client=client, priority=priority))
+        await asyncio.gather(request('long', 50), request('short', 3, delay=0.1))
+        return done
+    try:
+        # the long job is paused after its time slice, so the short job does not wait for it
+        assert event_loop.run_until_complete(requests()) == ['short', 'long']
+        assert log.count('long') == 50
+        metrics = service.metrics()
+        assert metrics['completed'] == 2
+        assert metrics['preemptions'] >= 1
+        assert metrics['queued'] == metrics['running'] == metrics['paused'] == 0
+        assert metrics['wait']['max'] < 0.5
+    finally:
+        service.stop()
+        thread_pool.shutdown()
+
+
+def test_fair_share_service_concurrent_jobs():
+    service_threaded = vaex.server.service.AsyncThreadedService(vaex.server.service.Service({}), 3, 2)
+    try:
+        # all threads compute, unless we leave one free for a job that preempts
+        assert vaex.server.service.FairShareService(service_threaded).concurrent_jobs == 3
+        assert vaex.server.service.FairShareService(service_threaded, concurrent_jobs=2).concurrent_jobs == 2
+    finally:
+        service_threaded.stop()
+
+
+def test_fair_share_service_memory_limit(event_loop):
+    df = vaex.from_arrays(x=np.arange(100_000, dtype='f8'))
+    service_threaded = vaex.server.service.AsyncThreadedService(vaex.server.service.Service({'df': df}), 2, 2)
+    service = vaex.server.service.FairShareService(service_threaded, memory_limit='1MB')
+
+    def request(**kwargs):
+        df_client = df.copy()
+        df_client.executor = vaex.execution.Executor()
+        df_client.count(binby='x', limits=[0, 1], delay=True, **kwargs)
+        return service.execute(df_client, df_client.executor.tasks)
+    try:
+        assert event_loop.run_until_complete(request(shape=10))[0].sum() == 1
+        with pytest.raises(MemoryError):
+            event_loop.run_until_complete(request(shape=1_000_000))
+        assert service.metrics()['memory_aborts'] == 1
+    finally:
+        service.stop()
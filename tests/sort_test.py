@@ -65,3 +65,44 @@ def test_sort_empty():
     assert len(dff) == 0
     dff_sorted = dff.sort(by='x')
     assert len(dff_sorted) == 0
+
+
+@pytest.mark.parametrize("ascending", [True, False])
+def test_sort_external(ascending):
+    x = np.random.RandomState(42).randint(0, 20, 100)
+    s = np.array([f'str{k % 7}' for k in range(100)], dtype=object)
+    s[::11] = None
+    df = vaex.from_arrays(x=x, s=s, i=np.arange(100))
+    with small_buffer(df, 13):
+        df_sorted = df.sort(['s', 'x'], ascending=ascending, memory_limit=100)
+        df_expected = df.sort(['s', 'x'], ascending=ascending)
+    assert df_sorted.i.tolist() == df_expected.i.tolist()
+
+
+def test_sort_external_filtered():
+    x = np.random.RandomState(42).random(100)
+    df = vaex.from_arrays(x=x)
+    dff = df[df.x > 0.5]
+    with small_buffer(dff, 7):
+        assert dff.sort('-x', memory_limit=64).x.tolist() == np.sort(x[x > 0.5])[::-1].tolist()
+
+
+def test_sort_external_runs(tmpdir):
+    x = np.random.RandomState(42).randint(0, 50, 1000)
+    df = vaex.from_arrays(x=x, i=np.arange(1000))
+    dff = df[df.x % 3 != 0]
+    sort_keys = [('key_0', 'ascending')]
+    with small_buffer(dff, 10):
+        # the size of a run is determined by the memory, not by the chunk size
+        runs = vaex.sort._write_runs(dff, ['x'], sort_keys, str(tmpdir), 2000, lambda *args: None)
+        assert sum(run.length for run in runs) == len(dff)
+        assert len(runs) < len(dff) // 10
+        for run in runs:
+            run.open()
+            values = run.table['key_0'].to_pylist()
+            assert values == sorted(values)
+        indices = np.concatenate([run.read(0, run.length)['__index'].to_numpy() for run in runs])
+        assert sorted(indices.tolist()) == list(range(len(dff)))
+        # equal keys keep their order
+        i = np.flatnonzero(x % 3 != 0)
+        assert dff.sort('x', memory_limit=2000).i.tolist() == i[np.argsort(x[i], kind='stable')].tolist()
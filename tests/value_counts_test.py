@@ -149,3 +149,21 @@ def test_value_counts_high_cardinality(high):
         df = vaex.from_arrays(x=x, s=s)
         assert df.x.value_counts().sum() == 100_000
         assert df.s.value_counts().sum() == 100_000
+
+
+def test_value_counts_limit(df_local):
+    df = df_local
+    expected = df.x.value_counts()
+    assert df.x.value_counts(limit=3).tolist() == expected.tolist()[:3]
+    assert df.x.value_counts(limit=3, ascending=True).tolist() == expected.tolist()[:3][::-1]
+    # the top values are found, even though the summary can not hold all values
+    x = np.arange(100_000) % 10_000
+    x[::10] = 42
+    s = [str(k) for k in x]
+    df = vaex.from_arrays(x=x, s=s)
+    counts = df.s.value_counts(limit=2)
+    assert counts.index.tolist()[0] == '42'
+    assert 10_000 - 100 <= counts.tolist()[0] <= 10_000 + 9
+    # lists fall back to the full count
+    df = vaex.from_arrays(l=pa.array([[1, 2], [2], [2, 3]]))
+    assert df.l.value_counts(limit=1).to_dict() == {2: 3}
@@ -0,0 +1,177 @@
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset
+import pyarrow.parquet as pq
+import pytest
+
+import vaex
+import vaex.zonemap
+
+
+@pytest.fixture
+def zone_settings():
+    size, bloom = vaex.settings.main.zonemap.size, vaex.settings.main.zonemap.bloom
+    vaex.settings.main.zonemap.size = 10
+    vaex.settings.main.zonemap.bloom = 16
+    try:
+        yield
+    finally:
+        vaex.settings.main.zonemap.size = size
+        vaex.settings.main.zonemap.bloom = bloom
+
+
+def test_zone_map_builder():
+    builder = vaex.zonemap.ZoneMapBuilder(25, 10, np.dtype('f8'))
+    builder.update(np.ma.array([3., 1, np.nan], mask=[0, 0, 1]))
+    builder.update(np.array([np.nan] * 7 + [5, 6, 2, 9, 8, 7]))
+    builder.update(np.full(9, np.nan))
+    zone_map = builder.finish()
+    assert zone_map.offsets.tolist() == [0, 10, 20, 25]
+    assert zone_map.min.tolist() == [1, 2, None]
+    assert zone_map.max.tolist() == [3, 9, None]
+    assert zone_map.null_count.tolist() == [1, 0, 0]
+    assert zone_map.count.tolist() == [2, 6, 0]
+    assert zone_map.may_match('>', 5).tolist() == [False, True, False]
+    assert zone_map.may_match('==', 1).tolist() == [True, False, False]
+    assert zone_map.slice(5, 22).offsets.tolist() == [0, 5, 15, 17]
+
+
+def test_zone_map_hdf5(tmpdir, zone_settings):
+    x = np.arange(100)
+    t = (x * 1000).astype('datetime64[s]')
+    f = np.ma.array(x * 2.0, mask=x % 7 == 0)
+    df = vaex.from_arrays(x=x, t=t, f=f, e=x * 2)
+    path = str(tmpdir / 'test.hdf5')
+    df.export_hdf5(path)
+    df = vaex.open(path)
+    zone_map = df.dataset.zone_map('x')
+    assert zone_map.min.tolist() == list(range(0, 100, 10))
+    assert zone_map.bloom.shape == (10, 16)
+    assert df.dataset.zone_map('f').null_count.tolist()[:2] == [2, 1]
+
+    dff = df[df.x > 85]
+    assert vaex.zonemap.read_ranges(df.dataset, [dff]) == [(80, 100)]
+    assert dff.x.tolist() == list(range(86, 100))
+    assert dff.x.sum() == sum(range(86, 100))
+    dff = df[(df.t < np.datetime64(15000, 's')) | (df.f >= 190)]
+    assert vaex.zonemap.read_ranges(df.dataset, [dff]) == [(0, 20), (90, 100)]
+    df_memory = vaex.from_arrays(x=x, t=t, f=f)
+    assert dff.x.tolist() == df_memory[(df_memory.t < np.datetime64(15000, 's')) | (df_memory.f >= 190)].x.tolist()
+    # the bloom filter knows 41 is not in the zone with 40 to 58
+    dff = df[df.e == 41]
+    assert vaex.zonemap.read_ranges(df.dataset, [dff]) == [(0, 10)]
+    assert len(dff) == 0
+    assert dff.x.tolist() == []
+    assert df[df.e == 42].x.tolist() == [21]
+
+
+def test_zone_map_datetime_resolution(tmpdir, zone_settings):
+    x = np.arange(100)
+    t = (x * 1000).astype('datetime64[s]')
+    path = str(tmpdir / 'test.hdf5')
+    vaex.from_arrays(x=x, t=t).export_hdf5(path)
+    df = vaex.open(path)
+    # the constants have a finer resolution than the column, and should not be truncated
+    dff = df[(df.t > np.datetime64(7500, 's')) & (df.t < np.datetime64(10000500, 'ms'))]
+    assert vaex.zonemap.read_ranges(df.dataset, [dff]) == [(0, 20)]
+    assert dff.x.tolist() == [8, 9, 10]
+    dff = df[df.t >= np.datetime64(-500, 'ms')]
+    assert dff.x.tolist() == x.tolist()
+    dff = df[df.t == np.datetime64(10000500, 'ms')]
+    assert dff.x.tolist() == []
+
+
+def test_zone_map_parquet(tmpdir):
+    x = np.arange(100)
+    table = pa.table({'x': x, 's': [f'{k:03}' for k in x], 't': pa.array((x * 1000).astype('datetime64[s]'))})
+    path = str(tmpdir / 'test.parquet')
+    pq.write_table(table, path, row_group_size=10)
+    df = vaex.open(path)
+    assert df.dataset.zone_map('x').max.tolist() == list(range(9, 100, 10))
+
+    dff = df[(df.x >= 33) & (df.x < 42)]
+    assert vaex.zonemap.read_ranges(df.dataset, [dff]) == [(30, 50)]
+    assert dff.x.tolist() == list(range(33, 42))
+    dff = df[df.s == '055']
+    assert vaex.zonemap.read_ranges(df.dataset, [dff]) == [(50, 60)]
+    assert dff.x.tolist() == [55]
+    dff = df[df.t > np.datetime64(97000, 's')]
+    assert dff.x.tolist() == [98, 99]
+    # the filtered length is also computed using the zone maps
+    assert len(df[df.x < 15]) == 15
+
+
+def test_pushdown_datetime(tmpdir):
+    t = np.datetime64('1960-01-01') + np.arange(10)
+    # units arrow does not know (days, minutes), without and with pushdown
+    df = vaex.from_arrays(x=np.arange(10), t=t)
+    assert df[df.t > np.datetime64('1960-01-05')].x.tolist() == [5, 6, 7, 8, 9]
+    assert df[df.t > np.datetime64('1960-01-05T00:01')].x.tolist() == [5, 6, 7, 8, 9]
+    path = str(tmpdir / 'test.parquet')
+    pq.write_table(pa.table({'x': np.arange(10), 't': t.astype('datetime64[s]')}), path, row_group_size=2)
+    df = vaex.open(path)
+    dff = df[df.t > np.datetime64('1960-01-05')]
+    assert vaex.zonemap.read_ranges(df.dataset, [dff]) == [(4, 10)]
+    assert dff.x.tolist() == [5, 6, 7, 8, 9]
+    assert df[df.t > np.datetime64('1960-01-05T00:01')].x.tolist() == [5, 6, 7, 8, 9]
+    assert df[df.t < np.datetime64('1960-01-01T00:00:00.000000000001')].x.tolist() == [0]
+
+
+def test_zone_map_not_used(tmpdir, zone_settings):
+    df = vaex.from_arrays(x=np.arange(100))
+    path = str(tmpdir / 'test.hdf5')
+    df.export_hdf5(path)
+    df = vaex.open(path)
+    dff = df[df.x > 85]
+    # not a comparison with a constant, or an or with an unknown part
+    assert vaex.zonemap.read_ranges(df.dataset, [df[df.x > df.x / 2]]) is None
+    assert vaex.zonemap.read_ranges(df.dataset, [df[(df.x > 85) | (df.x**2 < 10)]]) is None
+    # the second DataFrame needs all rows
+    assert vaex.zonemap.read_ranges(df.dataset, [dff, df]) is None
+    # selections see all (filtered) rows
+    assert dff.count(selection=dff.x > 90) == 9
+    vaex.settings.main.zonemap.enabled = False
+    try:
+        assert vaex.zonemap.read_ranges(df.dataset, [dff]) is None
+        assert dff.x.sum() == sum(range(86, 100))
+    finally:
+        vaex.settings.main.zonemap.enabled = True
+
+
+def test_pushdown_parquet_partitioned(tmpdir):
+    x = np.arange(100)
+    table = pa.table({'x': x, 'year': 2000 + x // 25, 's': [f'{k:03}' for k in x]})
+    path = str(tmpdir / 'partitioned')
+    pq.write_to_dataset(table, path, partition_cols=['year'], row_group_size=5)
+    df = vaex.open(path, partitioning='hive')
+    df_memory = vaex.from_arrow_table(table)
+
+    def check(df, df_memory, filter, expected):
+        assert vaex.zonemap.read_ranges(df.dataset, [df[filter(df)]]) == expected
+        dff = df[filter(df)]
+        dff_memory = df_memory[filter(df_memory)]
+        assert len(dff) == len(dff_memory)
+        assert sorted(dff.x.tolist()) == sorted(dff_memory.x.tolist())
+
+    # the fragments are the hive partitions, the row groups are pruned using the statistics
+    check(df, df_memory, lambda df: df.year == 2002, [(50, 75)])
+    check(df, df_memory, lambda df: (df.year >= 2001) & (df.x < 33), [(25, 35)])
+    check(df, df_memory, lambda df: df.year.isin([2000, 2003]), [(0, 25), (75, 100)])
+    check(df, df_memory, lambda df: (df.year == 2000) | (df.x > 97), [(0, 25), (95, 100)])
+    # isin on a normal column uses the zone maps
+    check(df, df_memory, lambda df: df.s.isin(['003', '042']), [(0, 5), (40, 45)])
+    # a part we cannot translate is ignored in an and
+    check(df, df_memory, lambda df: (df.year == 2001) & (df.x**2 > 100), [(25, 50)])
+    check(df, df_memory, lambda df: (df.year == 2001) | (df.x**2 > 100), None)
+
+    zone_match = df.dataset.pushdown(pyarrow.dataset.field('year') == 2003, ['year'])
+    assert zone_match.offsets.tolist() == list(range(0, 101, 5))
+    assert zone_match.match.tolist() == [False] * 15 + [True] * 5
+    assert df.dataset.pushdown(pyarrow.dataset.field('unknown') == 2003, ['unknown']) is None
+
+    df2 = vaex.concat([df, df])
+    assert vaex.zonemap.read_ranges(df2.dataset, [df2[df2.year == 2003]]) == [(75, 100), (175, 200)]
+    assert df2[df2.year == 2003].x.sum() == 2 * sum(range(75, 100))
+    df2 = df[10:60]
+    assert vaex.zonemap.read_ranges(df2.dataset, [df2[df2.year == 2001]]) == [(15, 40)]
+    assert df2[df2.year == 2001].x.tolist() == list(range(25, 50))